@@ -0,0 +1,39 @@
+# Packed series storage
+#
+# Measures the golden items in benchmarks/fixtures stored as they are and
+# with their series packed by nist_scraper.codec: BSON size, documents
+# decoded per second (unpacking included) and the size of every series
+# field. The items are checked to come back the same after a round trip.
+#
+#     python -m benchmarks.codec --repeat 2000
+#
+# The stored collection is measured with python -m nist_scraper.codec report
+
+import argparse
+import sys
+
+import bson
+
+from benchmarks.properties import load_items
+from nist_scraper import codec
+
+
+def main(args):
+    items = load_items()
+    for item in items:
+        if codec.unpack_document(codec.pack_document(item)) != item:
+            sys.exit("{} changed after a round trip".format(item["cas"]))
+
+    codec.print_report(codec.report(items, args.repeat))
+    for field in codec.SERIES:
+        plain = sum(len(bson.encode({field: item[field]})) for item in items if field in item)
+        packed = sum(
+            len(bson.encode({field: codec.pack(item[field])})) for item in items if field in item
+        )
+        print("  {:46} {:6} bytes, packed {:6}".format(field, plain, packed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=1000)
+    main(parser.parse_args())
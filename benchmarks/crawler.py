@@ -0,0 +1,183 @@
+# Cold versus warm crawler latency
+#
+# Crawls the substances in benchmarks/fixtures (synthetic pages, see
+# benchmarks/parser.py) the way crawl.json does, offline: the WebBook is replaced by a download handler serving the
+# fixtures (robots.txt is answered with a 404), optionally after a fixed
+# network latency.
+#
+#     cold  a new CrawlerRunner and Crawler per substance, as scrapyrt does
+#           for every request (settings, spider loader, middlewares,
+#           pipelines, robots.txt)
+#     warm  one WarmCrawler (nist_scraper/scrapyrt/warm.py) started once,
+#           every substance injected into its engine
+#
+# The items of both are checked against the golden files and the p50, p99
+# and mean latency of each are reported. The MongoPipeline and the HTTP
+# cache are disabled, and the rate limiter of webbook.nist.gov lets
+# everything through.
+#
+#     python -m benchmarks.crawler --requests 200
+#     python -m benchmarks.crawler --latency 50
+
+import argparse
+import sys
+import time
+
+from itemadapter import ItemAdapter
+from scrapy import signals
+from scrapy.crawler import CrawlerRunner
+from scrapy.http import HtmlResponse, Response
+from scrapy.utils.misc import load_object
+from twisted.internet import defer, reactor, task
+
+from scrapyrt.conf.spider_settings import get_project_settings, get_scrapyrt_settings
+from scrapyrt.core import ScrapyrtCrawler
+
+from benchmarks.parser import check_golden, fixture_cas, fixture_page, load_pages
+from nist_scraper.scrapyrt.warm import WarmCrawler
+from nist_scraper.upstream import Upstream, upstreams
+
+SPIDER = "webbook_nist"
+HANDLER = "benchmarks.crawler.FixtureDownloadHandler"
+
+
+class FixtureDownloadHandler:
+    # Answers the WebBook requests with the fixtures
+    lazy = False
+    corpus = {}
+    latency = 0.0
+
+    def __init__(self, settings, crawler=None):
+        pass
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings, crawler)
+
+    def download_request(self, request, spider):
+        return task.deferLater(reactor, self.latency, self.respond, request)
+
+    def respond(self, request):
+        if request.url.endswith("/robots.txt"):
+            return Response(request.url, status=404, request=request)
+
+        pages = self.corpus[request.url.split("ID=C")[1].split("&")[0]]
+        page = fixture_page(request)
+        body = pages[page]
+        if body is None and page == "all":
+            body = pages["main"]
+        if body is None:
+            return Response(request.url, status=404, request=request)
+        return HtmlResponse(request.url, body=body, request=request, encoding="utf-8")
+
+
+def settings():
+    custom = get_scrapyrt_settings(log_file=None)
+    custom.update(
+        {
+            "DOWNLOAD_HANDLERS": {
+                "https": HANDLER,
+                "http": HANDLER,
+            },
+            "HTTPCACHE_ENABLED": False,
+            "ITEM_PIPELINES": {},
+        }
+    )
+    return get_project_settings("nist_scraper.settings", custom_settings=custom)
+
+
+@defer.inlineCallbacks
+def cold_crawl(cas):
+    # What scrapyrt's CrawlManager does for every crawl.json request
+    items = []
+    runner = CrawlerRunner(settings())
+    spidercls = runner.spider_loader.load(SPIDER)
+    crawler = ScrapyrtCrawler(spidercls, runner.settings, start_requests=True)
+
+    # Signal receivers are weak references, this one lives until the crawl
+    # is over
+    def collect(item, response, spider):
+        items.append(item)
+
+    crawler.signals.connect(collect, signals.item_scraped)
+    yield runner.crawl(crawler, search_by="cas", cas=cas)
+    return items
+
+
+@defer.inlineCallbacks
+def warm_crawl(warm, cas):
+    result = yield warm.crawl("cas", cas)
+    return result["items"]
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(share * (len(values) - 1))))]
+
+
+@defer.inlineCallbacks
+def measure(name, crawl, corpus, requests):
+    latencies = []
+    ok = True
+    cas_list = list(corpus)
+    for number in range(requests):
+        cas = cas_list[number % len(cas_list)]
+        started = time.perf_counter()
+        items = yield crawl(cas)
+        latencies.append(time.perf_counter() - started)
+        if number < len(cas_list):
+            items = [ItemAdapter(item).asdict() for item in items]
+            if not check_golden(cas, items, False):
+                print("  ({})".format(name))
+                ok = False
+
+    print(
+        "  {:<5} p50 {:8.2f} ms  p99 {:8.2f} ms  mean {:8.2f} ms".format(
+            name,
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.99) * 1000,
+            sum(latencies) / len(latencies) * 1000,
+        )
+    )
+    return ok
+
+
+@defer.inlineCallbacks
+def main(_, args):
+    corpus = dict((cas, load_pages(cas)) for cas in fixture_cas())
+    # The class Scrapy loads, not the one of __main__
+    handler = load_object(HANDLER)
+    handler.corpus = corpus
+    handler.latency = args.latency / 1000
+    # The fixtures are not rate limited, the crawlers are measured
+    upstreams["webbook.nist.gov"] = Upstream("webbook.nist.gov", rate=1e6, burst=1e6)
+
+    print(
+        "{} crawls over {} substances, {:.0f} ms network latency".format(
+            args.requests, len(corpus), args.latency
+        )
+    )
+    cold_ok = yield measure("cold", cold_crawl, corpus, args.requests)
+
+    started = time.perf_counter()
+    warm = WarmCrawler(SPIDER, settings=settings())
+    yield warm.start()
+    print("  warm crawler started in {:.2f} ms".format((time.perf_counter() - started) * 1000))
+    warm_ok = yield measure(
+        "warm", lambda cas: warm_crawl(warm, cas), corpus, args.requests
+    )
+    # Lets the engine finish with the last response before closing
+    yield task.deferLater(reactor, 0.1, lambda: None)
+    yield warm.stop()
+
+    if cold_ok and warm_ok:
+        print("all items match the golden files")
+    else:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.0, help="milliseconds")
+    task.react(main, [parser.parse_args()])
@@ -0,0 +1,234 @@
+# Offline benchmark of the WebBook parser
+#
+# Replays the pages saved in benchmarks/fixtures/<cas>/ through the
+# WebbookNistSpider callbacks, without touching the network. The four
+# substances there now are synthetic pages written by hand in the layout of
+# the WebBook (placeholder names and references), not recorded ones, and
+# the numbers they give are only a rough guide until real pages are recorded
+# with benchmarks/record_fixtures.py:
+#
+#     main.html       substance page (parse)
+#     all.html        Mask=7, substance page with every section (combined mode)
+#     gas.html        Mask=1, gas phase thermochemistry (parse_gas_phase_thermo)
+#     condensed.html  Mask=2, condensed phase thermochemistry
+#     phase.html      Mask=4, phase change data
+#     item.json       golden item expected for the substance
+#
+# Every request yielded by a callback is answered with the fixture of its
+# Mask, so the spider follows the same chain it would follow online. When
+# all.html is missing the plain substance page is served instead, as if the
+# combined page had no sections. The harness reports pages per second, the
+# time spent in every callback, the peak memory and checks the items of both
+# the combined and the multi-page modes against the golden files.
+#
+#     python -m benchmarks.parser --repeat 20
+#     python -m benchmarks.parser --combined false
+#     python -m benchmarks.parser --update-golden
+#
+# New substances are recorded with benchmarks/record_fixtures.py
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from urllib.parse import parse_qs, urlparse
+
+import scrapy
+from itemadapter import ItemAdapter
+from scrapy.http import HtmlResponse, Request
+
+from nist_scraper.spiders.webbook_nist import WebbookNistSpider
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+# Fixture answering each WebBook Mask
+MASKS = {
+    "7": "all",
+    "1": "gas",
+    "2": "condensed",
+    "4": "phase",
+}
+
+# Section page and the phase extract_data_tables is called with
+SECTIONS = {
+    "gas": "gas",
+    "condensed": "liquid",
+    "phase": "",
+}
+
+
+def fixture_cas():
+    return sorted(
+        cas
+        for cas in os.listdir(FIXTURES)
+        if os.path.exists(os.path.join(FIXTURES, cas, "main.html"))
+    )
+
+
+def read_fixture(cas, page):
+    path = os.path.join(FIXTURES, cas, page + ".html")
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def load_pages(cas):
+    pages = {"main": read_fixture(cas, "main")}
+    for mask, page in MASKS.items():
+        pages[page] = read_fixture(cas, page)
+    return pages
+
+
+def fixture_page(request):
+    mask = parse_qs(urlparse(request.url).query).get("Mask")
+    return MASKS[mask[0]] if mask else "main"
+
+
+def crawl(spider, cas, pages, timings):
+    # Runs the callbacks the way the engine would, breadth first
+    spider.search_by = "cas"
+    spider.cas = cas
+    queue = list(spider.start_requests())
+    items = []
+    parsed = 0
+    while queue:
+        request = queue.pop(0)
+        page = fixture_page(request)
+        body = pages[page]
+        if body is None and page == "all":
+            body = pages["main"]
+        if body is None:
+            continue
+        response = HtmlResponse(
+            request.url, body=body, request=request, encoding="utf-8"
+        )
+        callback = request.callback or spider.parse
+
+        started = time.perf_counter()
+        results = list(callback(response) or [])
+        timings[callback.__name__].append(time.perf_counter() - started)
+        parsed += 1
+
+        for result in results:
+            if isinstance(result, scrapy.Request):
+                queue.append(result)
+            else:
+                items.append(ItemAdapter(result).asdict())
+    return items, parsed
+
+
+def benchmark_tables(spider, corpus, repeat):
+    responses = []
+    for _ in range(repeat):
+        for cas, pages in corpus.items():
+            for page, phase in SECTIONS.items():
+                if pages[page] is None:
+                    continue
+                url = "https://webbook.nist.gov/cgi/cbook.cgi?ID=C{}".format(cas)
+                response = HtmlResponse(
+                    url, body=pages[page], request=Request(url), encoding="utf-8"
+                )
+                response.selector  # builds the HTML tree
+                responses.append((response, phase))
+
+    started = time.perf_counter()
+    for response, phase in responses:
+        spider.extract_data_tables(response, phase)
+    return (time.perf_counter() - started) / len(responses)
+
+
+def golden_path(cas):
+    return os.path.join(FIXTURES, cas, "item.json")
+
+
+def check_golden(cas, items, update):
+    if update:
+        with open(golden_path(cas), "w") as f:
+            json.dump(items, f, indent=2, sort_keys=True, ensure_ascii=False)
+            f.write("\n")
+        return True
+
+    if not os.path.exists(golden_path(cas)):
+        print("{}: no golden item, run with --update-golden".format(cas))
+        return False
+    with open(golden_path(cas)) as f:
+        expected = json.load(f)
+    # Round trip through JSON so tuples and lists compare the same
+    if json.loads(json.dumps(items)) != expected:
+        print("{}: items differ from {}".format(cas, golden_path(cas)))
+        return False
+    return True
+
+
+def main(args):
+    corpus = dict((cas, load_pages(cas)) for cas in fixture_cas())
+
+    # Golden check, one pass over the corpus in each mode. The golden items
+    # are written from the multi-page mode.
+    ok = True
+    for combined in ["false", "true"]:
+        spider = WebbookNistSpider(combined=combined)
+        for cas, pages in corpus.items():
+            items, _ = crawl(spider, cas, pages, defaultdict(list))
+            update = args.update_golden and combined == "false"
+            if not check_golden(cas, items, update):
+                print("  (combined={})".format(combined))
+                ok = False
+
+    spider = WebbookNistSpider(combined=args.combined)
+
+    # Timed passes
+    timings = defaultdict(list)
+    started = time.perf_counter()
+    parsed = 0
+    for _ in range(args.repeat):
+        for cas, pages in corpus.items():
+            parsed += crawl(spider, cas, pages, timings)[1]
+    elapsed = time.perf_counter() - started
+
+    # tracemalloc slows everything down, so memory is measured apart
+    tracemalloc.start()
+    for cas, pages in corpus.items():
+        crawl(spider, cas, pages, defaultdict(list))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    print(
+        "{} substances, {} pages in {:.2f} s: {:.0f} pages/s, peak memory {:.1f} MiB".format(
+            len(corpus), parsed, elapsed, parsed / elapsed, peak / 2 ** 20
+        )
+    )
+    print(
+        "  {:.2f} pages per substance (combined={})".format(
+            parsed / args.repeat / len(corpus), args.combined
+        )
+    )
+    for name, values in sorted(timings.items()):
+        print(
+            "  {:<30} {:6d} calls {:8.3f} ms/call".format(
+                name, len(values), sum(values) / len(values) * 1000
+            )
+        )
+    print(
+        "  {:<30} {:8.3f} ms/page (HTML tree built beforehand)".format(
+            "extract_data_tables", benchmark_tables(spider, corpus, args.repeat) * 1000
+        )
+    )
+
+    if args.update_golden:
+        print("golden items updated")
+    elif ok:
+        print("all items match the golden files")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--combined", default="true")
+    parser.add_argument("--update-golden", action="store_true")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,102 @@
+# MongoPipeline write throughput
+#
+# Writes synthetic substances into a scratch collection of the database set
+# in MONGO_URI and MONGO_DB (default: nist_benchmark), first with one
+# count_documents plus insert_one per item (how the pipeline used to work)
+# and then with MongoPipeline's buffered bulk upserts, written from the
+# database thread pool. The scratch collection is dropped afterwards.
+#
+#     python -m benchmarks.pipeline_throughput --items 10000 --bulk-size 500
+
+import argparse
+import os
+import time
+
+from scrapy import Spider
+from twisted.internet import defer, task
+
+from nist_scraper.database import connection
+from nist_scraper.identifiers import cas_check_digit
+from nist_scraper.pipelines import MongoPipeline
+
+COLLECTION = "substances_benchmark"
+DATABASE = "nist_benchmark"
+
+
+class BenchmarkPipeline(MongoPipeline):
+    collection_name = COLLECTION
+
+
+def make_cas(i):
+    # Valid check digits, the pipeline warns about the others
+    digits = str(100000 + i)
+    return digits + str(cas_check_digit(digits))
+
+
+def make_items(n):
+    return [
+        {
+            "name": "substance {}".format(i),
+            "cas": make_cas(i),
+            "formula": "C{}H{}".format(i % 20 + 1, i % 40 + 2),
+            "molecular_weight": 12.0 + i % 300,
+            "image": "https://webbook.nist.gov/cgi/cbook.cgi?Struct=C{}".format(i),
+            "antoine_equation": [
+                {"temperatures": [273.0, 373.0], "A": 4.6, "B": 1435.2, "C": -64.8}
+            ],
+        }
+        for i in range(n)
+    ]
+
+
+def legacy(collection, items):
+    for item in items:
+        if collection.count_documents({"cas": item["cas"]}) == 0:
+            collection.insert_one(dict(item))
+
+
+def bulk(items, bulk_size):
+    pipeline = BenchmarkPipeline(
+        os.environ.get("MONGO_URI"), os.environ["MONGO_DB"], bulk_size, 3600
+    )
+    spider = Spider("pipeline_benchmark")
+    pipeline.open_spider(spider)
+    for item in items:
+        pipeline.process_item(item, spider)
+    # Fired once everything is written
+    return pipeline.close_spider(spider)
+
+
+@defer.inlineCallbacks
+def timed(name, f, n):
+    started = time.perf_counter()
+    yield f()
+    elapsed = time.perf_counter() - started
+    print("{:<8} {:8.0f} items/s ({:.2f} s)".format(name, n / elapsed, elapsed))
+
+
+@defer.inlineCallbacks
+def main(reactor, args):
+    collection = connection.collection(COLLECTION)
+    items = make_items(args.items)
+    try:
+        collection.drop()
+        collection.create_index("cas")
+        yield timed("legacy", lambda: legacy(collection, items), args.items)
+        collection.drop()
+        yield timed("bulk", lambda: bulk(items, args.bulk_size), args.items)
+        # A second run only finds duplicates
+        yield timed("rerun", lambda: bulk(items, args.bulk_size), args.items)
+    finally:
+        collection.drop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--bulk-size", type=int, default=500)
+    args = parser.parse_args()
+
+    # The scratch collection goes to nist_benchmark when no database is set
+    os.environ.setdefault("MONGO_DB", DATABASE)
+    task.react(main, [args])
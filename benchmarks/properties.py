@@ -0,0 +1,129 @@
+# Evaluation of the stored equations
+#
+# Evaluates the Shomate (gas and liquid) and Antoine equations of the golden
+# items in benchmarks/fixtures at many temperatures, with a plain Python loop
+# over the points and with the vectorized functions of nist_scraper.thermo,
+# and checks both give the same values. The time to build the JSON response
+# of the properties resource is reported apart.
+#
+#     python -m benchmarks.properties --points 100000
+
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+from scrapyrt.resources import ServiceResource
+
+from nist_scraper import thermo
+from nist_scraper.scrapyrt.resources import PropertiesResource
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def load_items():
+    items = []
+    for cas in sorted(os.listdir(FIXTURES)):
+        with open(os.path.join(FIXTURES, cas, "item.json")) as f:
+            items.extend(json.load(f))
+    return items
+
+
+def find_range(ranges, temperature):
+    for stored in ranges:
+        tmin, tmax = stored["temperatures"]
+        if tmin <= temperature <= tmax:
+            return stored
+    return None
+
+
+def loop_shomate(ranges, temperatures):
+    values = []
+    for temperature in temperatures:
+        stored = find_range(ranges, temperature)
+        if stored is None:
+            values.append((math.nan, math.nan, math.nan))
+            continue
+        a, b, c, d, e, f, g, h = [stored[name] for name in thermo.SHOMATE_COEFFICIENTS]
+        t = temperature / 1000
+        values.append(
+            (
+                a + b * t + c * t ** 2 + d * t ** 3 + e / t ** 2,
+                a * t + b * t ** 2 / 2 + c * t ** 3 / 3 + d * t ** 4 / 4 - e / t + f - h,
+                a * math.log(t) + b * t + c * t ** 2 / 2 + d * t ** 3 / 3 - e / (2 * t ** 2) + g,
+            )
+        )
+    return values
+
+
+def loop_antoine(ranges, temperatures):
+    values = []
+    for temperature in temperatures:
+        stored = find_range(ranges, temperature)
+        if stored is None:
+            values.append(math.nan)
+            continue
+        values.append(10 ** (stored["A"] - stored["B"] / (temperature + stored["C"])))
+    return values
+
+
+def equations(item):
+    for phase in ["gas", "liquid"]:
+        ranges = item.get("heat_capacity_shomate_equation_{}".format(phase))
+        if ranges:
+            yield "shomate", ranges
+    if item.get("antoine_equation"):
+        yield "antoine", item["antoine_equation"]
+
+
+def timed(f, *args):
+    start = time.perf_counter()
+    result = f(*args)
+    return result, time.perf_counter() - start
+
+
+def main(args):
+    items = load_items()
+    temperatures = np.linspace(200, 6000, args.points)
+
+    loop_total = vector_total = 0
+    for item in items:
+        for kind, ranges in equations(item):
+            if kind == "shomate":
+                expected, elapsed = timed(loop_shomate, ranges, temperatures.tolist())
+                loop_total += elapsed
+                values, elapsed = timed(thermo.shomate, ranges, temperatures)
+                vector_total += elapsed
+                got = np.array(
+                    [values["heat_capacity"], values["enthalpy"], values["entropy"]]
+                ).T
+            else:
+                expected, elapsed = timed(loop_antoine, ranges, temperatures.tolist())
+                loop_total += elapsed
+                got, elapsed = timed(thermo.antoine, ranges, temperatures)
+                vector_total += elapsed
+            assert np.allclose(got, np.array(expected), equal_nan=True), item["cas"]
+
+    print("{} points, {} substances".format(args.points, len(items)))
+    print("  python loop   {:9.1f} ms".format(loop_total * 1000))
+    print("  numpy         {:9.1f} ms".format(vector_total * 1000))
+
+    # Whole response of the resource, without the database lookup
+    resource = PropertiesResource()
+    for item in items:
+        resource.find_substance = lambda search_by, value: item
+        response, evaluate = timed(resource.evaluate, "cas", item["cas"], temperatures)
+        body, encode = timed(ServiceResource.json_encoder.encode, response)
+        print(
+            "  {:10} evaluate {:6.1f} ms, JSON {:6.1f} ms ({:.1f} MiB)".format(
+                item["cas"], evaluate * 1000, encode * 1000, len(body) / 2 ** 20
+            )
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, default=100000)
+    main(parser.parse_args())
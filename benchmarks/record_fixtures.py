@@ -0,0 +1,66 @@
+# Record WebBook pages for the offline parser benchmark
+#
+# Downloads the substance page, the combined page and the gas, condensed and
+# phase change pages of every CAS number given into benchmarks/fixtures/<cas>/, then
+# `python -m benchmarks.parser --update-golden` writes their golden items.
+#
+#     python -m benchmarks.record_fixtures 7732185 74828 64175
+#     python -m benchmarks.record_fixtures --file cas.txt
+#
+# Requests are spaced by --delay seconds to be gentle with webbook.nist.gov.
+
+import argparse
+import os
+import re
+import time
+import urllib.request
+
+from benchmarks.parser import FIXTURES, MASKS
+
+URL = "https://webbook.nist.gov/cgi/cbook.cgi?ID=C{}&Units=SI"
+
+
+def download(url):
+    request = urllib.request.Request(
+        url, headers={"User-Agent": "nist_scraper benchmark fixtures"}
+    )
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return response.read()
+
+
+def record(cas, delay):
+    directory = os.path.join(FIXTURES, cas)
+    os.makedirs(directory, exist_ok=True)
+
+    main = download(URL.format(cas))
+    with open(os.path.join(directory, "main.html"), "wb") as f:
+        f.write(main)
+
+    # Only the sections linked from the substance page exist, the combined
+    # page is always recorded
+    linked = set(re.findall(rb"Mask=(\d+)", main))
+    for mask, page in MASKS.items():
+        if page != "all" and mask.encode() not in linked:
+            continue
+        time.sleep(delay)
+        with open(os.path.join(directory, page + ".html"), "wb") as f:
+            f.write(download(URL.format(cas) + "&Mask=" + mask))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("cas", nargs="*")
+    parser.add_argument("--file", help="file with one CAS number per line")
+    parser.add_argument("--delay", type=float, default=1.0)
+    args = parser.parse_args()
+
+    numbers = list(args.cas)
+    if args.file:
+        with open(args.file) as f:
+            numbers += [line.strip() for line in f if line.strip()]
+
+    for cas in numbers:
+        cas = cas.replace("-", "")
+        print("recording {}".format(cas))
+        record(cas, args.delay)
+        time.sleep(args.delay)
@@ -0,0 +1,117 @@
+# Concurrent request latency of the scrapyrt resources
+#
+# Fires a burst of concurrent /substances requests against a fake collection
+# that sleeps on every query (simulating a slow MongoDB) and reports the
+# latency seen by the clients. The "blocking" run executes the queries on the
+# reactor thread as the resources used to do, the "threadpool" run uses
+# nist_scraper.scrapyrt.threads.
+#
+#     python -m benchmarks.resource_latency --requests 50 --delay 0.02
+
+import argparse
+import statistics
+import time
+
+from twisted.internet import defer, reactor
+from twisted.web.server import NOT_DONE_YET
+from twisted.web.test.requesthelper import DummyRequest
+
+from nist_scraper.database import connection
+from nist_scraper.scrapyrt import threads
+from nist_scraper.scrapyrt.resources import SubstancesResource
+
+
+class SlowCursor(list):
+    def skip(self, n):
+        return self
+
+    def limit(self, n):
+        return self
+
+    def sort(self, *args, **kwargs):
+        return self
+
+
+class SlowCollection:
+    def __init__(self, delay):
+        self.delay = delay
+
+    def count_documents(self, query):
+        time.sleep(self.delay)
+        return 500
+
+    def estimated_document_count(self):
+        time.sleep(self.delay)
+        return 500
+
+    def create_index(self, *args, **kwargs):
+        time.sleep(self.delay)
+
+    def find(self, *args, **kwargs):
+        time.sleep(self.delay)
+        return SlowCursor([{"name": "water", "cas": "7732185"}])
+
+
+def blocking_run_in_thread(f, *args, **kwargs):
+    return defer.maybeDeferred(f, *args, **kwargs)
+
+
+def fire(resource, started, latencies):
+    request = DummyRequest([b""])
+    request.method = b"GET"
+    request.args = {b"page": [b"2"], b"per_page": [b"10"]}
+    finished = request.notifyFinish()
+    result = resource.render(request)
+    if result is not NOT_DONE_YET:
+        latencies.append(time.perf_counter() - started)
+        return defer.succeed(None)
+    finished.addCallback(
+        lambda _: latencies.append(time.perf_counter() - started)
+    )
+    return finished
+
+
+def burst(n):
+    resource = SubstancesResource()
+    latencies = []
+    started = time.perf_counter()
+    calls = []
+    for _ in range(n):
+        d = defer.Deferred()
+        reactor.callLater(0, lambda d=d: fire(resource, started, latencies).chainDeferred(d))
+        calls.append(d)
+    return defer.gatherResults(calls).addCallback(lambda _: latencies)
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p99 = latencies[max(0, int(len(latencies) * 0.99) - 1)]
+    print(
+        "{:<12} p50={:7.1f} ms  p99={:7.1f} ms  max={:7.1f} ms".format(
+            name,
+            statistics.median(latencies) * 1000,
+            p99 * 1000,
+            latencies[-1] * 1000,
+        )
+    )
+
+
+@defer.inlineCallbacks
+def main(args):
+    connection.collection = lambda name="substances": SlowCollection(args.delay)
+    try:
+        run_in_thread = threads.run_in_thread
+        threads.run_in_thread = blocking_run_in_thread
+        report("blocking", (yield burst(args.requests)))
+        threads.run_in_thread = run_in_thread
+        report("threadpool", (yield burst(args.requests)))
+    finally:
+        reactor.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.02)
+    reactor.callWhenRunning(main, parser.parse_args())
+    reactor.run()
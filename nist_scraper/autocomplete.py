@@ -0,0 +1,213 @@
+# In-memory name index for autocomplete and synonym lookups
+#
+# Names, synonyms, CAS numbers and InChIKeys of the stored substances are
+# kept in a sorted list, so every key starting with a prefix is found with a
+# binary search, like a walk down a trie. Every word of the names is a key
+# too ("ether" finds "diethyl ether"). Names and synonyms are also indexed
+# by trigram for typos: the candidates share trigrams with the query and are
+# ranked by their Dice coefficient, counted with NumPy over the postings.
+#
+# The index is loaded from MongoDB when scrapyrt starts and the
+# MongoPipeline adds the substances it inserts.
+
+import bisect
+import re
+import threading
+
+import numpy as np
+
+from nist_scraper.identifiers import canonical_name
+
+def trigrams(term: str) -> set:
+    padded = "  {} ".format(term)
+    return set(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+class NameIndex:
+    projection = {
+        "_id": 0,
+        "name": 1,
+        "cas": 1,
+        "formula": 1,
+        "iupac_std_inchikey": 1,
+        "synonyms": 1,
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.substances = {}
+        # Sorted (key, cas, kind, term) tuples
+        self.keys = []
+        # Names and synonyms, their number of trigrams and the positions of
+        # the terms having every trigram
+        self.terms = []
+        self.sizes = np.zeros(0, dtype=np.int32)
+        self.grams = {}
+
+    def load(self, collection):
+        # Built aside with plain lists, sorted and turned into arrays once,
+        # then swapped in
+        index = NameIndex()
+        index.sizes = []
+        for document in collection.find({}, self.projection):
+            index.add(document, building=True)
+        index.keys.sort()
+
+        with self.lock:
+            self.substances = index.substances
+            self.keys = index.keys
+            self.terms = index.terms
+            self.sizes = np.array(index.sizes, dtype=np.int32)
+            self.grams = dict(
+                (gram, np.array(positions, dtype=np.int32))
+                for gram, positions in index.grams.items()
+            )
+            self.loaded = True
+        return len(self.substances)
+
+    def add(self, document: dict, building: bool = False):
+        cas = document.get("cas")
+        if not cas:
+            return
+
+        keys = []
+        terms = []
+        name = canonical_name(document.get("name") or "")
+        synonyms = [canonical_name(synonym) for synonym in document.get("synonyms", [])]
+        for kind, term in [("name", name)] + [("synonym", synonym) for synonym in synonyms]:
+            if not term:
+                continue
+            terms.append((term, cas, kind))
+            words = term.split(" ")
+            for position in range(len(words)):
+                keys.append((" ".join(words[position:]), cas, kind, term))
+        keys.append((cas, cas, "cas", cas))
+        if document.get("iupac_std_inchikey"):
+            inchikey = document["iupac_std_inchikey"].lower()
+            keys.append((inchikey, cas, "inchikey", document["iupac_std_inchikey"]))
+
+        with self.lock:
+            if cas in self.substances:
+                return
+            self.substances[cas] = {
+                "name": document.get("name"),
+                "cas": cas,
+                "formula": document.get("formula"),
+            }
+            for key in keys:
+                if building:
+                    self.keys.append(key)
+                else:
+                    bisect.insort(self.keys, key)
+            for term in terms:
+                position = len(self.terms)
+                grams = trigrams(term[0])
+                self.terms.append(term)
+                if building:
+                    self.sizes.append(len(grams))
+                    for gram in grams:
+                        self.grams.setdefault(gram, []).append(position)
+                else:
+                    self.sizes = np.append(self.sizes, len(grams))
+                    for gram in grams:
+                        self.grams[gram] = np.append(
+                            self.grams.get(gram, self.sizes[:0]), position
+                        )
+
+    def prefix(self, query: str, limit: int = 10) -> list:
+        query = canonical_name(query)
+        if re.fullmatch(r"[\d-]+", query):
+            query = query.replace("-", "")
+        if not query:
+            return []
+
+        matches = []
+        seen = set()
+        with self.lock:
+            position = bisect.bisect_left(self.keys, (query,))
+            while position < len(self.keys) and len(matches) < limit:
+                key, cas, kind, term = self.keys[position]
+                if not key.startswith(query):
+                    break
+                if cas not in seen:
+                    seen.add(cas)
+                    matches.append(self.match(cas, kind, term, 1.0))
+                position += 1
+        return matches
+
+    def fuzzy(self, query: str, limit: int = 10) -> list:
+        query = canonical_name(query)
+        grams = trigrams(query)
+        if not query:
+            return []
+
+        with self.lock:
+            postings = [self.grams[gram] for gram in grams if gram in self.grams]
+            if not postings:
+                return []
+            shared = np.bincount(np.concatenate(postings), minlength=len(self.terms))
+            candidates = np.flatnonzero(shared)
+            scores = 2 * shared[candidates] / (len(grams) + self.sizes[candidates])
+
+            # Several terms can belong to the same substance, a few more
+            # than the limit are ranked
+            count = min(limit * 4, len(candidates))
+            best = np.argpartition(-scores, count - 1)[:count]
+            scored = []
+            for position in best[np.argsort(-scores[best], kind="stable")]:
+                term, cas, kind = self.terms[candidates[position]]
+                scored.append((float(scores[position]), cas, kind, term))
+
+        matches = []
+        seen = set()
+        for score, cas, kind, term in scored:
+            if cas not in seen:
+                seen.add(cas)
+                matches.append(self.match(cas, kind, term, round(score, 3)))
+            if len(matches) == limit:
+                break
+        return matches
+
+    def complete(self, query: str, limit: int = 10, fuzzy: bool = True) -> list:
+        # Prefix matches first, typos fill the rest
+        matches = self.prefix(query, limit)
+        if fuzzy and len(matches) < limit:
+            seen = set(match["cas"] for match in matches)
+            for match in self.fuzzy(query, limit):
+                if match["cas"] not in seen and len(matches) < limit:
+                    matches.append(match)
+        return matches
+
+    def resolve(self, name: str):
+        # CAS of the stored substance having this name or synonym, exactly.
+        # Close names are left to autocomplete, where the user picks one:
+        # they are often another isomer (1,2- and 1,1-dichloroethane).
+        name = canonical_name(name)
+        if not name:
+            return None
+        with self.lock:
+            position = bisect.bisect_left(self.keys, (name,))
+            while position < len(self.keys) and self.keys[position][0] == name:
+                key, cas, kind, term = self.keys[position]
+                if kind in ["name", "synonym"] and term == name:
+                    return cas
+                position += 1
+        return None
+
+    def match(self, cas: str, kind: str, term: str, score: float) -> dict:
+        match = dict(self.substances[cas])
+        match.update({"match": term, "kind": kind, "score": score})
+        return match
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "loaded": self.loaded,
+                "substances": len(self.substances),
+                "keys": len(self.keys),
+                "trigrams": len(self.grams),
+            }
+
+
+name_index = NameIndex()
@@ -0,0 +1,97 @@
+# In-process cache of substance documents
+#
+# Popular substances are requested over and over through crawl.json, so the
+# documents found in MongoDB are kept in a bounded LRU cache with a time to
+# live. The MongoPipeline invalidates the entries of every substance it
+# writes. The cache is configured with the following environment variables:
+#
+# SUBSTANCE_CACHE_SIZE (default: 1024 documents, 0 disables the cache)
+# SUBSTANCE_CACHE_TTL (default: 3600 seconds)
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from dotenv import load_dotenv
+
+from nist_scraper.identifiers import canonical
+
+load_dotenv()
+
+
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            if self.entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            requests = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / requests if requests else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+def substance_key(search_by: str, value: str) -> tuple:
+    # Raises InvalidIdentifier for malformed identifiers
+    return (search_by, canonical(search_by, value))
+
+
+substance_cache = TTLCache(
+    maxsize=int(os.environ.get("SUBSTANCE_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("SUBSTANCE_CACHE_TTL", 3600)),
+)
@@ -0,0 +1,278 @@
+# Packed storage of the property series
+#
+# The heat capacity and vaporization series are lists of [value,
+# temperature] pairs, and the Shomate, Antoine and vaporization equations
+# lists of dicts repeating the same keys. Stored as they are, every number
+# is a BSON double with its own type byte and array index as key, and every
+# coefficient repeats its name. The MongoPipeline can store them packed
+# instead (MONGO_PACK_SERIES, see settings.py), as a single float64 array in
+# a BSON binary:
+#
+#     {"_codec": "float64", "_v": 1, "width": 2, "data": Binary}
+#
+# The records also have "columns", the name of every key and its width (0
+# for a number, the length of a list like "temperatures"). Missing numbers
+# (None) are stored as NaN and flagged with "missing". A series is only
+# packed when that makes it smaller, equations of a couple of ranges are
+# not. The resources unpack the documents they read, so the API answers the
+# same either way. The stored documents are packed, unpacked or measured
+# with:
+#
+#     python -m nist_scraper.codec pack
+#     python -m nist_scraper.codec unpack
+#     python -m nist_scraper.codec report
+
+import sys
+import time
+from array import array
+
+import bson
+from bson.binary import Binary
+from pymongo import UpdateOne
+
+CODEC = "float64"
+SCHEMA_VERSION = 1
+NAN = float("nan")
+
+SERIES = [
+    "constant_pressure_heat_capacity_values_gas",
+    "constant_pressure_heat_capacity_values_liquid",
+    "enthalpy_vaporization_values",
+    "entropy_vaporization_values",
+    "heat_capacity_shomate_equation_gas",
+    "heat_capacity_shomate_equation_liquid",
+    "enthalpy_vaporization_equation",
+    "antoine_equation",
+]
+
+
+def is_number(value) -> bool:
+    return value is None or (isinstance(value, (int, float)) and not isinstance(value, bool))
+
+
+def layout(record: dict):
+    # [[key, width]] of a record, None if it has anything but numbers and
+    # lists of numbers
+    columns = []
+    for key, value in record.items():
+        if isinstance(value, list) and value and all(is_number(item) for item in value):
+            columns.append([key, len(value)])
+        elif is_number(value):
+            columns.append([key, 0])
+        else:
+            return None
+    return columns
+
+
+def encode(rows: list, columns=None) -> dict:
+    values = array("d")
+    missing = False
+    for row in rows:
+        for item in row:
+            if item is None:
+                missing = True
+                values.append(NAN)
+            else:
+                values.append(item)
+    # Stored little endian
+    if sys.byteorder == "big":
+        values.byteswap()
+
+    packed = {
+        "_codec": CODEC,
+        "_v": SCHEMA_VERSION,
+        "width": len(rows[0]),
+        "data": Binary(values.tobytes()),
+    }
+    if columns is not None:
+        packed["columns"] = columns
+    if missing:
+        packed["missing"] = True
+    return packed
+
+
+def smaller(packed: dict, value: list):
+    if len(bson.encode({"value": packed})) < len(bson.encode({"value": value})):
+        return packed
+    return value
+
+
+def pack(value):
+    # The series packed, or as it is when it does not fit in a float64 array
+    if not isinstance(value, list) or not value:
+        return value
+
+    if all(isinstance(row, list) for row in value):
+        width = len(value[0])
+        if width and all(
+            len(row) == width and all(is_number(item) for item in row) for row in value
+        ):
+            return smaller(encode(value), value)
+        return value
+
+    if all(isinstance(row, dict) for row in value):
+        columns = layout(value[0])
+        if not columns or any(layout(row) != columns for row in value[1:]):
+            return value
+        rows = []
+        for record in value:
+            row = []
+            for key, width in columns:
+                if width:
+                    row.extend(record[key])
+                else:
+                    row.append(record[key])
+            rows.append(row)
+        return smaller(encode(rows, columns), value)
+
+    return value
+
+
+def is_packed(value) -> bool:
+    return isinstance(value, dict) and value.get("_codec") == CODEC
+
+
+def unpack(value):
+    if not is_packed(value):
+        return value
+    if value.get("_v") != SCHEMA_VERSION:
+        raise ValueError("Unknown {} codec version: {}".format(CODEC, value.get("_v")))
+
+    values = array("d")
+    values.frombytes(value["data"])
+    if sys.byteorder == "big":
+        values.byteswap()
+    values = values.tolist()
+    if value.get("missing"):
+        # NaN is the only value not equal to itself
+        values = [None if item != item else item for item in values]
+
+    # Rows of width values, one iterator zipped with itself
+    rows = list(map(list, zip(*[iter(values)] * value["width"])))
+    if "columns" not in value:
+        return rows
+
+    records = []
+    for row in rows:
+        record = {}
+        position = 0
+        for key, size in value["columns"]:
+            if size:
+                record[key] = row[position:position + size]
+                position += size
+            else:
+                record[key] = row[position]
+                position += 1
+        records.append(record)
+    return records
+
+
+def pack_document(document: dict) -> dict:
+    # A copy of the document with its series packed
+    packed = dict(document)
+    for field in SERIES:
+        if field in packed:
+            packed[field] = pack(packed[field])
+    return packed
+
+
+def unpack_document(document: dict) -> dict:
+    # The document read from the database as the API answers it, packed or
+    # not. Unpacked in place.
+    if document:
+        for field, value in document.items():
+            if is_packed(value):
+                document[field] = unpack(value)
+    return document
+
+
+def migrate(collection, packed: bool = True, batch_size: int = 1000) -> dict:
+    # Packs (or unpacks) the series of the stored documents
+    projection = dict.fromkeys(SERIES, 1)
+    stats = {"scanned": 0, "updated": 0}
+
+    batch = []
+    for document in collection.find({}, projection):
+        stats["scanned"] += 1
+        changed = {}
+        for field in SERIES:
+            if field not in document:
+                continue
+            value = pack(document[field]) if packed else unpack(document[field])
+            if value is not document[field]:
+                changed[field] = value
+        if changed:
+            batch.append(UpdateOne({"_id": document["_id"]}, {"$set": changed}))
+        if len(batch) >= batch_size:
+            stats["updated"] += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        stats["updated"] += collection.bulk_write(batch, ordered=False).modified_count
+    return stats
+
+
+def report(documents, repeat: int = 5) -> dict:
+    # BSON size and decoding time of the documents stored as they are and
+    # packed, the time to read a packed one includes unpacking it
+    plain = []
+    packed = []
+    for document in documents:
+        document = unpack_document(dict(document))
+        document.pop("_id", None)
+        plain.append(bson.encode(document))
+        packed.append(bson.encode(pack_document(document)))
+    if not plain:
+        return {"documents": 0}
+
+    def read(encoded, decode):
+        started = time.perf_counter()
+        for _ in range(repeat):
+            for data in encoded:
+                decode(bson.decode(data))
+        return len(encoded) * repeat / (time.perf_counter() - started)
+
+    plain_size = sum(len(data) for data in plain)
+    packed_size = sum(len(data) for data in packed)
+    plain_rate = read(plain, lambda document: document)
+    packed_rate = read(packed, unpack_document)
+    return {
+        "documents": len(plain),
+        "plain_bytes": plain_size,
+        "packed_bytes": packed_size,
+        "size_saving": round(1 - packed_size / plain_size, 4),
+        "plain_documents_per_second": round(plain_rate, 1),
+        "packed_documents_per_second": round(packed_rate, 1),
+        "read_speedup": round(packed_rate / plain_rate, 3),
+    }
+
+
+def print_report(stats: dict):
+    if not stats["documents"]:
+        print("No documents")
+        return
+    print(
+        "{} documents: {} bytes stored as they are, {} packed ({:.1%} smaller)".format(
+            stats["documents"], stats["plain_bytes"], stats["packed_bytes"], stats["size_saving"]
+        )
+    )
+    print(
+        "read: {:.0f} documents/s as they are, {:.0f} packed and unpacked ({:.2f}x)".format(
+            stats["plain_documents_per_second"],
+            stats["packed_documents_per_second"],
+            stats["read_speedup"],
+        )
+    )
+
+
+if __name__ == "__main__":
+    from nist_scraper.database import connection
+
+    if sys.argv[1:] not in [["pack"], ["unpack"], ["report"]]:
+        sys.exit("Usage: python -m nist_scraper.codec pack|unpack|report")
+
+    collection = connection.collection()
+    if sys.argv[1] == "report":
+        print_report(report(collection.find({}, {"_id": 0})))
+    else:
+        stats = migrate(collection, packed=sys.argv[1] == "pack")
+        print("{} documents scanned, {} updated".format(stats["scanned"], stats["updated"]))
@@ -0,0 +1,203 @@
+# Shared MongoDB connection
+#
+# A single MongoClient (and therefore a single connection pool) is kept per
+# process and shared by the scrapyrt resources and the MongoPipeline. The
+# client is created lazily on first use and closed when the process exits.
+#
+#     https://pymongo.readthedocs.io/en/stable/faq.html#how-does-connection-pooling-work-in-pymongo
+
+import atexit
+import logging
+import os
+import threading
+
+import pymongo
+from pymongo import monitoring
+from pymongo.errors import OperationFailure
+from dotenv import load_dotenv
+
+from nist_scraper.metrics import CommandTimingListener
+from nist_scraper.search import SEARCH_INDEXES
+
+load_dotenv()
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    # Keeps counters of the connection pool events so the pool can be sized
+    # from real usage instead of guessing.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checked_in = 0
+        self.checkout_failures = 0
+        self.pool_cleared = 0
+        self.in_use = 0
+        self.max_in_use = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self.lock:
+            self.pool_cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self.lock:
+            self.created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self.lock:
+            self.closed += 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        with self.lock:
+            self.checked_out += 1
+            self.in_use += 1
+            self.max_in_use = max(self.max_in_use, self.in_use)
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self.checked_in += 1
+            self.in_use -= 1
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {
+                "connections_open": self.created - self.closed,
+                "connections_created": self.created,
+                "connections_closed": self.closed,
+                "connections_in_use": self.in_use,
+                "max_connections_in_use": self.max_in_use,
+                "checkouts": self.checked_out,
+                "checkout_failures": self.checkout_failures,
+                "pool_cleared": self.pool_cleared,
+            }
+
+
+# Indexes every substances collection should have, the unique cas index is
+# what the MongoPipeline upserts rely on
+SUBSTANCE_INDEXES = [
+    ("cas", {"unique": True}),
+    ("name", {}),
+    ("iupac_std_inchikey", {}),
+    ("formula", {}),
+] + SEARCH_INDEXES
+
+
+class MongoConnection:
+    # Process-wide connection manager. The pool is configured with the
+    # following environment variables:
+    #
+    # MONGO_URI, MONGO_DB
+    # MONGO_MAX_POOL_SIZE (default: 20)
+    # MONGO_MIN_POOL_SIZE (default: 0)
+    # MONGO_MAX_IDLE_TIME_MS (default: 60000)
+    # MONGO_SERVER_SELECTION_TIMEOUT_MS (default: 5000)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.listener = PoolStatsListener()
+        # Query timings for the /metrics resource
+        self.command_listener = CommandTimingListener()
+        self._client = None
+        # Collections whose indexes were created by this process
+        self.indexed = set()
+
+    def settings(self) -> dict:
+        return {
+            "maxPoolSize": int(os.environ.get("MONGO_MAX_POOL_SIZE", 20)),
+            "minPoolSize": int(os.environ.get("MONGO_MIN_POOL_SIZE", 0)),
+            "maxIdleTimeMS": int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", 60000)),
+            "serverSelectionTimeoutMS": int(
+                os.environ.get("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000)
+            ),
+        }
+
+    @property
+    def client(self) -> pymongo.MongoClient:
+        if self._client is None:
+            with self.lock:
+                if self._client is None:
+                    self._client = pymongo.MongoClient(
+                        os.environ.get("MONGO_URI"),
+                        event_listeners=[self.listener, self.command_listener],
+                        **self.settings(),
+                    )
+        return self._client
+
+    @property
+    def db(self):
+        return self.client[os.environ.get("MONGO_DB")]
+
+    def collection(self, name: str = "substances"):
+        return self.db[name]
+
+    def ensure_indexes(self, name: str = "substances"):
+        # create_index is a no-op when the index already exists, but still a
+        # round trip per index, so it runs once per process
+        if name in self.indexed:
+            return
+        collection = self.collection(name)
+        for field, options in SUBSTANCE_INDEXES:
+            try:
+                collection.create_index(field, **options)
+            except OperationFailure as e:
+                logging.warning(
+                    "Could not create the {} index on {}: {}".format(field, name, e)
+                )
+        self.indexed.add(name)
+
+    def ping(self) -> bool:
+        try:
+            self.client.admin.command("ping")
+            return True
+        except Exception as e:
+            logging.warning("MongoDB health check failed: {}".format(e))
+            return False
+
+    def stats(self) -> dict:
+        stats = self.listener.as_dict()
+        stats["connected"] = self._client is not None
+        stats.update(self.settings())
+        return stats
+
+    def close(self):
+        with self.lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+
+connection = MongoConnection()
+atexit.register(connection.close)
+
+
+def get_collection(name: str = "substances"):
+    return connection.collection(name)
+
+
+if __name__ == "__main__":
+    # Bootstrap the indexes of the substances collection:
+    #
+    #     python -m nist_scraper.database
+    connection.ensure_indexes()
+    print(connection.collection().index_information())
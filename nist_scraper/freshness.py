@@ -0,0 +1,59 @@
+# Freshness of the stored substances
+#
+# Every document is stored with the time it was fetched from the WebBook
+# (fetched_at, seconds since the epoch) and a hash of its parsed content
+# (content_hash). crawl.json serves the stored document right away, and when
+# it is older than FRESHNESS_MAX_AGE the substance is crawled again in the
+# background (stale-while-revalidate). The MongoPipeline only rewrites a
+# document whose content hash changed, an unchanged one just gets its
+# fetched_at moved forward. Freshness is configured with the following
+# environment variables:
+#
+# FRESHNESS_MAX_AGE (default: 2592000 seconds, 30 days, 0 never refreshes)
+# FRESHNESS_MAX_REFRESHES (default: 4 background crawls at a time)
+
+import hashlib
+import json
+import os
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+FRESHNESS_MAX_AGE = float(os.environ.get("FRESHNESS_MAX_AGE", 30 * 24 * 3600))
+FRESHNESS_MAX_REFRESHES = int(os.environ.get("FRESHNESS_MAX_REFRESHES", 4))
+
+# Fields that are not part of the content of a substance
+METADATA = ["_id", "fetched_at", "content_hash", "query"]
+
+
+def content_hash(document: dict) -> str:
+    content = dict(
+        (field, value) for field, value in document.items() if field not in METADATA
+    )
+    encoded = json.dumps(content, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def stamp(document: dict, fetched_at: float = None) -> dict:
+    # The document with its fetched_at and content_hash
+    document["fetched_at"] = time.time() if fetched_at is None else fetched_at
+    document["content_hash"] = content_hash(document)
+    return document
+
+
+def age(document: dict, now: float = None):
+    # Seconds since the document was fetched, None for the documents stored
+    # before fetched_at existed
+    fetched_at = document.get("fetched_at")
+    if not isinstance(fetched_at, (int, float)):
+        return None
+    return (time.time() if now is None else now) - fetched_at
+
+
+def is_stale(document: dict, now: float = None, max_age: float = FRESHNESS_MAX_AGE) -> bool:
+    if max_age <= 0:
+        return False
+    seconds = age(document, now)
+    return seconds is None or seconds > max_age
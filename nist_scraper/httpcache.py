@@ -0,0 +1,186 @@
+# Persistent HTTP cache for the WebBook pages
+#
+# Scrapy's HttpCacheMiddleware with a SQLite storage and a policy made for
+# the WebBook. The pages rarely change, so they are kept for a TTL that
+# depends on the section they belong to (their Mask) and, once stale, they
+# are revalidated with If-None-Match / If-Modified-Since instead of being
+# downloaded again. The bodies are stored compressed.
+#
+# The storage is a single SQLite file in WAL mode, so every spider and every
+# process started from the project (scrapy crawl, scrapyrt) share it.
+#
+#     https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#module-scrapy.downloadermiddlewares.httpcache
+
+import json
+import logging
+import os
+import sqlite3
+import zlib
+from time import time
+from urllib.parse import parse_qs
+
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy.extensions.httpcache import RFC2616Policy, rfc1123_to_epoch
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.httpobj import urlparse_cached
+from scrapy.utils.project import data_path
+from scrapy.utils.request import request_fingerprint
+
+logger = logging.getLogger(__name__)
+
+DAY = 24 * 3600
+
+# Freshness of the pages by Mask, "" is the substance (or search) page
+SECTION_TTLS = {
+    "": 7 * DAY,
+    "1": 30 * DAY,
+    "2": 30 * DAY,
+    "4": 30 * DAY,
+    "7": 7 * DAY,
+}
+
+# Headers of a 304 that replace the stored ones (RFC 7234, section 4.3.4)
+REVALIDATION_HEADERS = [b"Date", b"Expires", b"Cache-Control", b"ETag", b"Last-Modified"]
+
+
+class NistCachePolicy(RFC2616Policy):
+    # Every successful page is stored, whatever its Cache-Control says, and is
+    # fresh for the TTL of its section. Stale pages are revalidated with the
+    # validators they were served with.
+
+    def __init__(self, settings):
+        super().__init__(settings)
+        self.ttls = dict(SECTION_TTLS)
+        self.ttls.update(
+            (str(mask), ttl)
+            for mask, ttl in settings.getdict("HTTPCACHE_SECTION_TTLS").items()
+        )
+
+    def ttl(self, request) -> float:
+        mask = parse_qs(urlparse_cached(request).query).get("Mask", [""])[0]
+        return self.ttls.get(mask, self.ttls[""])
+
+    def should_cache_response(self, response, request):
+        if b"no-store" in self._parse_cachecontrol(response):
+            return False
+        return response.status == 200
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+        if b"no-cache" in self._parse_cachecontrol(request):
+            self._set_conditional_validators(request, cachedresponse)
+            return False
+
+        now = time()
+        date = rfc1123_to_epoch(cachedresponse.headers.get(b"Date")) or now
+        if now - date < self.ttl(request):
+            return True
+
+        self._set_conditional_validators(request, cachedresponse)
+        return False
+
+
+class SqliteCacheStorage:
+    # Responses keyed by request fingerprint, with their body compressed with
+    # zlib. HTTPCACHE_EXPIRATION_SECS works as in the Scrapy storages, the
+    # entries older than that are not returned and are purged when a spider
+    # opens (0 keeps them forever and lets the policy revalidate them).
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings["HTTPCACHE_DIR"], createdir=True)
+        self.filename = settings.get("HTTPCACHE_SQLITE_FILE", "nist.sqlite")
+        self.expiration_secs = settings.getint("HTTPCACHE_EXPIRATION_SECS")
+        self.db = None
+
+    def open_spider(self, spider):
+        path = os.path.join(self.cachedir, self.filename)
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " fingerprint TEXT PRIMARY KEY,"
+            " url TEXT NOT NULL,"
+            " status INTEGER NOT NULL,"
+            " headers TEXT NOT NULL,"
+            " body BLOB NOT NULL,"
+            " stored_at REAL NOT NULL)"
+        )
+        if self.expiration_secs > 0:
+            self.db.execute(
+                "DELETE FROM responses WHERE stored_at < ?",
+                (time() - self.expiration_secs,),
+            )
+
+        logger.debug(
+            "Using SQLite cache storage in %(cachepath)s",
+            {"cachepath": path},
+            extra={"spider": spider},
+        )
+
+    def close_spider(self, spider):
+        self.db.close()
+        self.db = None
+
+    def retrieve_response(self, spider, request):
+        row = self.db.execute(
+            "SELECT url, status, headers, body, stored_at FROM responses"
+            " WHERE fingerprint = ?",
+            (request_fingerprint(request),),
+        ).fetchone()
+        if row is None:
+            return None
+
+        url, status, headers, body, stored_at = row
+        if 0 < self.expiration_secs < time() - stored_at:
+            return None
+
+        headers = Headers(json.loads(headers))
+        respcls = responsetypes.from_args(headers=headers, url=url)
+        return respcls(
+            url=url, headers=headers, status=status, body=zlib.decompress(body)
+        )
+
+    def store_response(self, spider, request, response):
+        headers = dict(
+            (key.decode("latin-1"), [value.decode("latin-1") for value in values])
+            for key, values in response.headers.items()
+        )
+        self.db.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                request_fingerprint(request),
+                response.url,
+                response.status,
+                json.dumps(headers),
+                zlib.compress(response.body),
+                time(),
+            ),
+        )
+
+    def stats(self) -> dict:
+        count, size = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(body)), 0) FROM responses"
+        ).fetchone()
+        return {"responses": count, "compressed_bytes": size}
+
+
+class NistHttpCacheMiddleware(HttpCacheMiddleware):
+    # On a 304 Scrapy returns the cached response as it was stored, so it
+    # would be stale again on the next request and revalidated every time.
+    # The stored headers are refreshed with the ones of the 304 instead.
+
+    def process_response(self, request, response, spider):
+        cachedresponse = request.meta.get("cached_response")
+        result = super().process_response(request, response, spider)
+        if cachedresponse is not None and response.status == 304:
+            for header in REVALIDATION_HEADERS:
+                if header in response.headers:
+                    cachedresponse.headers[header] = response.headers[header]
+            self.storage.store_response(spider, request, cachedresponse)
+        return result
+
+    def spider_closed(self, spider):
+        if hasattr(self.storage, "stats"):
+            spider.logger.info("HTTP cache: {}".format(self.storage.stats()))
+        super().spider_closed(spider)
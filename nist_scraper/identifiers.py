@@ -0,0 +1,151 @@
+# Canonical form of the substance identifiers
+#
+# The same substance can be asked for as "7732-18-5", "7732185" or
+# "C7732185", as "Ethyl+Ether" or "ethyl  ether". Every identifier is turned
+# into one canonical string, used both to store the documents and to look
+# them up (database, cache, crawl coalescing), so they always meet:
+#
+# cas       digits only, without dashes, with a valid check digit
+# name      NFKC, lowercase, single spaces, "+" between words as a space
+# inchikey  uppercase, validated against the InChIKey layout
+#
+# The documents stored before are migrated with:
+#
+#     python -m nist_scraper.identifiers migrate
+
+import logging
+import re
+import sys
+import unicodedata
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+CAS = re.compile(r"^(\d{2,7})(\d{2})(\d)$")
+INCHIKEY = re.compile(r"^[A-Z]{14}-[A-Z]{10}-[A-Z]$")
+
+# Dashes NFKC leaves as they are
+DASHES = dict.fromkeys(map(ord, "\u2010\u2011\u2012\u2013\u2014\u2212"), "-")
+
+
+class InvalidIdentifier(ValueError):
+    pass
+
+
+def cas_check_digit(digits: str) -> int:
+    # The digits before the check digit, from right to left, are weighted
+    # 1, 2, 3... and the check digit is their sum modulo 10
+    return sum(
+        position * int(digit) for position, digit in enumerate(reversed(digits), 1)
+    ) % 10
+
+
+def canonical_cas(value, check: bool = True) -> str:
+    cas = str(value).strip().translate(DASHES).replace("-", "").replace(" ", "")
+    if cas[:1] in ["C", "c"]:
+        # WebBook ids are the CAS number after a C
+        cas = cas[1:]
+    match = CAS.match(cas)
+    if match is None:
+        raise InvalidIdentifier("Invalid CAS number: {}".format(value))
+    if check and cas_check_digit(cas[:-1]) != int(cas[-1]):
+        raise InvalidIdentifier("Invalid CAS check digit: {}".format(value))
+    return cas
+
+
+def format_cas(cas: str) -> str:
+    # 7732185 -> 7732-18-5
+    return "{}-{}-{}".format(*CAS.match(cas).groups())
+
+
+def canonical_name(value) -> str:
+    name = unicodedata.normalize("NFKC", str(value)).translate(DASHES)
+    # "ethyl+ether" from a query string, "(+)-camphor" keeps its sign
+    name = re.sub(r"(?<=\w)\+(?=\w)", " ", name)
+    return " ".join(name.lower().split())
+
+
+def canonical_inchikey(value) -> str:
+    inchikey = str(value).strip().upper()
+    if inchikey.startswith("INCHIKEY="):
+        inchikey = inchikey[len("INCHIKEY="):]
+    if not INCHIKEY.match(inchikey):
+        raise InvalidIdentifier("Invalid InChIKey: {}".format(value))
+    return inchikey
+
+
+CANONICAL = {
+    "cas": canonical_cas,
+    "name": canonical_name,
+    "formula": lambda value: str(value).strip(),
+    "iupac_std_inchikey": canonical_inchikey,
+}
+
+
+def canonical(search_by: str, value) -> str:
+    # Raises InvalidIdentifier for malformed CAS numbers and InChIKeys
+    return CANONICAL.get(search_by, lambda value: str(value).strip())(value)
+
+
+def canonical_document(document: dict) -> dict:
+    # The identifier fields of a stored document in canonical form, the ones
+    # that can not be made canonical are left as they are
+    fields = {}
+    for field in ["cas", "name", "iupac_std_inchikey"]:
+        if document.get(field):
+            try:
+                fields[field] = canonical(field, document[field])
+            except InvalidIdentifier as e:
+                logging.warning("{} ({})".format(e, document.get("cas")))
+    if document.get("synonyms"):
+        fields["synonyms"] = [canonical_name(synonym) for synonym in document["synonyms"]]
+    return fields
+
+
+def migrate(collection, batch_size: int = 1000) -> dict:
+    # Rewrites the identifiers of the stored documents in canonical form. A
+    # document whose canonical CAS already exists is a duplicate, it is
+    # reported and left for review.
+    projection = {"cas": 1, "name": 1, "iupac_std_inchikey": 1, "synonyms": 1}
+    stats = {"scanned": 0, "updated": 0, "duplicates": []}
+
+    def write(batch):
+        try:
+            stats["updated"] += collection.bulk_write(batch, ordered=False).modified_count
+        except BulkWriteError as e:
+            stats["updated"] += e.details.get("nModified", 0)
+            for error in e.details.get("writeErrors", []):
+                if error.get("code") == 11000:
+                    stats["duplicates"].append(str(error["op"]["q"]["_id"]))
+                else:
+                    logging.warning(error.get("errmsg"))
+
+    batch = []
+    for document in collection.find({}, projection):
+        stats["scanned"] += 1
+        fields = canonical_document(document)
+        changed = dict(
+            (field, value) for field, value in fields.items() if document.get(field) != value
+        )
+        if changed:
+            batch.append(UpdateOne({"_id": document["_id"]}, {"$set": changed}))
+        if len(batch) >= batch_size:
+            write(batch)
+            batch = []
+    if batch:
+        write(batch)
+    return stats
+
+
+if __name__ == "__main__":
+    from nist_scraper.database import connection
+
+    if sys.argv[1:] != ["migrate"]:
+        sys.exit("Usage: python -m nist_scraper.identifiers migrate")
+
+    stats = migrate(connection.collection())
+    print(
+        "{} documents scanned, {} updated".format(stats["scanned"], stats["updated"])
+    )
+    for _id in stats["duplicates"]:
+        print("Duplicate CAS, document {} left as it was".format(_id))
@@ -0,0 +1,217 @@
+# Bulk ingestion of substances into MongoDB
+#
+# Streams identifiers from a JSON, NDJSON or CSV file into the webbook_nist
+# spider, including the links.json written by generic_spider and
+# wiki_substances. The identifiers already stored in MongoDB are skipped with
+# one query per batch, and the resolved ones are written to a checkpoint file
+# so a run that was killed resumes where it stopped:
+#
+#     python -m nist_scraper.ingest links.json --preset polite
+#
+# The same bulk mode is available from the command line with
+#
+#     scrapy crawl webbook_nist -a source=links.json
+
+import argparse
+import csv
+import json
+import logging
+import os
+from urllib.parse import parse_qs, urlparse
+
+from pymongo.errors import PyMongoError
+
+from nist_scraper.identifiers import InvalidIdentifier, canonical
+from nist_scraper.database import connection
+
+# Throttling presets, on top of the project settings
+PRESETS = {
+    "polite": {
+        "AUTOTHROTTLE_ENABLED": True,
+        "AUTOTHROTTLE_START_DELAY": 2.0,
+        "AUTOTHROTTLE_TARGET_CONCURRENCY": 1.0,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 2,
+        "DOWNLOAD_DELAY": 1.0,
+    },
+    "balanced": {
+        "AUTOTHROTTLE_ENABLED": True,
+        "AUTOTHROTTLE_START_DELAY": 1.0,
+        "AUTOTHROTTLE_TARGET_CONCURRENCY": 4.0,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 8,
+        "DOWNLOAD_DELAY": 0.25,
+    },
+    "fast": {
+        "AUTOTHROTTLE_ENABLED": True,
+        "AUTOTHROTTLE_START_DELAY": 0.5,
+        "AUTOTHROTTLE_TARGET_CONCURRENCY": 8.0,
+        "CONCURRENT_REQUESTS": 32,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": 16,
+        "DOWNLOAD_DELAY": 0,
+        "MONGO_BULK_SIZE": 500,
+    },
+}
+
+
+def read_entries(path: str):
+    # One dict per entry, the file is never loaded as a whole
+    extension = os.path.splitext(path)[1].lower()
+    with open(path, newline="", encoding="utf-8") as f:
+        if extension == ".csv":
+            yield from csv.DictReader(f)
+        elif extension in [".jl", ".jsonl", ".ndjson"]:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            # JSON arrays as written by the Scrapy feed exporter, one item
+            # per line between the brackets
+            for number, line in enumerate(f, 1):
+                line = line.strip().lstrip("[").rstrip("]").strip().rstrip(",")
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    raise ValueError(
+                        "{}:{} is not one item per line, convert it to NDJSON".format(
+                            path, number
+                        )
+                    )
+
+
+def identifier(entry: dict):
+    # (search_by, value) of an entry with a cas, a name or a WebBook link
+    if entry.get("cas"):
+        return "cas", canonical("cas", entry["cas"])
+    if entry.get("name"):
+        return "name", str(entry["name"]).strip().replace(" ", "+")
+
+    link = entry.get("link") or entry.get("url")
+    if link:
+        query = parse_qs(urlparse(link).query)
+        if query.get("ID", [""])[0].startswith("C"):
+            return "cas", canonical("cas", query["ID"][0])
+        if query.get("Name"):
+            return "name", query["Name"][0].strip().replace(" ", "+")
+    return None
+
+
+def read_identifiers(path: str):
+    for entry in read_entries(path):
+        try:
+            found = identifier(entry)
+        except InvalidIdentifier as e:
+            logging.warning(e)
+            continue
+        if found is None:
+            logging.warning("No CAS, name or link in {}".format(entry))
+            continue
+        yield found
+
+
+def batches(iterable, size: int):
+    batch = []
+    for element in iterable:
+        batch.append(element)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Checkpoint:
+    # Identifiers already resolved, one per line. They are appended when the
+    # substance is written to the database or known not to be stored, so
+    # what was still buffered when a run was killed is crawled again.
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.done.update(line.rstrip("\n") for line in f if line.strip())
+        self.file = open(path, "a", encoding="utf-8")
+
+    def __contains__(self, value) -> bool:
+        return str(value) in self.done
+
+    def mark(self, values):
+        # Once each, a batch can resolve the same identifier twice
+        values = [
+            value for value in dict.fromkeys(str(value) for value in values)
+            if value not in self.done
+        ]
+        if values:
+            self.done.update(values)
+            self.file.write("".join(value + "\n" for value in values))
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def stored(search_by: str, values: list) -> set:
+    # Canonical identifiers of the batch that are already in the database
+    documents = connection.collection().find(
+        {search_by: {"$in": [canonical(search_by, value) for value in values]}},
+        {"_id": 0, search_by: 1},
+    )
+    return set(document[search_by] for document in documents)
+
+
+def pending_identifiers(path: str, checkpoint: Checkpoint = None, batch_size=500):
+    # Identifiers of the file still to crawl, with one database query per
+    # search_by and batch. Without a database nothing is skipped there.
+    skip_stored = True
+    for batch in batches(read_identifiers(path), batch_size):
+        if checkpoint is not None:
+            batch = [(by, value) for by, value in batch if value not in checkpoint]
+
+        found = {}
+        if skip_stored:
+            try:
+                for search_by in set(by for by, value in batch):
+                    found[search_by] = stored(
+                        search_by, [value for by, value in batch if by == search_by]
+                    )
+            except PyMongoError as e:
+                logging.warning("Not skipping stored substances: {}".format(e))
+                skip_stored = False
+                found = {}
+
+        for search_by, value in batch:
+            if canonical(search_by, value) in found.get(search_by, ()):
+                continue
+            yield search_by, value
+
+
+if __name__ == "__main__":
+    from scrapy.crawler import CrawlerProcess
+    from scrapy.utils.project import get_project_settings
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="JSON, NDJSON or CSV file")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="balanced")
+    parser.add_argument("--checkpoint", help="default: <source>.checkpoint")
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    # The upserts of the MongoPipeline rely on the unique cas index to never
+    # store a CAS twice
+    try:
+        connection.ensure_indexes()
+    except PyMongoError as e:
+        logging.warning("Could not create the indexes: {}".format(e))
+
+    settings = get_project_settings()
+    settings.setdict(PRESETS[args.preset], priority="cmdline")
+
+    process = CrawlerProcess(settings)
+    process.crawl(
+        "webbook_nist",
+        source=args.source,
+        checkpoint=args.checkpoint or args.source + ".checkpoint",
+        batch_size=args.batch_size,
+    )
+    process.start()
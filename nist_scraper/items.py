@@ -16,6 +16,7 @@ class SubstanceItem(scrapy.Item):
     iupac_std_inchi = scrapy.Field()
     iupac_std_inchikey = scrapy.Field()
     image = scrapy.Field()
+    synonyms = scrapy.Field()
     enthalpy_formation_gas = scrapy.Field()
     enthalpy_combustion_gas = scrapy.Field()
     entropy_gas = scrapy.Field()
@@ -43,3 +44,6 @@ class SubstanceItem(scrapy.Item):
     entropy_vaporization_values = scrapy.Field()
     entropy_vaporization_units = scrapy.Field()
     antoine_equation = scrapy.Field()
+    # Identifier a substance was requested with in batch mode, it is not
+    # stored in the database
+    query = scrapy.Field()
@@ -0,0 +1,259 @@
+# Prometheus metrics of the service
+#
+# Counters, gauges and histograms kept in memory and exposed by the /metrics
+# resource in the Prometheus text format, so Fly.io (see fly.toml) or any
+# Prometheus server can scrape them:
+#
+#     https://prometheus.io/docs/instrumenting/exposition_formats/
+#
+# The crawls run inside the scrapyrt process, so the downloader middleware
+# and the MongoPipeline update the same registry as the resources. Gauges
+# built from other statistics (thread pools, caches) are read when scraped.
+
+import bisect
+import threading
+import time
+
+from pymongo import monitoring
+
+# Buckets in seconds, the download ones go up to the download timeout
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+MONGO_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+DOWNLOAD_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 180)
+
+
+def format_value(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        pairs.append('{}="{}"'.format(name, value))
+    return "{" + ",".join(pairs) + "}"
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def key(self, labels) -> tuple:
+        if len(labels) != len(self.labels):
+            raise ValueError("{} expects the labels {}".format(self.name, self.labels))
+        return tuple(str(label) for label in labels)
+
+    def samples(self):
+        # (suffix, label names, label values, value)
+        with self.lock:
+            return [(self.name, self.labels, key, value) for key, value in self.values.items()]
+
+    def render(self) -> list:
+        lines = [
+            "# HELP {} {}".format(self.name, self.documentation),
+            "# TYPE {} {}".format(self.name, self.kind),
+        ]
+        for name, label_names, label_values, value in self.samples():
+            lines.append(
+                "{}{} {}".format(
+                    name, format_labels(label_names, label_values), format_value(value)
+                )
+            )
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels=(), collect=None):
+        # collect returns {label values: value}, read on every scrape
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+
+    def set(self, *labels, value):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def samples(self):
+        if self.collect is not None:
+            values = self.collect()
+            with self.lock:
+                self.values = dict(
+                    (self.key(labels), value) for labels, value in values.items()
+                )
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels=(), buckets=REQUEST_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, *labels, value: float):
+        key = self.key(labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0.0))
+            counts[position] += 1
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self.values.items()]
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(
+                    (self.name + "_bucket", self.labels + ("le",), key + (format_value(bound),), cumulative)
+                )
+            samples.append((self.name + "_sum", self.labels, key, total))
+            samples.append((self.name + "_count", self.labels, key, cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def register(self, metric: Metric) -> Metric:
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError("{} is already registered".format(metric.name))
+            self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+# scrapyrt resources
+requests_duration = registry.histogram(
+    "nist_http_request_duration_seconds",
+    "Time to answer an API request, by resource",
+    ["resource", "method", "code"],
+)
+lookups = registry.counter(
+    "nist_crawl_lookups_total",
+    "Substances asked for through crawl.json, by where they were found "
+    "(cache, database or crawl)",
+    ["source"],
+)
+revalidations = registry.counter(
+    "nist_revalidations_total",
+    "Stale substances served by crawl.json, by what happened to their background "
+    "crawl (started, skipped, failed)",
+    ["result"],
+)
+
+# MongoDB
+mongo_duration = registry.histogram(
+    "nist_mongo_command_duration_seconds",
+    "Duration of the MongoDB commands, by command",
+    ["command"],
+    buckets=MONGO_BUCKETS,
+)
+mongo_failures = registry.counter(
+    "nist_mongo_command_failures_total",
+    "MongoDB commands that failed, by command",
+    ["command"],
+)
+
+# NIST WebBook downloads
+download_latency = registry.histogram(
+    "nist_download_latency_seconds",
+    "Time to download a page of the NIST WebBook, cached pages left out",
+    buckets=DOWNLOAD_BUCKETS,
+)
+download_responses = registry.counter(
+    "nist_download_responses_total",
+    "Responses of the NIST WebBook, by status code",
+    ["status"],
+)
+download_errors = registry.counter(
+    "nist_download_errors_total",
+    "Downloads of the NIST WebBook that failed, by exception",
+    ["exception"],
+)
+
+# MongoPipeline
+pipeline_items = registry.counter(
+    "nist_pipeline_items_total",
+    "Items written by the MongoPipeline, by result (inserted, updated, unchanged, "
+    "duplicate, failed, retried)",
+    ["result"],
+)
+pipeline_rate = registry.gauge(
+    "nist_pipeline_items_per_second",
+    "Items written per second by the MongoPipeline since its spider opened",
+    ["spider"],
+)
+
+
+class CommandTimingListener(monitoring.CommandListener):
+    # Times every command of the shared MongoClient
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_duration.observe(event.command_name, value=event.duration_micros / 1e6)
+
+    def failed(self, event):
+        mongo_duration.observe(event.command_name, value=event.duration_micros / 1e6)
+        mongo_failures.inc(event.command_name)
+
+
+class RateMeter:
+    # Items per second of a spider, for the pipeline_rate gauge
+
+    def __init__(self, spider: str):
+        self.spider = spider
+        self.started = time.monotonic()
+        self.count = 0
+
+    def add(self, count: int):
+        self.count += count
+        elapsed = time.monotonic() - self.started
+        if elapsed > 0:
+            pipeline_rate.set(self.spider, value=self.count / elapsed)
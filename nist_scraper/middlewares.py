@@ -3,11 +3,19 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import time
+
 from scrapy import signals
+from scrapy.exceptions import IgnoreRequest
+from twisted.internet import reactor, task
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+from nist_scraper import metrics
+from nist_scraper.tracing import trace_of
+from nist_scraper.upstream import UpstreamUnavailable, rejections, retry_after, upstream
+
 
 class NistScraperSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -61,10 +69,15 @@ class NistScraperDownloaderMiddleware:
     # scrapy acts as if the downloader middleware does not modify the
     # passed objects.
 
+    def __init__(self, fail_fast=False):
+        # The scrapyrt crawls fail fast while the WebBook is unavailable,
+        # the others wait for it
+        self.fail_fast = fail_fast
+
     @classmethod
     def from_crawler(cls, crawler):
         # This method is used by Scrapy to create your spiders.
-        s = cls()
+        s = cls(fail_fast=crawler.settings.getbool("UPSTREAM_FAIL_FAST", False))
         crawler.signals.connect(s.spider_opened, signal=signals.spider_opened)
         return s
 
@@ -78,8 +91,36 @@ class NistScraperDownloaderMiddleware:
         # - or return a Request object
         # - or raise IgnoreRequest: process_exception() methods of
         #   installed downloader middleware will be called
+
+        # Rate limiter and circuit breaker shared by the crawls of the
+        # process, see nist_scraper/upstream.py
+        site = upstream(request.url)
+        trips = site.breaker.trips
+        try:
+            delay = site.acquire(self.fail_fast)
+        except UpstreamUnavailable as e:
+            return self.unavailable(e, request, spider)
+        if delay > 0:
+            return task.deferLater(reactor, delay, self.admit, site, trips, request, spider)
         return None
 
+    def admit(self, site, trips, request, spider):
+        try:
+            site.admit(trips)
+        except UpstreamUnavailable as e:
+            return self.unavailable(e, request, spider)
+
+    def unavailable(self, exception, request, spider):
+        # Failing fast the request is dropped, otherwise it is tried again
+        # once the circuit may let it through (a second at least, a single
+        # probe goes through a half open circuit)
+        if self.fail_fast:
+            rejections.inc(exception.host, exception.reason)
+            raise exception
+        return task.deferLater(
+            reactor, max(1.0, exception.retry_after), self.process_request, request, spider
+        )
+
     def process_response(self, request, response, spider):
         # Called with the response returned from the downloader.
 
@@ -87,6 +128,25 @@ class NistScraperDownloaderMiddleware:
         # - return a Response object
         # - return a Request object
         # - or raise IgnoreRequest
+
+        # Cache hits are answered by the process_request of the HTTP cache
+        # but come back through here too, the WebBook never saw them
+        latency = request.meta.get("download_latency")
+        if "cached" in response.flags or latency is None:
+            return response
+
+        metrics.download_responses.inc(response.status)
+        upstream(request.url).response(
+            response.status, latency, retry_after(response.headers.get("Retry-After"))
+        )
+        metrics.download_latency.observe(value=latency)
+        trace_of(spider, request).add(
+            "download",
+            time.perf_counter() - latency,
+            latency,
+            url=request.url,
+            status=response.status,
+        )
         return response
 
     def process_exception(self, request, exception, spider):
@@ -97,7 +157,12 @@ class NistScraperDownloaderMiddleware:
         # - return None: continue processing this exception
         # - return a Response object: stops process_exception() chain
         # - return a Request object: stops process_exception() chain
-        pass
+        if isinstance(exception, UpstreamUnavailable):
+            return None
+        metrics.download_errors.inc(type(exception).__name__)
+        # Requests ignored by other middlewares (robots.txt) were not sent
+        if not isinstance(exception, IgnoreRequest):
+            upstream(request.url).error()
 
     def spider_opened(self, spider):
         spider.logger.info('Spider opened: %s' % spider.name)
@@ -5,11 +5,26 @@
 
 
 # useful for handling different item types with a single interface
-import pymongo
 import logging
 import os
 from itemadapter import ItemAdapter
 from dotenv import load_dotenv
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from twisted.internet import defer, task
+from twisted.python.failure import Failure
+
+from nist_scraper import metrics
+from nist_scraper.autocomplete import name_index
+from nist_scraper.cache import substance_cache, substance_key
+from nist_scraper.codec import pack_document
+from nist_scraper.database import connection
+from nist_scraper.freshness import stamp
+from nist_scraper.identifiers import InvalidIdentifier, canonical_document
+from nist_scraper.scrapyrt import threads
+from nist_scraper.search import formula_elements
+from nist_scraper.snapshot import snapshot
+from nist_scraper.tracing import trace_of
 
 load_dotenv()
 
@@ -17,41 +32,268 @@ load_dotenv()
 class MongoPipeline:
     collection_name = "substances"
 
-    def __init__(self, mongo_uri, mongo_db):
+    def __init__(self, mongo_uri, mongo_db, bulk_size=100, bulk_interval=5.0,
+                 pack_series=False, buffer_max=10000):
         self.mongo_uri = mongo_uri
         self.mongo_db = mongo_db
+        self.bulk_size = bulk_size
+        self.bulk_interval = bulk_interval
+        self.pack_series = pack_series
+        self.buffer_max = max(buffer_max, bulk_size)
 
     @classmethod
     def from_crawler(cls, crawler):
         return cls(
             mongo_uri=os.environ.get("MONGO_URI"),
             mongo_db=os.environ.get("MONGO_DB"),
+            bulk_size=crawler.settings.getint("MONGO_BULK_SIZE", 100),
+            bulk_interval=crawler.settings.getfloat("MONGO_BULK_INTERVAL", 5.0),
+            pack_series=crawler.settings.getbool("MONGO_PACK_SERIES", False),
+            buffer_max=crawler.settings.getint("MONGO_BUFFER_MAX", 10000),
         )
 
-    # def open_spider(self, spider):
-    #     self.client = pymongo.MongoClient(self.mongo_uri)
-    #     self.db = self.client[self.mongo_db]
+    def open_spider(self, spider):
+        # The client is shared with the rest of the process, so it is not
+        # closed when the spider finishes
+        self.client = connection.client
+        self.db = self.client[self.mongo_db]
+        self.buffer = []
+        self.inserted = 0
+        self.updated = 0
+        self.duplicates = 0
+        self.dropped = 0
+
+        # The write in progress, if any, and whether the last one failed:
+        # then only the flush loop tries again
+        self.writing = None
+        self.failing = False
+
+        # Bulk runs checkpoint the identifiers once they are written
+        self.checkpoint = getattr(spider, "checkpoint", None)
+        self.queries = []
+
+        # Items per second, exposed by the /metrics resource
+        self.rate = metrics.RateMeter(spider.name)
+        # Timings of the crawl.json request the spider runs for, if asked
+        self.trace = trace_of(spider)
 
+        # Items are also written every bulk_interval seconds so a slow crawl
+        # does not keep them in memory until the buffer is full
+        self.flush_loop = task.LoopingCall(self.flush)
+        self.flush_loop.start(self.bulk_interval, now=False)
+
+    @defer.inlineCallbacks
     def close_spider(self, spider):
-        self.client.close()
+        if self.flush_loop.running:
+            self.flush_loop.stop()
+        # The write in progress, then what was buffered meanwhile
+        yield self.flush()
+        yield self.flush()
+        if self.buffer:
+            logging.error(
+                "MongoPipeline could not write {} items, the database is "
+                "unreachable".format(len(self.buffer))
+            )
+        logging.info(
+            "MongoPipeline inserted {} items, updated {}, {} were already in the "
+            "database, {} were dropped".format(
+                self.inserted, self.updated, self.duplicates, self.dropped)
+        )
+        logging.info("MongoDB pool statistics: {}".format(connection.stats()))
 
     def process_item(self, item, spider):
 
-        try:
-            self.client = pymongo.MongoClient(self.mongo_uri)
-            self.db = self.client[self.mongo_db]
-        except:
-            logging.info("Error connecting with database")
-            return item
-
         has_image = "image" in item.keys()
-        duplicate = (
-            self.db[self.collection_name].count_documents({"cas": item["cas"]}) > 0
-        )
-        if has_image and not duplicate:
-            self.db[self.collection_name].insert_one(ItemAdapter(item).asdict())
+        if has_image and "cas" in item.keys():
+            if len(self.buffer) >= self.buffer_max:
+                # The database has been unreachable for a while. A bulk run
+                # crawls the item again when resumed, it is not checkpointed.
+                self.dropped += 1
+                metrics.pipeline_items.inc("dropped")
+                logging.error(
+                    'The item "{}" is dropped, {} items are waiting for the '
+                    "database already".format(item["cas"], len(self.buffer))
+                )
+                return item
+            document = ItemAdapter(item).asdict()
+            self.queries.append(document.pop("query", None))
+            # Stored with the identifiers the lookups use
+            document.update(canonical_document(document))
+            # Searched by element, see nist_scraper/search.py
+            if "formula" in document:
+                document["elements"] = formula_elements(document["formula"])
+            # Fetch time and content hash, see nist_scraper/freshness.py
+            document = stamp(document)
+            # The series as float64 arrays, see nist_scraper/codec.py
+            if self.pack_series:
+                document = pack_document(document)
+            self.buffer.append(document)
+            if len(self.buffer) >= self.bulk_size and not self.failing:
+                self.flush()
         else:
             logging.info(
-                'The item "{}" is already in the database'.format(item["name"])
+                'The item "{}" has no image and it is not stored'.format(item["name"])
             )
+            if self.checkpoint is not None and "query" in item.keys():
+                self.checkpoint.mark([item["query"]])
         return item
+
+    def flush(self):
+        # Deferred fired once the buffer is written. pymongo blocks, the
+        # writes run in the database thread pool one at a time, and the
+        # Deferred never fails so the flush loop keeps running.
+        if self.writing is not None:
+            return self.writing
+        if not self.buffer:
+            return defer.succeed(None)
+
+        documents, self.buffer = self.buffer, []
+        queries, self.queries = self.queries, []
+        collection = self.db[self.collection_name]
+        writing = self.writing = threads.run_in_thread(self.write, collection, documents)
+        writing.addCallbacks(
+            self.written, self.write_failed,
+            callbackArgs=(documents, queries), errbackArgs=(documents, queries))
+        writing.addBoth(self.write_finished)
+        return writing
+
+    def write(self, collection, documents):
+        # New CAS are inserted, the stored substances are only rewritten when
+        # their content changed, otherwise just their fetched_at is updated.
+        # Runs in the database thread pool.
+        failed = set()
+        with self.trace.span("mongo_write", items=len(documents)):
+            stored = self.stored_hashes(collection, documents)
+            requests = []
+            new, changed, unchanged = set(), set(), set()
+            for index, document in enumerate(documents):
+                if document["cas"] not in stored:
+                    new.add(index)
+                    requests.append(
+                        UpdateOne(
+                            {"cas": document["cas"]}, {"$setOnInsert": document}, upsert=True
+                        )
+                    )
+                elif stored[document["cas"]] != document["content_hash"]:
+                    changed.add(index)
+                    requests.append(ReplaceOne({"cas": document["cas"]}, document))
+                else:
+                    unchanged.add(index)
+                    requests.append(
+                        UpdateOne(
+                            {"cas": document["cas"]},
+                            {"$set": {"fetched_at": document["fetched_at"]}},
+                        )
+                    )
+            try:
+                result = collection.bulk_write(requests, ordered=False)
+                inserted = result.upserted_count
+                upserted = list(result.upserted_ids)
+            except BulkWriteError as e:
+                # Duplicate key errors happen when another process inserted the
+                # same CAS between the upsert lookup and the insert
+                inserted = e.details.get("nUpserted", 0)
+                upserted = [upsert["index"] for upsert in e.details.get("upserted", [])]
+                errors = e.details.get("writeErrors", [])
+                logging.warning("{} errors writing items to the database".format(len(errors)))
+                # Duplicates are stored already, anything else is crawled again
+                # by the next bulk run
+                failed = set(error["index"] for error in errors if error.get("code") != 11000)
+
+        # The columnar snapshot, once built, gets the new and changed
+        # substances, its last row of a CAS wins. Appending takes a file lock
+        # and can compact the segments, so it is done here, off the reactor,
+        # and in the order of the writes.
+        written = sorted(set(upserted) | (changed - failed))
+        if written and snapshot.exists():
+            try:
+                snapshot.append([documents[index] for index in written])
+            except OSError as e:
+                logging.warning("Could not update the snapshot: {}".format(e))
+
+        return {
+            "inserted": inserted,
+            "upserted": upserted,
+            "new": new - failed,
+            "changed": changed - failed,
+            "unchanged": unchanged - failed,
+            "failed": failed,
+        }
+
+    def written(self, result, documents, queries):
+        self.failing = False
+        inserted, upserted = result["inserted"], result["upserted"]
+        new, changed, unchanged = result["new"], result["changed"], result["unchanged"]
+        failed = result["failed"]
+        self.inserted += inserted
+        self.updated += len(changed)
+        self.duplicates += len(new) - inserted + len(unchanged)
+        metrics.pipeline_items.inc("inserted", amount=inserted)
+        metrics.pipeline_items.inc("updated", amount=len(changed))
+        metrics.pipeline_items.inc("unchanged", amount=len(unchanged))
+        metrics.pipeline_items.inc("duplicate", amount=len(new) - inserted)
+        metrics.pipeline_items.inc("failed", amount=len(failed))
+        self.rate.add(len(documents))
+
+        for document in documents:
+            self.invalidate_cache(document)
+
+        # The name index of the scrapyrt process learns the new substances
+        if name_index.loaded:
+            for index in upserted:
+                name_index.add(documents[index])
+
+        if self.checkpoint is not None:
+            self.checkpoint.mark(
+                query
+                for index, query in enumerate(queries)
+                if query is not None and index not in failed
+            )
+
+    def write_failed(self, failure, documents, queries):
+        if failure.check(PyMongoError):
+            # The database is unreachable (ServerSelectionTimeoutError...):
+            # the items go back to the buffer, and until a write succeeds
+            # only the flush loop tries again
+            logging.warning(
+                "Could not write {} items to the database, they are written "
+                "again later: {}".format(len(documents), failure.getErrorMessage())
+            )
+            metrics.pipeline_items.inc("retried", amount=len(documents))
+            self.buffer[:0] = documents
+            self.queries[:0] = queries
+            self.failing = True
+        else:
+            logging.error(
+                "Could not write {} items to the database: {}".format(
+                    len(documents), failure.getTraceback())
+            )
+            metrics.pipeline_items.inc("failed", amount=len(documents))
+
+    def write_finished(self, result):
+        self.writing = None
+        if isinstance(result, Failure):
+            logging.error("Could not handle the written items: {}".format(result.getTraceback()))
+        # Items buffered while writing
+        if len(self.buffer) >= self.bulk_size and not self.failing:
+            self.flush()
+
+    def stored_hashes(self, collection, documents):
+        return dict(
+            (document["cas"], document.get("content_hash"))
+            for document in collection.find(
+                {"cas": {"$in": [document["cas"] for document in documents]}},
+                {"_id": 0, "cas": 1, "content_hash": 1},
+            )
+        )
+
+    def invalidate_cache(self, item):
+        # Drop the cached lookups of this substance so the API reads the new
+        # document from the database
+        for search_by in ["cas", "name"]:
+            if search_by in item.keys():
+                try:
+                    key = substance_key(search_by, item[search_by])
+                except InvalidIdentifier:
+                    continue
+                substance_cache.invalidate(key)
@@ -0,0 +1,15 @@
+# Crawl manager of the scrapyrt crawls
+#
+# The crawls answering an HTTP request fail fast while the WebBook is
+# unavailable (see nist_scraper/upstream.py), a client is better served by a
+# 503 than by waiting for the end of the cooldown. The command line and bulk
+# crawls keep the project settings and wait.
+
+from scrapyrt.core import CrawlManager
+
+
+class FailFastCrawlManager(CrawlManager):
+    def get_project_settings(self):
+        settings = super(FailFastCrawlManager, self).get_project_settings()
+        settings.set("UPSTREAM_FAIL_FAST", True, priority="cmdline")
+        return settings
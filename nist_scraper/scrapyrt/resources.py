@@ -1,17 +1,70 @@
-import os
+import itertools
 import json
+import logging
+import os
+import time
+import zlib
 
-from pymongo import MongoClient
+import numpy as np
+from itemadapter import ItemAdapter
+
+from twisted.internet.defer import Deferred
+from twisted.web import resource, server
 from twisted.web.error import Error
-from dotenv import load_dotenv
-load_dotenv()
 
-from scrapyrt.resources import CrawlResource, ServiceResource
+from scrapyrt.resources import CrawlResource, RealtimeApi, ServiceResource
+from scrapyrt.utils import extract_scrapy_request_args
+
+from nist_scraper.cache import TTLCache, substance_cache, substance_key
+from nist_scraper.codec import unpack_document
+from nist_scraper.database import connection
+from nist_scraper.freshness import FRESHNESS_MAX_REFRESHES, is_stale
+from nist_scraper.scrapyrt import threads
+from nist_scraper.scrapyrt.singleflight import crawls
+from nist_scraper.scrapyrt.warm import warm_crawlers
+from nist_scraper import metrics, thermo, tracing, upstream
+from nist_scraper.autocomplete import name_index
+from nist_scraper.identifiers import InvalidIdentifier, canonical
+from nist_scraper.search import build_filter
+from nist_scraper.snapshot import COLUMNS, NUMBER_COLUMNS, parse_where, snapshot
+
+
+# Total of substances, refreshed every SUBSTANCES_COUNT_TTL seconds
+count_cache = TTLCache(
+    maxsize=1, ttl=float(os.environ.get("SUBSTANCES_COUNT_TTL", 60)))
+
+# Rate limiter and circuit breaker of the WebBook downloads
+webbook = upstream.upstream("https://webbook.nist.gov/cgi/cbook.cgi")
+
+# Largest number of substances returned by a search
+SEARCH_MAX_LIMIT = int(os.environ.get("SEARCH_MAX_LIMIT", 1000))
 
+# Largest number of temperatures evaluated in one request
+EVALUATE_MAX_POINTS = int(os.environ.get("EVALUATE_MAX_POINTS", 1000000))
+
+
+def positive_int(api_params, name, default, maximum=None):
+    # A url parameter that must be a positive integer, a 400 otherwise
+    try:
+        value = int(api_params.get(name, default))
+    except ValueError:
+        raise Error('400', "{} must be an integer".format(name))
+    if value <= 0:
+        raise Error('400', "{} must be positive".format(name))
+    if maximum is not None and value > maximum:
+        raise Error('400', "{} must be at most {}".format(name, maximum))
+    return value
 
 
 class CheckDatabaseBeforeCrawlResource(CrawlResource):
 
+    def __init__(self, root=None, **kwargs):
+        super(CheckDatabaseBeforeCrawlResource, self).__init__(root)
+        # Crawlers kept open for single substances, see warm.py
+        warm_crawlers.start()
+        # Background crawls of stale substances running
+        self.refreshes = 0
+
     def render_GET(self, request, **kwargs):
 
         # Get the url parameters
@@ -20,68 +73,344 @@ class CheckDatabaseBeforeCrawlResource(CrawlResource):
             for name, value in request.args.items()
         )
 
-        crawl_args = json.loads(api_params["crawl_args"])
-            
+        # trace=true adds the time spent in every stage to the response,
+        # profile=true also samples the reactor thread meanwhile
+        profile = self.enabled(api_params, 'profile')
+        if not profile and not self.enabled(api_params, 'trace'):
+            return self.lookup(request, api_params, **kwargs)
+
+        trace = tracing.start(profile)
+        kwargs["trace_id"] = trace.id
         try:
+            result = self.lookup(request, api_params, **kwargs)
+        except Exception:
+            trace.close()
+            raise
+        if isinstance(result, Deferred):
+            return result.addBoth(trace.attach)
+        return trace.attach(result)
+
+    def enabled(self, api_params, name):
+        return api_params.get(name, '').lower() in ['true', '1', 'yes']
+
+    def lookup(self, request, api_params, **kwargs):
+        trace = tracing.get(kwargs.get("trace_id"))
+
+        try:
+            crawl_args = json.loads(api_params["crawl_args"])
             search_by = crawl_args["search_by"]
             value = crawl_args[search_by]
+        except (KeyError, TypeError, ValueError) as e:
+            raise Error('400', "crawl_args needs search_by and its value ({})".format(
+                "missing {}".format(e) if isinstance(e, KeyError) else e))
+
+        # Malformed CAS numbers and InChIKeys are rejected before any lookup
+        try:
+            for identifier in value if isinstance(value, list) else [value]:
+                key = substance_key(search_by, identifier)
+        except InvalidIdentifier as e:
+            raise Error('400', str(e))
+
+        # A list of identifiers is resolved in batch mode
+        if isinstance(value, list):
+            return self.render_batch(request, api_params, search_by, value, **kwargs)
+
+        # Hot substances are served from memory
+        with trace.span("cache"):
+            substance = substance_cache.get(key)
+        if substance:
+            metrics.lookups.inc("cache")
+            return self.render_substance(substance, request, key, **kwargs)
+
+        # Checking DDBB, the query runs outside the reactor thread
+        dfd = threads.run_in_thread(self.find_substance, search_by, value)
+        dfd.addCallback(trace.timer("precheck"))
+        dfd.addCallback(self.cache_substance, key)
+        dfd.addCallback(self.render_substance, request, key, **kwargs)
+        return dfd
 
-            # Checking DDBB
-            client = MongoClient(os.environ.get("MONGO_URI"))
-            db = client[os.environ.get("MONGO_DB")]
-        except Exception as e:
-            print(e)
-            return 
+    def find_substance(self, search_by, value):
         collection_name = "substances"
-        substance = db[collection_name].find_one({search_by: value}, {"_id":0})
+        collection = connection.collection(collection_name)
+        substance = collection.find_one(
+            {search_by: canonical(search_by, value)}, {"_id":0})
+
+        # Synonyms of a stored substance are resolved before crawling
+        if substance is None and search_by == "name" and name_index.loaded:
+            cas = name_index.resolve(value)
+            if cas:
+                substance = collection.find_one({"cas": cas}, {"_id":0})
+        return unpack_document(substance)
+
+    def find_substances(self, search_by, values):
+        # One query for the whole batch, the documents are returned by their
+        # canonical identifier
+        collection_name = "substances"
+        substances = connection.collection(collection_name).find(
+            {search_by: {"$in": [canonical(search_by, value) for value in values]}},
+            {"_id":0})
+        return dict(
+            (substance[search_by], unpack_document(substance)) for substance in substances)
+
+    def cache_substance(self, substance, key):
+        if substance:
+            metrics.lookups.inc("database")
+            substance_cache.set(key, substance)
+        return substance
+
+    def render_substance(self, substance, request, key, **kwargs):
         if substance:
+            # Served as it is, and crawled again if it is too old, see
+            # nist_scraper/freshness.py
+            if is_stale(substance) and webbook.available():
+                self.revalidate(request, key, **kwargs)
+
             response = {
             "status": "ok",
             "items": [substance],
             }
 
             return response
-        
-        return super(CheckDatabaseBeforeCrawlResource, self).render_GET(
-        request, **kwargs)
+
+        # While the circuit breaker is open a crawl would only fail, so does
+        # the request, at once
+        if not webbook.available():
+            self.unavailable(request)
+
+        # Concurrent requests for the same substance share a single crawl
+        metrics.lookups.inc("crawl")
+        flight = self.flight_key(request, key)
+        trace = tracing.get(kwargs.get("trace_id"))
+        trace.mark("crawl")
+        timer = trace.timer("crawl", coalesced=flight in crawls.calls)
+        dfd = crawls.run(flight, self.crawl_substance, request, key, **kwargs)
+        return dfd.addCallback(timer)
+
+    def unavailable(self, request):
+        retry_after = webbook.stats()["retry_after"]
+        request.setHeader('Retry-After', str(int(retry_after) + 1))
+        raise Error('503', "The NIST WebBook is unavailable, retry in {:.0f} seconds".format(
+            retry_after))
+
+    def flight_key(self, request, key):
+        # Crawls are only shared by the requests for the same spider and
+        # crawl arguments, combined=true for instance crawls other pages
+        spider_name = request.args.get(b"spider_name", [b""])[0]
+        crawl_args = json.loads(request.args[b"crawl_args"][0].decode('utf-8'))
+        search_by = crawl_args.pop("search_by")
+        crawl_args.pop(search_by, None)
+        return (spider_name,) + key + (json.dumps(crawl_args, sort_keys=True),)
+
+    def revalidate(self, request, key, **kwargs):
+        flight = self.flight_key(request, key)
+        if flight in crawls.calls:
+            return
+        if self.refreshes >= FRESHNESS_MAX_REFRESHES:
+            metrics.revalidations.inc("skipped")
+            return
+
+        # The timings of the request do not wait for it
+        kwargs.pop("trace_id", None)
+        self.refreshes += 1
+        metrics.revalidations.inc("started")
+        dfd = crawls.run(flight, self.crawl_substance, request, key, **kwargs)
+        dfd.addErrback(self.revalidation_failed, key)
+        dfd.addBoth(self.revalidated)
+
+    def revalidation_failed(self, failure, key):
+        metrics.revalidations.inc("failed")
+        logging.warning("Could not refresh {}: {}".format(key, failure.getErrorMessage()))
+
+    def revalidated(self, _):
+        self.refreshes -= 1
+
+    def crawl_substance(self, request, key, **kwargs):
+        api_params = dict(
+            (name.decode('utf-8'), value[0].decode('utf-8'))
+            for name, value in request.args.items()
+        )
+        crawl_args = json.loads(api_params["crawl_args"])
+        search_by = crawl_args["search_by"]
+
+        # The warm crawler of the spider takes the substance, unless the
+        # crawl has other arguments than the identifier
+        crawler = warm_crawlers.get(api_params.get("spider_name"))
+        if crawler is None or set(crawl_args) - {"search_by", search_by}:
+            return super(CheckDatabaseBeforeCrawlResource, self).render_GET(
+                request, **kwargs)
+
+        dfd = crawler.crawl(search_by, crawl_args[search_by], kwargs.get("trace_id"))
+        dfd.addCallback(self.cache_crawled, key)
+        dfd.addCallback(self.prepare_response)
+        return dfd
+
+    def cache_crawled(self, result, key):
+        # The warm crawler's pipeline writes the item a few seconds later,
+        # the cache answers meanwhile, as a fresh substance
+        if result["items"]:
+            substance = ItemAdapter(result["items"][0]).asdict()
+            substance["fetched_at"] = time.time()
+            substance_cache.set(key, substance)
+        return result
+
+
+    def render_batch(self, request, api_params, search_by, values, **kwargs):
+        results = {}
+        remaining = []
+        for value in values:
+            substance = substance_cache.get(substance_key(search_by, value))
+            if substance:
+                results[value] = substance
+            else:
+                remaining.append(value)
+        metrics.lookups.inc("cache", amount=len(values) - len(remaining))
+
+        if not remaining:
+            return self.render_batch_response({}, results, search_by, values)
+
+        dfd = threads.run_in_thread(self.find_substances, search_by, remaining)
+        dfd.addCallback(tracing.get(kwargs.get("trace_id")).timer("precheck"))
+        dfd.addCallback(self.crawl_batch, results, api_params, search_by,
+            remaining, values, **kwargs)
+        return dfd
+
+    def crawl_batch(self, found, results, api_params, search_by, remaining,
+        values, **kwargs):
+        # Identifiers of the same substance ("64-17-5" and "64175") are
+        # crawled once, the dupefilter would drop the second request
+        misses = {}
+        for value in remaining:
+            key = substance_key(search_by, value)
+            substance = found.get(key[1])
+            if substance:
+                substance_cache.set(key, substance)
+                results[value] = substance
+            else:
+                misses.setdefault(key, value)
+        metrics.lookups.inc("database", amount=len(remaining) - sum(
+            value not in results for value in remaining))
+        misses = list(misses.values())
+
+        if not misses:
+            return self.render_batch_response({}, results, search_by, values)
+
+        # The substances found are still returned while the circuit breaker
+        # is open
+        if not webbook.available():
+            return self.render_batch_response({"errors": [
+                "The NIST WebBook is unavailable, retry in {:.0f} seconds".format(
+                    webbook.stats()["retry_after"])]}, results, search_by, values)
+
+        # Every identifier missing in the database goes into a single crawl
+        metrics.lookups.inc("crawl", amount=len(misses))
+        api_params = dict(api_params)
+        api_params["crawl_args"] = json.dumps({"search_by": search_by, search_by: misses})
+        scrapy_request_args = extract_scrapy_request_args(api_params,
+            raise_error=False)
+        self.validate_options(scrapy_request_args, api_params)
+
+        trace = tracing.get(kwargs.get("trace_id"))
+        trace.mark("crawl")
+        timer = trace.timer("crawl", identifiers=len(misses))
+        dfd = self.prepare_crawl(api_params, scrapy_request_args, **kwargs)
+        dfd.addCallback(timer)
+        dfd.addCallback(self.render_batch_response, results, search_by, values)
+        return dfd
+
+    def render_batch_response(self, crawl_response, results, search_by, values):
+        # Crawled items carry the identifier they were requested with, and
+        # answer every identifier of the same substance
+        for item in crawl_response.get("items") or []:
+            query = item.pop("query", None)
+            if query is not None:
+                results[query] = item
+        substances = dict(
+            (substance_key(search_by, value), substance)
+            for value, substance in results.items()
+        )
+
+        response = {
+            "status": "ok",
+            "items": dict(
+                (value, substances.get(substance_key(search_by, value))) for value in values
+            ),
+        }
+        if crawl_response.get("errors"):
+            response["errors"] = crawl_response["errors"]
+
+        return response
 
 
 class SubstancesResource(ServiceResource):
     # Return a list of name: cas pairs
+    projection = {
+        "_id" : 0,
+        "name" : 1, 
+        "cas" : 1, 
+        "formula" : 1,
+        "molecular_weight" : 1,
+        "image" : 1,
+    }
+
+    def __init__(self, root=None, **kwargs):
+        super(SubstancesResource, self).__init__(root)
+        # scrapyrt creates the resources once, when it starts
+        dfd = threads.run_in_thread(connection.ensure_indexes)
+        dfd.addErrback(
+            lambda failure: logging.warning(
+                "Could not create the indexes: {}".format(failure.getErrorMessage())
+            )
+        )
+
     def render_GET(self, request, **kwargs): 
         isLeaf = True
 
-        try:
-            client = MongoClient(os.environ.get("MONGO_URI"))
-            db = client[os.environ.get("MONGO_DB")]
-        except ValueError as e:
-            raise Error('400', str(e))
-
         # Get the url parameters
         api_params = dict(
             (name.decode('utf-8'), value[0].decode('utf-8'))
             for name, value in request.args.items()
         )
 
-        given_page = int(api_params['page']) if 'page' in api_params else 1
-        per_page = int(api_params['per_page']) if 'per_page' in api_params else 20
+        given_page = positive_int(api_params, 'page', 1)
+        per_page = positive_int(api_params, 'per_page', 20)
+
+        # Keyset pagination, the cost does not grow with the page depth. The
+        # stored CAS numbers are canonical, so is the one compared with them.
+        if 'after' in api_params:
+            after = api_params['after']
+            if after:
+                try:
+                    after = canonical("cas", after)
+                except InvalidIdentifier as e:
+                    raise Error('400', str(e))
+            return threads.run_in_thread(self.get_page_after, after, per_page)
 
+        return threads.run_in_thread(self.get_page, given_page, per_page)
+
+    def count_substances(self, collection):
+        # The total comes from the collection metadata and it is cached for a
+        # while, counting the documents on every page is a full scan
+        total_substances = count_cache.get("substances")
+        if total_substances is None:
+            total_substances = collection.estimated_document_count()
+            count_cache.set("substances", total_substances)
+        return total_substances
+
+    def get_page(self, given_page, per_page):
         collection_name = "substances"
-        total_substances = db[collection_name].count_documents({})
+        try:
+            collection = connection.collection(collection_name)
+        except ValueError as e:
+            raise Error('400', str(e))
+
+        total_substances = self.count_substances(collection)
         total_pages = int(total_substances/per_page) + 1
 
         page = given_page if given_page <= total_pages else total_pages
 
         # MongoDB query
-        substances = db[collection_name].find({}, {
-            "_id" : 0,
-            "name" : 1, 
-            "cas" : 1, 
-            "formula" : 1,
-            "molecular_weight" : 1,
-            "image" : 1,
-            
-        }).skip((page - 1) * per_page).limit(per_page)
+        substances = collection.find({}, self.projection).skip(
+            (page - 1) * per_page).limit(per_page)
         
 
         substances = list(substances)
@@ -95,4 +424,474 @@ class SubstancesResource(ServiceResource):
             "items" : substances,
         }
 
-        return response
\ No newline at end of file
+        return response
+
+    def get_page_after(self, after, per_page):
+        collection_name = "substances"
+        try:
+            collection = connection.collection(collection_name)
+        except ValueError as e:
+            raise Error('400', str(e))
+
+        # Walks the cas index, "after" is the last cas of the previous page
+        query = {"cas": {"$gt": after}} if after else {}
+        substances = collection.find(query, self.projection).sort(
+            "cas", 1).limit(per_page)
+
+        substances = list(substances)
+        response = {
+            "status": "ok",
+            "after": after,
+            "next": substances[-1]["cas"] if len(substances) == per_page else None,
+            "itemsPerPage": per_page,
+            "itemsInPage": len(substances),
+            "totalItems": self.count_substances(collection),
+            "items" : substances,
+        }
+
+        return response
+
+
+class ExportResource(resource.Resource):
+    # Stream the whole substances collection as NDJSON, one document per line.
+    # The documents are read from the cursor in batches in the database thread
+    # pool and the next batch is only read once the client has taken the
+    # previous one, so memory use does not depend on the collection size.
+    isLeaf = True
+
+    def __init__(self, root=None, **kwargs):
+        super(ExportResource, self).__init__()
+        self.root = root
+
+    def render_GET(self, request, **kwargs):
+
+        # Get the url parameters
+        api_params = dict(
+            (name.decode('utf-8'), value[0].decode('utf-8'))
+            for name, value in request.args.items()
+        )
+
+        batch_size = positive_int(api_params, 'batch_size',
+            os.environ.get("EXPORT_BATCH_SIZE", 500))
+        compress = api_params.get('gzip', 'false').lower() in ('1', 'true')
+
+        projection = {"_id": 0}
+        if api_params.get('fields'):
+            for field in api_params['fields'].split(','):
+                projection[field.strip()] = 1
+
+        request.setHeader(b"Content-Type", b"application/x-ndjson")
+        request.setHeader(b"Access-Control-Allow-Origin", b"*")
+        if compress:
+            request.setHeader(b"Content-Encoding", b"gzip")
+
+        NdjsonProducer(request, projection, batch_size, compress).start()
+        return server.NOT_DONE_YET
+
+
+class NdjsonProducer:
+    # Push producer registered on the request, Twisted pauses it while the
+    # transport buffer is full
+
+    def __init__(self, request, projection, batch_size, compress):
+        self.request = request
+        self.projection = projection
+        self.batch_size = batch_size
+        self.compressor = zlib.compressobj(wbits=31) if compress else None
+        self.cursor = None
+        self.paused = False
+        self.reading = False
+        self.done = False
+
+    def start(self):
+        self.request.registerProducer(self, True)
+        self.request.notifyFinish().addErrback(self.stopProducing)
+        self.read_batch()
+
+    def open_cursor(self):
+        collection_name = "substances"
+        return connection.collection(collection_name).find(
+            {}, self.projection, batch_size=self.batch_size)
+
+    def next_batch(self):
+        if self.cursor is None:
+            self.cursor = self.open_cursor()
+        return [unpack_document(substance)
+            for substance in itertools.islice(self.cursor, self.batch_size)]
+
+    def read_batch(self):
+        if self.done or self.paused or self.reading:
+            return
+        self.reading = True
+        dfd = threads.run_in_thread(self.next_batch)
+        dfd.addCallbacks(self.write_batch, self.fail)
+
+    def write_batch(self, substances):
+        self.reading = False
+        if self.done:
+            return self.close_cursor()
+
+        if not substances:
+            return self.finish()
+
+        chunk = "".join(
+            json.dumps(substance, default=str) + "\n" for substance in substances
+        ).encode("utf-8")
+        if self.compressor:
+            chunk = self.compressor.compress(chunk)
+        if chunk:
+            self.request.write(chunk)
+        self.read_batch()
+
+    def finish(self):
+        self.done = True
+        if self.compressor:
+            self.request.write(self.compressor.flush())
+        self.request.unregisterProducer()
+        self.request.finish()
+        self.close_cursor()
+
+    def fail(self, failure):
+        # Headers are already sent, so the only thing left is to drop the
+        # connection and let the client notice the truncated body
+        logging.error("Export failed: {}".format(failure.getErrorMessage()))
+        self.reading = False
+        self.done = True
+        self.request.unregisterProducer()
+        self.request.loseConnection()
+        self.close_cursor()
+
+    def close_cursor(self):
+        if self.cursor is not None:
+            threads.run_in_thread(self.cursor.close)
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.read_batch()
+
+    def stopProducing(self, *args):
+        # The client went away, a batch being read closes the cursor itself
+        if not self.done:
+            self.done = True
+            if not self.reading:
+                self.close_cursor()
+
+
+class HealthResource(ServiceResource):
+    # Return the database health, the connection pool and cache statistics
+    def render_GET(self, request, **kwargs):
+        dfd = threads.run_in_thread(connection.ping)
+        dfd.addCallback(self.render_health, request)
+        return dfd
+
+    def render_health(self, healthy, request):
+        if not healthy:
+            request.setResponseCode(503)
+
+        response = {
+            "status": "ok" if healthy else "error",
+            "database": {
+                "healthy": healthy,
+                "pool": connection.stats(),
+            },
+            "threadpool": threads.stats(),
+            "cache": substance_cache.stats(),
+            "crawls": crawls.stats(),
+            "warm_crawlers": warm_crawlers.stats(),
+            "upstream": upstream.stats(),
+            "snapshot": snapshot.stats(),
+            "autocomplete": name_index.stats(),
+        }
+
+        return response
+
+
+class PropertiesResource(ServiceResource):
+    # Evaluate the stored Shomate and Antoine equations of a substance at
+    # many temperatures: Cp, H - H298 and S for every phase with Shomate
+    # ranges and the vapor pressure. The temperatures are given as a list
+    # (temperatures=298.15,300,...) or as a range (tmin, tmax and points or
+    # step).
+    units = {
+        "temperatures": "K",
+        "heat_capacity": "J/mol*K",
+        "enthalpy": "kJ/mol",
+        "entropy": "J/mol*K",
+        "vapor_pressure": "bar",
+    }
+
+    def render_GET(self, request, **kwargs):
+
+        # Get the url parameters
+        api_params = dict(
+            (name.decode('utf-8'), value[0].decode('utf-8'))
+            for name, value in request.args.items()
+        )
+
+        search_by = "cas" if "cas" in api_params else "name"
+        if search_by not in api_params:
+            raise Error('400', "A cas or a name is required")
+
+        try:
+            substance_key(search_by, api_params[search_by])
+            temperatures = self.parse_temperatures(api_params)
+        except ValueError as e:
+            raise Error('400', str(e))
+
+        return threads.run_in_thread(self.evaluate, search_by,
+            api_params[search_by], temperatures)
+
+    def parse_temperatures(self, api_params):
+        if "temperatures" in api_params:
+            temperatures = np.array(
+                [float(value) for value in api_params["temperatures"].split(",")])
+        elif "tmin" in api_params and "tmax" in api_params:
+            tmin = float(api_params["tmin"])
+            tmax = float(api_params["tmax"])
+            if "step" in api_params:
+                step = float(api_params["step"])
+                if step <= 0:
+                    raise ValueError("step must be positive")
+                if (tmax - tmin) / step >= EVALUATE_MAX_POINTS:
+                    raise ValueError("Too many temperatures, the maximum is {}".format(
+                        EVALUATE_MAX_POINTS))
+                temperatures = np.arange(tmin, tmax + step / 2, step)
+            else:
+                points = int(api_params.get("points", 100))
+                if points > EVALUATE_MAX_POINTS:
+                    raise ValueError("Too many temperatures, the maximum is {}".format(
+                        EVALUATE_MAX_POINTS))
+                temperatures = np.linspace(tmin, tmax, max(points, 1))
+        else:
+            raise ValueError("Either temperatures or tmin and tmax are required")
+
+        if len(temperatures) > EVALUATE_MAX_POINTS:
+            raise ValueError("Too many temperatures, the maximum is {}".format(
+                EVALUATE_MAX_POINTS))
+        return temperatures
+
+    def find_substance(self, search_by, value):
+        key = substance_key(search_by, value)
+        substance = substance_cache.get(key)
+        if substance is None:
+            substance = unpack_document(connection.collection("substances").find_one(
+                {search_by: canonical(search_by, value)}, {"_id":0}))
+            if substance:
+                substance_cache.set(key, substance)
+        return substance
+
+    def evaluate(self, search_by, value, temperatures):
+        substance = self.find_substance(search_by, value)
+        if not substance:
+            raise Error('404', "Substance {} not found".format(value))
+
+        response = {
+            "status": "ok",
+            "name": substance.get("name"),
+            "cas": substance.get("cas"),
+            "units": self.units,
+            "temperatures": temperatures.tolist(),
+        }
+
+        for phase in ["gas", "liquid"]:
+            ranges = substance.get("heat_capacity_shomate_equation_{}".format(phase))
+            if ranges:
+                values = thermo.shomate(ranges, temperatures)
+                response[phase] = dict(
+                    (name, self.to_list(array)) for name, array in values.items())
+
+        if substance.get("antoine_equation"):
+            response["vapor_pressure"] = self.to_list(
+                thermo.antoine(substance["antoine_equation"], temperatures))
+
+        return response
+
+    def to_list(self, array):
+        # NaN is not valid JSON, the points without equation are null
+        missing = ~np.isfinite(array)
+        if not missing.any():
+            return array.tolist()
+        values = array.astype(object)
+        values[missing] = None
+        return values.tolist()
+
+
+class QueryResource(ServiceResource):
+    # Screening over the columnar snapshot of the scalar properties, e.g.
+    # where=temperature_critical>=400,temperature_critical<=600,molecular_weight<100
+    default_fields = ["cas", "name", "formula", "molecular_weight"]
+
+    def render_GET(self, request, **kwargs):
+
+        # Get the url parameters
+        api_params = dict(
+            (name.decode('utf-8'), value[0].decode('utf-8'))
+            for name, value in request.args.items()
+        )
+
+        try:
+            clauses = parse_where(api_params.get('where', ''))
+        except ValueError as e:
+            raise Error('400', str(e))
+
+        fields = list(self.default_fields)
+        if 'fields' in api_params:
+            fields = [field for field in api_params['fields'].split(',') if field]
+        fields += [column for column, _, _ in clauses if column not in fields]
+        unknown = [field for field in fields if field not in COLUMNS]
+        if unknown:
+            raise Error('400', "Unknown fields: {}".format(", ".join(unknown)))
+
+        limit = positive_int(api_params, 'limit', 100)
+
+        if not snapshot.exists():
+            raise Error('503', "The snapshot has not been built yet")
+
+        return threads.run_in_thread(self.query, clauses, fields, limit)
+
+    def query(self, clauses, fields, limit):
+        total, items = snapshot.query(clauses, fields, limit)
+        return {
+            "status": "ok",
+            "totalItems": total,
+            "itemsInPage": len(items),
+            "units": dict(
+                (field, units) for field, units in NUMBER_COLUMNS.items()
+                if field in fields and units),
+            "items": items,
+        }
+
+
+class SearchResource(ServiceResource):
+    # Range and multi-property search in the database, every condition is
+    # backed by an index (see nist_scraper/search.py), e.g.
+    # where=temperature_boil>=300,molecular_weight<100&elements=C,H,O
+    def render_GET(self, request, **kwargs):
+
+        # Get the url parameters
+        api_params = dict(
+            (name.decode('utf-8'), value[0].decode('utf-8'))
+            for name, value in request.args.items()
+        )
+
+        try:
+            query = build_filter(api_params.get('where', ''),
+                api_params.get('elements', ''))
+        except ValueError as e:
+            raise Error('400', str(e))
+
+        projection = dict(SubstancesResource.projection)
+        if 'fields' in api_params:
+            projection = dict(
+                (field, 1) for field in api_params['fields'].split(',') if field)
+            projection["_id"] = 0
+
+        limit = positive_int(api_params, 'limit', 100, SEARCH_MAX_LIMIT)
+
+        return threads.run_in_thread(self.search, query, projection, limit)
+
+    def search(self, query, projection, limit):
+        substances = [unpack_document(substance) for substance in connection.collection(
+            "substances").find(query, projection).limit(limit)]
+
+        return {
+            "status": "ok",
+            "itemsInPage": len(substances),
+            "items": substances,
+        }
+
+
+class AutocompleteResource(ServiceResource):
+    # Names, synonyms, CAS numbers and InChIKeys starting with q, completed
+    # with close names when fuzzy is not false
+    def __init__(self, root=None, **kwargs):
+        super(AutocompleteResource, self).__init__(root)
+        dfd = threads.run_in_thread(name_index.load,
+            connection.collection("substances"))
+        dfd.addErrback(
+            lambda failure: logging.warning(
+                "Could not load the name index: {}".format(failure.getErrorMessage())
+            )
+        )
+
+    def render_GET(self, request, **kwargs):
+
+        # Get the url parameters
+        api_params = dict(
+            (name.decode('utf-8'), value[0].decode('utf-8'))
+            for name, value in request.args.items()
+        )
+
+        if not api_params.get('q'):
+            raise Error('400', "q is required")
+        if not name_index.loaded:
+            raise Error('503', "The name index is still loading")
+
+        limit = min(positive_int(api_params, 'limit', 10), 100)
+        fuzzy = api_params.get('fuzzy', 'true').lower() not in ['false', '0', 'no']
+
+        # Answered on the reactor thread, the index is in memory
+        items = name_index.complete(api_params['q'], limit, fuzzy)
+        return {
+            "status": "ok",
+            "itemsInPage": len(items),
+            "items": items,
+        }
+
+
+# Saturation of the thread pools, read when the metrics are scraped
+metrics.registry.gauge(
+    "nist_threadpool_threads",
+    "Threads of the MongoDB and reactor thread pools, by state (busy, idle, max)",
+    ["pool", "state"],
+    collect=lambda: dict(
+        ((pool, state), stats.get(state + "_threads", 0))
+        for pool, stats in [("mongo", threads.stats()), ("reactor", threads.reactor_stats())]
+        for state in ["busy", "idle", "max"]
+    ),
+)
+metrics.registry.gauge(
+    "nist_threadpool_queued",
+    "Calls waiting for a thread, by pool",
+    ["pool"],
+    collect=lambda: {
+        ("mongo",): threads.stats().get("queued", 0),
+        ("reactor",): threads.reactor_stats().get("queued", 0),
+    },
+)
+
+
+class MeasuredRealtimeApi(RealtimeApi):
+    # scrapyrt root (SERVICE_ROOT) timing every request until its response
+    # is finished, Deferred results included
+    def getChildWithDefault(self, path, request):
+        started = time.perf_counter()
+        name = path.decode('utf-8', 'replace') if path in self.children else "unknown"
+
+        def observe(_):
+            metrics.requests_duration.observe(
+                name, request.method.decode('utf-8', 'replace'), request.code,
+                value=time.perf_counter() - started)
+
+        request.notifyFinish().addBoth(observe)
+        return super(MeasuredRealtimeApi, self).getChildWithDefault(path, request)
+
+
+class MetricsResource(ServiceResource):
+    # Metrics of the service in the Prometheus text format
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def render_GET(self, request, **kwargs):
+        return metrics.registry.render()
+
+    def render_object(self, obj, request):
+        if not isinstance(obj, str):
+            return super(MetricsResource, self).render_object(obj, request)
+
+        body = obj.encode('utf-8')
+        request.setHeader('Content-Type', self.content_type)
+        request.setHeader('Content-Length', str(len(body)))
+        return body
@@ -4,7 +4,20 @@
 #
 #     https://scrapyrt.readthedocs.io/en/latest/api.html#available-settings
 
+# Root resource timing every request for the /metrics resource
+SERVICE_ROOT = 'nist_scraper.scrapyrt.resources.MeasuredRealtimeApi'
+
+# Crawls failing fast while the WebBook is unavailable
+CRAWL_MANAGER = 'nist_scraper.scrapyrt.manager.FailFastCrawlManager'
+
 RESOURCES = {
     'crawl.json': 'nist_scraper.scrapyrt.resources.CheckDatabaseBeforeCrawlResource',
     'substances': 'nist_scraper.scrapyrt.resources.SubstancesResource',
-}
\ No newline at end of file
+    'substances.ndjson': 'nist_scraper.scrapyrt.resources.ExportResource',
+    'health': 'nist_scraper.scrapyrt.resources.HealthResource',
+    'properties': 'nist_scraper.scrapyrt.resources.PropertiesResource',
+    'query': 'nist_scraper.scrapyrt.resources.QueryResource',
+    'search': 'nist_scraper.scrapyrt.resources.SearchResource',
+    'autocomplete': 'nist_scraper.scrapyrt.resources.AutocompleteResource',
+    'metrics': 'nist_scraper.scrapyrt.resources.MetricsResource',
+}
@@ -0,0 +1,49 @@
+# In-flight request deduplication
+#
+# When several clients ask crawl.json for the same substance while it is not
+# in the database yet, only the first request starts a crawl. The others wait
+# for the same crawl and get its result, which avoids hitting NIST several
+# times for one substance and racing the duplicate check in MongoPipeline.
+#
+# Everything here runs on the reactor thread, so no locking is needed.
+
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.python.failure import Failure
+
+
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+        self.started = 0
+        self.coalesced = 0
+
+    def run(self, key, f, *args, **kwargs) -> Deferred:
+        if key in self.calls:
+            self.coalesced += 1
+            waiter = Deferred()
+            self.calls[key].append(waiter)
+            return waiter
+
+        self.started += 1
+        self.calls[key] = []
+        dfd = maybeDeferred(f, *args, **kwargs)
+        dfd.addBoth(self.finish, key)
+        return dfd
+
+    def finish(self, result, key):
+        for waiter in self.calls.pop(key):
+            if isinstance(result, Failure):
+                waiter.errback(result)
+            else:
+                waiter.callback(result)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self.calls),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
+
+
+crawls = SingleFlight()
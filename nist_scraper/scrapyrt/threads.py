@@ -0,0 +1,53 @@
+# Thread pool for blocking database calls
+#
+# pymongo is a blocking driver, so every query made from a scrapyrt resource
+# runs in this bounded pool instead of on the Twisted reactor thread. The
+# resources get a Deferred back and return it, scrapyrt then answers the
+# request with NOT_DONE_YET and finishes it when the Deferred fires.
+#
+#     https://docs.twisted.org/en/stable/core/howto/threading.html
+
+import os
+
+from twisted.internet import reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+_pool = None
+
+
+def get_pool() -> ThreadPool:
+    # The pool size can be set with MONGO_THREADPOOL_SIZE, it should not be
+    # larger than MONGO_MAX_POOL_SIZE or threads will wait for a connection
+    global _pool
+    if _pool is None:
+        size = int(os.environ.get("MONGO_THREADPOOL_SIZE", 10))
+        _pool = ThreadPool(minthreads=1, maxthreads=size, name="mongo")
+        _pool.start()
+        reactor.addSystemEventTrigger("during", "shutdown", _pool.stop)
+    return _pool
+
+
+def run_in_thread(f, *args, **kwargs):
+    return threads.deferToThreadPool(reactor, get_pool(), f, *args, **kwargs)
+
+
+def pool_stats(pool) -> dict:
+    if pool is None or not pool.started:
+        return {"started": False}
+    statistics = pool._team.statistics()
+    return {
+        "started": True,
+        "max_threads": pool.max,
+        "busy_threads": statistics.busyWorkerCount,
+        "idle_threads": statistics.idleWorkerCount,
+        "queued": statistics.backloggedWorkCount,
+    }
+
+
+def stats() -> dict:
+    return pool_stats(_pool)
+
+
+def reactor_stats() -> dict:
+    # The reactor's own pool, used by DNS lookups and deferToThread
+    return pool_stats(reactor.getThreadPool())
@@ -0,0 +1,274 @@
+# Warm crawlers
+#
+# scrapyrt builds a new Crawler for every crawl.json request: the settings
+# are loaded, the middlewares, extensions and pipelines are created, the
+# spider is opened and robots.txt is downloaded again before the substance
+# page is even requested. A warm crawler is started once per spider when
+# scrapyrt starts and kept open (its spider_idle raises DontCloseSpider). The
+# substances asked for are injected into its engine as new requests, and
+# robots.txt, the settings and the open MongoPipeline are reused.
+#
+# The items of every injected request are told apart by wrapping the
+# callbacks and errbacks of the request and of every request they yield: a
+# job is finished when none of its requests is left. A job that timed out
+# only loses its HTTP reply, its requests still run and its item is stored.
+#
+# The gain is small, the crawl itself dominates (p50 214 ms warm against
+# 222 ms cold offline, see the README), so the warm crawlers are opt-in. They
+# are configured with the following environment variables:
+#
+# WARM_SPIDERS (default: none, webbook_nist to warm up the substance crawls)
+# WARM_CRAWLER_TIMEOUT (default: 180 seconds per substance)
+
+import itertools
+import logging
+import os
+import time
+from scrapy import signals
+from scrapy.crawler import CrawlerRunner
+from scrapy.exceptions import DontCloseSpider
+from scrapy.http import Request
+from twisted.internet import defer, reactor
+from twisted.python.failure import Failure
+from twisted.web.error import Error
+
+from scrapyrt.core import ScrapyrtCrawler
+from scrapyrt.log import setup_spider_logging
+
+from nist_scraper.scrapyrt.manager import FailFastCrawlManager
+
+WARM_SPIDERS = [
+    name.strip()
+    for name in os.environ.get("WARM_SPIDERS", "").split(",")
+    if name.strip()
+]
+WARM_CRAWLER_TIMEOUT = float(os.environ.get("WARM_CRAWLER_TIMEOUT", 180))
+
+
+class Job:
+    # The requests made for one injected substance and what they produced
+    def __init__(self, token: int, trace_id: str = None):
+        self.token = token
+        self.trace_id = trace_id
+        self.started = time.perf_counter()
+        self.deferred = defer.Deferred()
+        self.timeout = None
+        self.outstanding = 0
+        self.requests = 0
+        self.items = []
+        self.errors = []
+
+
+class WarmCrawler:
+    def __init__(self, spider_name: str, settings=None, timeout: float = WARM_CRAWLER_TIMEOUT):
+        self.spider_name = spider_name
+        self.settings = settings
+        self.timeout = timeout
+        self.crawler = None
+        self.ready = None
+        self.jobs = {}
+        self.tokens = itertools.count()
+        self.shutdown_trigger = False
+
+    @property
+    def running(self) -> bool:
+        return self.crawler is not None and self.ready is not None and self.ready.called
+
+    def start(self) -> defer.Deferred:
+        if self.ready is not None:
+            return self.ready
+
+        # Settings of a scrapyrt crawl by default, with its own log file
+        settings = self.settings or FailFastCrawlManager(self.spider_name, {}).get_project_settings()
+        runner = CrawlerRunner(settings)
+        spidercls = runner.spider_loader.load(self.spider_name)
+        self.crawler = ScrapyrtCrawler(spidercls, runner.settings, start_requests=False)
+        self.crawler.signals.connect(self.spider_idle, signals.spider_idle)
+        self.crawler.signals.connect(self.spider_closed, signals.spider_closed)
+        self.crawler.signals.connect(self.request_dropped, signals.request_dropped)
+
+        # Fired once the engine takes requests, crawl() only fires when the
+        # crawler stops
+        self.ready = defer.Deferred()
+        self.crawler.signals.connect(self.engine_started, signals.engine_started)
+
+        dfd = runner.crawl(self.crawler)
+        cleanup_logging = setup_spider_logging(self.crawler.spider, runner.settings)
+        dfd.addBoth(lambda result: cleanup_logging() or result)
+        dfd.addErrback(self.crawl_failed)
+        if not self.shutdown_trigger:
+            self.shutdown_trigger = True
+            reactor.addSystemEventTrigger("before", "shutdown", self.stop)
+        return self.ready
+
+    def engine_started(self):
+        logging.info("Warm crawler {} started".format(self.spider_name))
+        if not self.ready.called:
+            self.ready.callback(self)
+
+    def crawl_failed(self, failure):
+        logging.warning(
+            "Warm crawler {} failed: {}".format(self.spider_name, failure.getErrorMessage())
+        )
+        if not self.ready.called:
+            self.ready.errback(failure)
+        self.reset()
+
+    def spider_idle(self, spider):
+        raise DontCloseSpider
+
+    def request_dropped(self, request, spider):
+        # A request the scheduler refused will never be answered
+        job = self.jobs.get(request.meta.get("warm_job"))
+        if job is not None:
+            self.done(job)
+
+    def spider_closed(self, spider, reason):
+        logging.info("Warm crawler {} closed: {}".format(self.spider_name, reason))
+        self.reset()
+
+    def reset(self):
+        # The next request starts a new crawler
+        jobs, self.jobs = self.jobs, {}
+        self.crawler = None
+        self.ready = None
+        for job in jobs.values():
+            self.fail(job, Error('503', "The warm crawler closed"))
+
+    def stop(self):
+        if self.crawler is not None and self.crawler.crawling:
+            return self.crawler.stop()
+
+    def crawl(self, search_by: str, value, trace_id: str = None) -> defer.Deferred:
+        # Deferred firing with the result of a scrapyrt crawl (items,
+        # items_dropped, stats, spider_name) for one substance
+        spider = self.crawler.spider
+        job = Job(next(self.tokens), trace_id)
+        self.jobs[job.token] = job
+        job.timeout = reactor.callLater(self.timeout, self.timed_out, job)
+
+        request = spider.substance_request(search_by, value, {})
+        self.crawler.engine.crawl(self.track(request.replace(dont_filter=True), job))
+        return job.deferred
+
+    def track(self, request: Request, job: Job) -> Request:
+        # Scrapy only takes functions and methods as callbacks, the job and
+        # the callbacks of the spider go in the meta
+        job.outstanding += 1
+        job.requests += 1
+        meta = dict(request.meta)
+        meta["warm_job"] = job.token
+        meta["warm_callback"] = request.callback or self.crawler.spider.parse
+        meta["warm_errback"] = request.errback
+        if job.trace_id:
+            meta["trace_id"] = job.trace_id
+        return request.replace(callback=self.callback, errback=self.errback, meta=meta)
+
+    def callback(self, response):
+        meta = response.meta
+        job = self.jobs.get(meta["warm_job"])
+        if job is None:
+            return
+        yield from self.follow(job, lambda: meta["warm_callback"](response))
+
+    def errback(self, failure):
+        meta = failure.request.meta
+        job = self.jobs.get(meta["warm_job"])
+        if job is None:
+            return
+        if meta["warm_errback"] is None:
+            job.errors.append(failure.getErrorMessage())
+            self.done(job)
+            return
+        yield from self.follow(job, lambda: meta["warm_errback"](failure))
+
+    def follow(self, job, produce):
+        # Items go on to the pipelines as usual and are kept for the job,
+        # the requests are tracked as part of it
+        try:
+            for result in produce() or ():
+                if isinstance(result, Request):
+                    yield self.track(result, job)
+                else:
+                    job.items.append(result)
+                    yield result
+        except Exception as e:
+            job.errors.append(repr(e))
+            raise
+        finally:
+            self.done(job)
+
+    def done(self, job):
+        job.outstanding -= 1
+        if job.outstanding > 0 or self.jobs.pop(job.token, None) is None:
+            return
+        if job.timeout.active():
+            job.timeout.cancel()
+        if job.deferred.called:
+            # Timed out, the item went to the pipeline anyway
+            return
+
+        result = {
+            "items": job.items,
+            "items_dropped": [],
+            "stats": {
+                "warm_crawler": True,
+                "downloader/request_count": job.requests,
+                "item_scraped_count": len(job.items),
+                "elapsed_time_seconds": round(time.perf_counter() - job.started, 6),
+            },
+            "spider_name": self.spider_name,
+        }
+        if job.errors:
+            result["errors"] = job.errors
+        job.deferred.callback(result)
+
+    def timed_out(self, job):
+        # The client gets a 504 but the job stays tracked: its callbacks keep
+        # running so the spider finishes the substance (and clears its
+        # pending sections) and the pipeline stores it
+        logging.warning(
+            "Warm crawl {} timed out with {} requests left".format(job.token, job.outstanding)
+        )
+        job.deferred.errback(Failure(Error('504', "The crawl timed out")))
+
+    def fail(self, job, exception):
+        self.jobs.pop(job.token, None)
+        if job.timeout is not None and job.timeout.active():
+            job.timeout.cancel()
+        if not job.deferred.called:
+            job.deferred.errback(Failure(exception))
+
+    def stats(self) -> dict:
+        return {"running": self.running, "jobs": len(self.jobs)}
+
+
+class WarmCrawlerPool:
+    def __init__(self, spider_names: list):
+        self.crawlers = dict((name, WarmCrawler(name)) for name in spider_names)
+
+    def start(self):
+        for name, crawler in self.crawlers.items():
+            crawler.start().addErrback(
+                lambda failure, name=name: logging.warning(
+                    "Could not start the warm crawler {}: {}".format(
+                        name, failure.getErrorMessage()
+                    )
+                )
+            )
+
+    def get(self, spider_name: str):
+        # The running warm crawler of a spider, started again if it closed
+        crawler = self.crawlers.get(spider_name)
+        if crawler is None:
+            return None
+        if not crawler.running:
+            crawler.start()
+            return None
+        return crawler
+
+    def stats(self) -> dict:
+        return dict((name, crawler.stats()) for name, crawler in self.crawlers.items())
+
+
+warm_crawlers = WarmCrawlerPool(WARM_SPIDERS)
@@ -0,0 +1,187 @@
+# Range and multi-property search over the substances collection
+#
+# The /search resource turns conditions such as
+#
+#     where=temperature_critical>=400,temperature_critical<=600,molecular_weight<100
+#     elements=C,H,O
+#
+# into a MongoDB filter. Only the fields in SEARCH_FIELDS can be used, every
+# one of them is the first key of an index (see SEARCH_INDEXES), so no search
+# needs a collection scan. That can be checked against a database with:
+#
+#     python -m nist_scraper.search check
+#
+# The elements of the formulas stored before the elements field existed are
+# filled in with:
+#
+#     python -m nist_scraper.search backfill
+
+import itertools
+import re
+import sys
+
+from pymongo import UpdateOne
+
+from nist_scraper.snapshot import NUMBER_COLUMNS, STRING_COLUMNS, parse_where
+
+# Numeric fields that can be searched by range, stored as {value, units}
+# except molecular_weight
+RANGE_FIELDS = [
+    "molecular_weight",
+    "temperature_boil",
+    "temperature_fusion",
+    "temperature_triple",
+    "temperature_critical",
+    "pressure_critical",
+    "density_critical",
+    "enthalpy_formation_gas",
+    "enthalpy_formation_liquid",
+    "enthalpy_vaporization_average",
+]
+
+SEARCH_FIELDS = STRING_COLUMNS + RANGE_FIELDS
+
+# Comparisons allowed in a search, "!=" is left out as it reads the whole
+# index
+COMPARISONS = {
+    "<": "$lt",
+    "<=": "$lte",
+    ">": "$gt",
+    ">=": "$gte",
+    "=": "$eq",
+    "==": "$eq",
+}
+
+ELEMENT = re.compile(r"[A-Z][a-z]?")
+
+
+def field_path(field: str) -> str:
+    if field in NUMBER_COLUMNS and NUMBER_COLUMNS[field] is not None:
+        return field + ".value"
+    return field
+
+
+# Indexes backing the searches, created with the other SUBSTANCE_INDEXES.
+# Elements come first in their compound index, an equality on a multikey
+# field followed by the most common range.
+SEARCH_INDEXES = [
+    (field_path(field), {}) for field in RANGE_FIELDS
+] + [
+    ([("elements", 1), ("molecular_weight", 1)], {}),
+]
+
+
+def formula_elements(formula: str) -> list:
+    # "C2H6O" -> ["C", "H", "O"], the symbols in order of appearance
+    return list(dict.fromkeys(ELEMENT.findall(formula or "")))
+
+
+def build_filter(where: str = "", elements: str = "") -> dict:
+    clauses = parse_where(where)
+    query = {}
+    for column, comparison, value in clauses:
+        if column not in SEARCH_FIELDS:
+            raise ValueError("{} can not be searched".format(column))
+        if comparison not in COMPARISONS:
+            raise ValueError("{} is not supported in a search".format(comparison))
+        query.setdefault(field_path(column), {})[COMPARISONS[comparison]] = value
+
+    symbols = [symbol.strip() for symbol in elements.split(",") if symbol.strip()]
+    for symbol in symbols:
+        if not ELEMENT.fullmatch(symbol):
+            raise ValueError("Invalid element: {}".format(symbol))
+    if symbols:
+        query["elements"] = {"$all": symbols}
+
+    if not query:
+        raise ValueError("At least one condition is required")
+    return query
+
+
+def plan_stages(plan) -> list:
+    # Every stage of an explain plan, the classic and the slot based engine
+    # nest them differently
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+
+def explain(collection, query: dict, limit: int = 100) -> list:
+    explained = collection.find(query, {"_id": 0}).limit(limit).explain()
+    return plan_stages(explained["queryPlanner"]["winningPlan"])
+
+
+def sample_queries():
+    # One query per field and per pair of fields, plus the element searches
+    values = {
+        "cas": "cas=7732185",
+        "name": "name=water",
+        "formula": "formula=H2O",
+        "iupac_std_inchikey": "iupac_std_inchikey=XLYOFNOQVPJJNP-UHFFFAOYSA-N",
+    }
+    for field in RANGE_FIELDS:
+        values[field] = "{0}>=0,{0}<1000".format(field)
+
+    for field in SEARCH_FIELDS:
+        yield values[field], ""
+    for first, second in itertools.combinations(SEARCH_FIELDS, 2):
+        yield "{},{}".format(values[first], values[second]), ""
+    yield "", "C,H"
+    yield values["molecular_weight"], "C,H,O"
+    yield values["temperature_critical"], "C"
+
+
+def check(collection) -> bool:
+    ok = True
+    for where, elements in sample_queries():
+        stages = explain(collection, build_filter(where, elements))
+        if "COLLSCAN" in stages or not any("IXSCAN" in stage for stage in stages):
+            print("where={} elements={}: {}".format(where, elements, stages))
+            ok = False
+    return ok
+
+
+def backfill(collection, batch_size: int = 1000) -> int:
+    documents = collection.find(
+        {"elements": {"$exists": False}, "formula": {"$exists": True}},
+        {"formula": 1},
+    )
+    updated = 0
+    batch = []
+    for document in documents:
+        batch.append(
+            UpdateOne(
+                {"_id": document["_id"]},
+                {"$set": {"elements": formula_elements(document["formula"])}},
+            )
+        )
+        if len(batch) >= batch_size:
+            updated += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += collection.bulk_write(batch, ordered=False).modified_count
+    return updated
+
+
+if __name__ == "__main__":
+    from nist_scraper.database import connection
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    collection = connection.collection()
+    connection.ensure_indexes()
+
+    if command == "backfill":
+        print("{} substances updated".format(backfill(collection)))
+    elif command == "check":
+        if not check(collection):
+            sys.exit("Some searches do not use an index")
+        print("Every search uses an index")
+    else:
+        sys.exit("Usage: python -m nist_scraper.search [check|backfill]")
@@ -66,6 +66,16 @@ ROBOTSTXT_OBEY = True
 #    'nist_scraper.pipelines.NistScraperPipeline': 300,
 # }
 
+# MongoPipeline writes the items in bulk, after MONGO_BULK_SIZE items or
+# every MONGO_BULK_INTERVAL seconds, whatever happens first
+MONGO_BULK_SIZE = 100
+MONGO_BULK_INTERVAL = 5.0
+# Items kept while MongoDB is unreachable, the next ones are dropped
+MONGO_BUFFER_MAX = 10000
+# Store the heat capacity and vaporization series (and the equations with
+# many ranges) as float64 arrays, see nist_scraper/codec.py
+MONGO_PACK_SERIES = False
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 # AUTOTHROTTLE_ENABLED = True
@@ -78,11 +88,32 @@ ROBOTSTXT_OBEY = True
 # AUTOTHROTTLE_TARGET_CONCURRENCY = 1.0
 # Enable showing throttling stats for every response received:
 # AUTOTHROTTLE_DEBUG = False
+# AutoThrottle only sees the requests of its own crawl, the WebBook downloads
+# of every crawl are throttled together by NistScraperDownloaderMiddleware
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-# HTTPCACHE_ENABLED = True
-# HTTPCACHE_EXPIRATION_SECS = 0
-# HTTPCACHE_DIR = 'httpcache'
-# HTTPCACHE_IGNORE_HTTP_CODES = []
-# HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
+#
+# The WebBook pages are kept in .scrapy/httpcache/nist.sqlite, shared by the
+# command line crawls and scrapyrt. They are fresh for the TTL of their
+# section (seconds by Mask, "" is the substance page, see
+# nist_scraper/httpcache.py for the defaults) and revalidated afterwards.
+HTTPCACHE_ENABLED = True
+HTTPCACHE_EXPIRATION_SECS = 0
+HTTPCACHE_DIR = "httpcache"
+HTTPCACHE_SQLITE_FILE = "nist.sqlite"
+HTTPCACHE_STORAGE = "nist_scraper.httpcache.SqliteCacheStorage"
+HTTPCACHE_POLICY = "nist_scraper.httpcache.NistCachePolicy"
+# HTTPCACHE_SECTION_TTLS = {"": 7 * 24 * 3600, "1": 30 * 24 * 3600}
+
+DOWNLOADER_MIDDLEWARES = {
+    "scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware": None,
+    "nist_scraper.httpcache.NistHttpCacheMiddleware": 900,
+    # After the cache, it measures the downloads from the WebBook, rate
+    # limits them and opens a circuit breaker while the WebBook fails, for all
+    # the crawls of the process (see nist_scraper/upstream.py)
+    "nist_scraper.middlewares.NistScraperDownloaderMiddleware": 950,
+}
+# The downloads wait while the WebBook is unavailable, the scrapyrt crawls
+# set it to fail at once instead (see nist_scraper/scrapyrt/manager.py)
+UPSTREAM_FAIL_FAST = False
@@ -0,0 +1,340 @@
+# Columnar snapshot of the substances collection
+#
+# The scalar properties of every substance are flattened into one NumPy
+# array per column and saved as .npy files, which are memory-mapped when
+# queried. Screening queries ("temperature_critical between 400 and 600 K
+# and molecular_weight < 100") are then vectorized comparisons over a few
+# columns instead of a scan of the collection.
+#
+# The snapshot is a directory of segments. A full build writes a single
+# segment, the MongoPipeline adds a segment with the substances it inserts
+# and the segments are merged back into one once there are too many. The
+# snapshot is configured with the following environment variables:
+#
+# SNAPSHOT_DIR (default: snapshot)
+# SNAPSHOT_MAX_SEGMENTS (default: 16)
+#
+# Build it (again) from the database with:
+#
+#     python -m nist_scraper.snapshot
+
+import fcntl
+import json
+import operator
+import os
+import re
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from dotenv import load_dotenv
+
+from nist_scraper.identifiers import canonical
+
+load_dotenv()
+
+STRING_COLUMNS = ["cas", "name", "formula", "iupac_std_inchikey"]
+
+# Scalar properties, {value, units} dicts in the documents, with the units
+# of their column. A value given in other units is left out (NaN).
+NUMBER_COLUMNS = {
+    "molecular_weight": None,
+    "enthalpy_formation_gas": "kJ/mol",
+    "enthalpy_combustion_gas": "kJ/mol",
+    "entropy_gas": "J/mol*K",
+    "enthalpy_formation_liquid": "kJ/mol",
+    "enthalpy_combustion_liquid": "kJ/mol",
+    "entropy_liquid": "J/mol*K",
+    "temperature_boil": "K",
+    "temperature_fusion": "K",
+    "temperature_triple": "K",
+    "pressure_triple": "bar",
+    "temperature_critical": "K",
+    "pressure_critical": "bar",
+    "volume_critical": "l/mol",
+    "density_critical": "mol/l",
+    "enthalpy_vaporization_average": "kJ/mol",
+}
+
+COLUMNS = STRING_COLUMNS + list(NUMBER_COLUMNS)
+
+# Comparisons of a column with a value, NaN never matches
+OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "=": operator.eq,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+CLAUSE = re.compile(r"^\s*(\w+)\s*(<=|>=|==|!=|<|>|=)\s*(.+?)\s*$")
+
+
+def number(document: dict, column: str) -> float:
+    value = document.get(column)
+    units = NUMBER_COLUMNS[column]
+    if isinstance(value, dict):
+        if units is not None and value.get("units") != units:
+            return np.nan
+        value = value.get("value")
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def flatten(documents: list) -> dict:
+    # One array per column for the given documents
+    columns = {}
+    for column in STRING_COLUMNS:
+        columns[column] = np.array(
+            [str(document.get(column) or "") for document in documents], dtype=str
+        )
+    for column in NUMBER_COLUMNS:
+        columns[column] = np.array(
+            [number(document, column) for document in documents], dtype=float
+        )
+    return columns
+
+
+def concatenate(segments: list) -> dict:
+    return dict(
+        (column, np.concatenate([segment[column] for segment in segments]))
+        for column in COLUMNS
+    )
+
+
+def deduplicate(columns: dict) -> dict:
+    # The last row of every CAS wins
+    cas = columns["cas"][::-1]
+    _, first = np.unique(cas, return_index=True)
+    keep = np.sort(len(cas) - 1 - first)
+    return dict((column, values[keep]) for column, values in columns.items())
+
+
+def parse_where(where: str) -> list:
+    # "temperature_critical>=400,molecular_weight<100" as
+    # [(column, comparison, value)]
+    clauses = []
+    for clause in filter(None, where.split(",")):
+        match = CLAUSE.match(clause)
+        if match is None:
+            raise ValueError("Invalid condition: {}".format(clause))
+        column, comparison, value = match.groups()
+        if column not in COLUMNS:
+            raise ValueError("Unknown column: {}".format(column))
+        if column in STRING_COLUMNS:
+            if comparison not in ["=", "==", "!="]:
+                raise ValueError("{} only supports = and !=".format(column))
+            value = canonical(column, value)
+        else:
+            value = float(value)
+        clauses.append((column, comparison, value))
+    return clauses
+
+
+class Snapshot:
+    def __init__(self, path: str = None, max_segments: int = None):
+        self.path = path or os.environ.get("SNAPSHOT_DIR", "snapshot")
+        self.max_segments = max_segments or int(
+            os.environ.get("SNAPSHOT_MAX_SEGMENTS", 16)
+        )
+        # Memory-mapped segments of the last query, by segment name
+        self.loaded = {}
+        self.loaded_lock = threading.Lock()
+        # Segments of the last query and their live rows, see live()
+        self.live_rows = ((), [])
+
+    def exists(self) -> bool:
+        return os.path.isdir(self.path)
+
+    @contextmanager
+    def lock(self):
+        # Writers of every process take the lock, readers never wait for it
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, ".lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def segments(self) -> list:
+        if not self.exists():
+            return []
+        return sorted(
+            name for name in os.listdir(self.path) if name.startswith("segment-")
+        )
+
+    def write_segment(self, columns: dict) -> str:
+        # Written aside and renamed, readers never see half a segment
+        name = "segment-{}-{}".format(time.time_ns(), os.getpid())
+        tmp = os.path.join(self.path, "." + name)
+        os.makedirs(tmp)
+        for column, values in columns.items():
+            np.save(os.path.join(tmp, column + ".npy"), values)
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump({"rows": len(columns["cas"]), "created": time.time()}, f)
+        os.rename(tmp, os.path.join(self.path, name))
+        return name
+
+    def read_segment(self, name: str, mmap_mode="r") -> dict:
+        return dict(
+            (
+                column,
+                np.load(os.path.join(self.path, name, column + ".npy"), mmap_mode=mmap_mode),
+            )
+            for column in COLUMNS
+        )
+
+    def remove_segments(self, names: list):
+        for name in names:
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    def append(self, documents: list):
+        # Incremental refresh with the substances inserted in the database
+        documents = [document for document in documents if document.get("cas")]
+        if not documents:
+            return
+        with self.lock():
+            self.write_segment(flatten(documents))
+            if len(self.segments()) > self.max_segments:
+                self.compact()
+
+    def compact(self):
+        # Called with the lock held
+        names = self.segments()
+        if len(names) < 2:
+            return
+        columns = deduplicate(
+            concatenate([self.read_segment(name, mmap_mode=None) for name in names])
+        )
+        self.write_segment(columns)
+        self.remove_segments(names)
+
+    def rebuild(self, collection, batch_size: int = 10000) -> int:
+        projection = dict((column, 1) for column in COLUMNS)
+        projection["_id"] = 0
+        cursor = collection.find({}, projection, batch_size=batch_size)
+
+        parts = []
+        documents = []
+        for document in cursor:
+            documents.append(document)
+            if len(documents) >= batch_size:
+                parts.append(flatten(documents))
+                documents = []
+        parts.append(flatten(documents))
+
+        columns = deduplicate(concatenate(parts))
+        with self.lock():
+            names = self.segments()
+            self.write_segment(columns)
+            self.remove_segments(names)
+        return len(columns["cas"])
+
+    def load(self) -> list:
+        # A segment removed by a compaction of another process between the
+        # listing and the load is skipped, the merged one has its rows
+        names = self.segments()
+        with self.loaded_lock:
+            for name in names:
+                if name not in self.loaded:
+                    try:
+                        self.loaded[name] = self.read_segment(name)
+                    except FileNotFoundError:
+                        continue
+            self.loaded = dict(
+                (name, self.loaded[name]) for name in names if name in self.loaded
+            )
+            return list(self.loaded.values())
+
+    def live(self, segments: list) -> list:
+        # A boolean mask per segment of the rows that are the last of their
+        # CAS across the segments. The older rows of a substance appended
+        # again are superseded, they must not match a query. Kept until the
+        # segments change.
+        with self.loaded_lock:
+            cached, masks = self.live_rows
+            if len(cached) == len(segments) and all(
+                old is new for old, new in zip(cached, segments)
+            ):
+                return masks
+
+        cas = np.concatenate([segment["cas"] for segment in segments])
+        keep = np.zeros(len(cas), dtype=bool)
+        _, first = np.unique(cas[::-1], return_index=True)
+        keep[len(cas) - 1 - first] = True
+        masks = np.split(keep, np.cumsum([len(segment["cas"]) for segment in segments])[:-1])
+
+        with self.loaded_lock:
+            self.live_rows = (tuple(segments), masks)
+        return masks
+
+    def query(self, clauses: list, fields: list, limit: int = 100):
+        # Rows matching every clause, as (total, [row dicts]). Only the
+        # last row of every CAS is compared, the clauses are applied after
+        # the deduplication.
+        matches = []
+        segments = self.load()
+        if not segments:
+            return 0, []
+        for segment, live in zip(segments, self.live(segments)):
+            mask = live.copy()
+            for column, comparison, value in clauses:
+                mask &= OPERATORS[comparison](segment[column], value)
+            index = np.flatnonzero(mask)
+            if len(index):
+                matches.append(
+                    dict((column, segment[column][index]) for column in set(fields) | {"cas"})
+                )
+
+        if not matches:
+            return 0, []
+
+        columns = dict(
+            (column, np.concatenate([match[column] for match in matches]))
+            for column in matches[0]
+        )
+        total = len(columns["cas"])
+
+        rows = []
+        for position in range(min(total, limit)):
+            row = {}
+            for column in fields:
+                value = columns[column][position].item()
+                if isinstance(value, float) and np.isnan(value):
+                    value = None
+                row[column] = value
+            rows.append(row)
+        return total, rows
+
+    def stats(self) -> dict:
+        rows = 0
+        names = self.segments()
+        for name in names:
+            try:
+                with open(os.path.join(self.path, name, "meta.json")) as f:
+                    rows += json.load(f)["rows"]
+            except FileNotFoundError:
+                pass
+        return {"segments": len(names), "rows": rows}
+
+
+snapshot = Snapshot()
+
+
+if __name__ == "__main__":
+    from nist_scraper.database import connection
+
+    started = time.perf_counter()
+    rows = snapshot.rebuild(connection.collection())
+    print(
+        "Snapshot of {} substances written to {} in {:.1f} s".format(
+            rows, snapshot.path, time.perf_counter() - started
+        )
+    )
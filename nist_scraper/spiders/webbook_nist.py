@@ -1,10 +1,15 @@
 import scrapy
+import itertools
 import re
 from nist_scraper.items import SubstanceItem
-
-# Uncomment this if you want to scrap from urls stored in a json file
-# from os import path
-# import json
+from nist_scraper.ingest import Checkpoint, pending_identifiers
+from nist_scraper.tracing import trace_of, traced
+from nist_scraper.identifiers import (
+    InvalidIdentifier,
+    canonical_cas,
+    canonical_inchikey,
+    canonical_name,
+)
 
 
 class WebbookNistSpider(scrapy.Spider):
@@ -19,42 +24,114 @@ class WebbookNistSpider(scrapy.Spider):
         }
     }
 
-    # Uncomment this if you want to scrap from urls stored in a json file
-    # def __init__(self):
-    #     basepath = path.dirname(__file__)
-    #     filepath = path.abspath(path.join(basepath, "..", "..", "links.json"))
-
-    #     with open(filepath) as data_file:
-    #         self.links = json.load(data_file)
-
-    # def start_requests(self):
-    #     for item in self.links:
-    #         request = scrapy.Request(item["link"], callback=self.parse)
-    #         yield request
+    # Section pages linked from the substance page, with their callback, the
+    # phase their tables belong to and the id of their heading. The partial
+    # results are merged in this order.
+    sections = [
+        ("Gas phase thermo", "parse_gas_phase_thermo", "gas", "Thermo-Gas"),
+        (
+            "Condensed phase thermo",
+            "parse_condensed_phase_thermo",
+            "liquid",
+            "Thermo-Condensed",
+        ),
+        ("Phase change data", "parse_phase_change_data", "", "Thermo-Phase"),
+    ]
+
+    # WebBook Mask asking for the gas (1), condensed (2) and phase change (4)
+    # sections on the substance page itself
+    combined_mask = 7
+
+    def __init__(self, *args, **kwargs):
+        super(WebbookNistSpider, self).__init__(*args, **kwargs)
+        # Substances waiting for some of their section pages
+        self.pending = {}
+        self.substance_ids = itertools.count()
+
+        # Combined mode (default) gets all the sections in one request, it
+        # can be turned off with -a combined=false
+        self.combined = str(getattr(self, "combined", True)).lower() not in [
+            "false",
+            "0",
+            "no",
+        ]
+
+        # Bulk mode, -a source=links.json streams the identifiers of a file
+        # (see nist_scraper/ingest.py) and keeps a checkpoint of its progress
+        path = getattr(self, "checkpoint", None)
+        self.checkpoint = None
+        if getattr(self, "source", None):
+            self.checkpoint = Checkpoint(path or self.source + ".checkpoint")
+
+    def closed(self, reason):
+        if self.checkpoint is not None:
+            self.checkpoint.close()
 
     def start_requests(self):
+        # Time from the start of the crawl.json crawl until the engine asks
+        # for the first requests
+        trace = trace_of(self)
+        if "crawl" in trace.marks:
+            trace.add("crawler_startup", trace.marks["crawl"])
+
+        if self.checkpoint is not None:
+            # Scrapy pulls the start requests lazily, so the file is read
+            # as the crawl goes
+            for search_by, value in pending_identifiers(
+                self.source, self.checkpoint, int(getattr(self, "batch_size", 500))
+            ):
+                yield self.substance_request(search_by, value, {"query": value})
+            return
+
+        # crawl_args can pass a list of identifiers (batch mode), each request
+        # then keeps the identifier it was made for in its meta
+        values = getattr(self, self.search_by)
+        batch = isinstance(values, list)
+        if not batch:
+            values = [values]
+
+        for value in values:
+            yield self.substance_request(
+                self.search_by, value, {"query": value} if batch else {}
+            )
+
+    def substance_request(self, search_by: str, value: str, meta: dict):
         url = ""
-        if self.search_by == "cas":
-            url = f"https://webbook.nist.gov/cgi/cbook.cgi?ID=C{self.cas}&Units=SI"
-        
-        if self.search_by == "name":
-            url = f"https://webbook.nist.gov/cgi/cbook.cgi?Name={self.name}&Units=SI"
-        
-        yield scrapy.Request(url)
+        if search_by == "cas":
+            try:
+                value = canonical_cas(value, check=False)
+            except InvalidIdentifier:
+                pass
+            url = f"https://webbook.nist.gov/cgi/cbook.cgi?ID=C{value}&Units=SI"
+
+        if search_by == "name":
+            url = f"https://webbook.nist.gov/cgi/cbook.cgi?Name={value}&Units=SI"
 
+        if self.combined:
+            url = f"{url}&Mask={self.combined_mask}"
+
+        return scrapy.Request(url, meta=meta)
+
+    @traced("parse")
     def parse(self, response):
-        name = response.xpath("//h1[@id='Top']/text()").get().lower()
+        name = canonical_name(response.xpath("//h1[@id='Top']/text()").get() or "")
 
         # If name does not exist then there is no additional info from this substance
+        if not name and self.checkpoint is not None:
+            self.checkpoint.mark([response.meta["query"]])
+
         if name:
             properties = {}
             properties["name"] = name
+            if "query" in response.meta:
+                properties["query"] = response.meta["query"]
 
             cas = response.xpath(
                 "//main/ul/li[strong[contains(string(.), 'CAS')]]/text()"
             ).get()
             if cas:
-                properties["cas"] = cas.strip().replace("-", "")
+                # Stored as shown by the WebBook, its check digit is not verified
+                properties["cas"] = canonical_cas(cas, check=False)
 
             formula = response.xpath(
                 "string(//main/ul/li[strong[contains(string(.), 'Formula')]])"
@@ -80,61 +157,71 @@ class WebbookNistSpider(scrapy.Spider):
                 "//main//span[@class='inchi-text']/text()"
             ).get()
             if iupac_std_inchikey:
+                try:
+                    iupac_std_inchikey = canonical_inchikey(iupac_std_inchikey)
+                except InvalidIdentifier:
+                    iupac_std_inchikey = iupac_std_inchikey.strip()
                 properties["iupac_std_inchikey"] = iupac_std_inchikey
 
+            other_names = response.xpath(
+                "string(//main/ul/li[strong[contains(string(.), 'Other names')]])"
+            ).get()
+            if other_names:
+                synonyms = [
+                    canonical_name(synonym)
+                    for synonym in other_names.replace("Other names:", "").split(";")
+                ]
+                properties["synonyms"] = [synonym for synonym in synonyms if synonym]
+
             image = response.xpath(
                 "//main//li[strong[contains(text(), 'Chemical structure')]]/img/@src"
             ).get()
             if image:
                 properties["image"] = "https://webbook.nist.gov{}".format(image)
 
-            # Look for link to pass as url for next response
-            gas_phase_thermo = response.xpath(
-                "//main//li[a[contains(string(.), 'Gas phase thermo')]]/a/@href"
-            ).get()
-            condensed_phase_thermo = response.xpath(
-                "//main//li[a[contains(string(.), 'Condensed phase thermo')]]/a/@href"
-            ).get()
-            phase_change_data = response.xpath(
-                "//main//li[a[contains(string(.), 'Phase change data')]]/a/@href"
-            ).get()
-
-            if gas_phase_thermo:
-                gas_phase_thermo = "https://webbook.nist.gov{}".format(gas_phase_thermo)
-                yield response.follow(
-                    url=gas_phase_thermo,
-                    callback=self.parse_gas_phase_thermo,
-                    meta={**properties},
-                )
-            elif condensed_phase_thermo:
-                condensed_phase_thermo = "https://webbook.nist.gov{}".format(
-                    condensed_phase_thermo
-                )
-                yield response.follow(
-                    url=condensed_phase_thermo,
-                    callback=self.parse_condensed_phase_thermo,
-                    meta={**properties},
-                )
-            elif phase_change_data:
-                phase_change_data = "https://webbook.nist.gov{}".format(
-                    phase_change_data
-                )
-                yield response.follow(
-                    url=phase_change_data,
-                    callback=self.parse_phase_change_data,
-                    meta={**properties},
-                )
+            # Sections already on this page (combined mode) are extracted
+            # right away. The rest are requested at once and their partial
+            # results are merged into one item when the last one arrives.
+            sections = {}
+            links = []
+            for text, callback, phase, heading in self.sections:
+                if response.xpath("//main/h2[@id='{}']".format(heading)):
+                    sections[phase] = self.section_properties(
+                        response, phase, heading
+                    )
+                    continue
+
+                link = response.xpath(
+                    "//main//li[a[contains(string(.), '{}')]]/a/@href".format(text)
+                ).get()
+                if link:
+                    links.append((link, callback))
+
+            if links:
+                key = next(self.substance_ids)
+                self.pending[key] = {
+                    "properties": properties,
+                    "remaining": len(links),
+                    "sections": sections,
+                }
+                for link, callback in links:
+                    # The pages belong to this substance only, a substance
+                    # requested twice in a batch needs its own copies
+                    yield response.follow(
+                        url="https://webbook.nist.gov{}".format(link),
+                        callback=getattr(self, callback),
+                        errback=self.section_failed,
+                        meta={"substance": key},
+                        dont_filter=True,
+                    )
             else:
-                substance = SubstanceItem()
-                for key, value in properties.items():
-                    substance[key] = value
-
-                yield substance
+                yield self.build_item(properties, sections)
 
     def extract_properties(self, properties: dict) -> dict:
         parsed_properties = {}
         for key, value in properties.items():
             if key not in [
+                "substance",
                 "depth",
                 "download_timeout",
                 "download_slot",
@@ -152,15 +239,64 @@ class WebbookNistSpider(scrapy.Spider):
             return value * 1 * 10 ** (power)
         return float(text)
 
-    def extract_data_tables(self, response: scrapy.Request, phase: str) -> dict:
-        """_summary_
+    def table_rows(self, table) -> list:
+        """Rows of a table with their position among their sibling rows.
+
+        The position is the one XPath gives to `//tr[position()=n]`, so the
+        handlers below select exactly the rows the per-table queries did.
+        """
+        rows = []
+        positions = {}
+        for row in table.iter("tr"):
+            parent = row.getparent()
+            positions[parent] = positions.get(parent, 0) + 1
+            rows.append((positions[parent], row))
+        return rows
+
+    def cells(self, row, tag: str = "td") -> list:
+        return [cell for cell in row if cell.tag == tag]
+
+    def cell_string(self, cell) -> str:
+        # Same as XPath string(), all the text inside the cell
+        return "".join(cell.itertext())
+
+    def cell_text(self, cell) -> str:
+        # Same as XPath text() followed by get(), the first text node
+        if cell.text:
+            return cell.text
+        for child in cell:
+            if child.tail:
+                return child.tail
+        return None
+
+    def header_units(self, tables: list, column: int) -> str:
+        # Units between parenthesis in the first header row of the tables
+        for table in tables:
+            for position, row in self.table_rows(table):
+                headers = self.cells(row, "th")
+                if position == 1 and len(headers) > column:
+                    return re.search(
+                        "\((.*)\)", self.cell_string(headers[column])
+                    ).group(1)
+        return None
+
+    @traced("extract_data_tables")
+    def extract_data_tables(
+        self, response: scrapy.Request, phase: str, section: str = None
+    ) -> dict:
+        """Extract the properties found in the data tables of a section page.
+
+        The tables of the page are walked once and each one is handed to the
+        extractor of its kind according to its aria-label.
 
         Args:
-            response (scrapy.Request): _description_
-            phase (str): _description_
+            response (scrapy.Request): gas, condensed or phase change page
+            phase (str): "gas", "liquid" or "" for the phase change page
+            section (str): only use the tables under the heading with this id,
+                for pages holding several sections
 
         Returns:
-            dict: _description_
+            dict: properties from the previous pages plus the ones found
         """
 
         # Spreding the information alrady scraped from the previous parse
@@ -169,134 +305,144 @@ class WebbookNistSpider(scrapy.Spider):
         # as dict
         properties = self.extract_properties(response.request.meta)
 
-        # One dimentional data is the first table for each phase (gas, condensed or change)
-        # This table contains the enthalpy and entalpy for each phase.
-        one_dimentional_data = response.xpath(
-            "//main/table[@aria-label='One dimensional data']//tr[th]/following-sibling::tr[position()=1]"
+        tables = []
+        heading = None
+        for element in response.selector.root.xpath("//main/h2 | //main/table"):
+            if element.tag == "h2":
+                heading = element.get("id")
+            elif section is None or heading == section:
+                tables.append((element.get("aria-label", ""), element))
+
+        def labelled(text):
+            return [table for label, table in tables if text in label]
+
+        self.extract_one_dimensional_data(
+            [table for label, table in tables if label == "One dimensional data"],
+            phase,
+            properties,
         )
-        if one_dimentional_data:
-            for row in one_dimentional_data:
-                property = row.xpath("string(td[position()=1])").get()
-                value_str = re.sub(
-                    "\s.*", "", row.xpath("string(td[position()=2])").get()
-                )
-                if value_str:
-                    value = {
-                        "value": self.to_float(value_str),
-                        "units": row.xpath("td[position()=3]/text()").get(),
-                    }
+        self.extract_heat_capacity(
+            labelled("Constant pressure heat capacity of {}".format(phase)),
+            phase,
+            properties,
+        )
+        self.extract_shomate_equation(
+            labelled(
+                "{} Phase Heat Capacity (Shomate Equation)".format(phase.capitalize())
+            ),
+            phase,
+            properties,
+        )
+        enthalpy_vaporization_tables = labelled("Enthalpy of vaporization")
+        self.extract_enthalpy_vaporization(enthalpy_vaporization_tables, properties)
+        self.extract_enthalpy_vaporization_equation(
+            enthalpy_vaporization_tables, properties
+        )
+        self.extract_entropy_vaporization(
+            labelled("Entropy of vaporization"), properties
+        )
+        self.extract_antoine_equation(labelled("Antoine"), properties)
+
+        return properties
 
-                    # Gas or liquid
-                    if property == "fH°{}".format(phase):
-                        properties["enthalpy_formation_{}".format(phase)] = value
-                    if property == "cH°{}".format(phase):
-                        properties["enthalpy_combustion_{}".format(phase)] = value
-                    if property == "S°{}".format(phase):
-                        properties["entropy_{}".format(phase)] = value
-
-                    # Phase change
-                    if property == "Tboil":
-                        properties["temperature_boil"] = value
-                    if property == "Tfus":
-                        properties["temperature_fusion"] = value
-                    if property == "Ttriple":
-                        properties["temperature_triple"] = value
-                    if property == "Ptriple":
-                        properties["pressure_triple"] = value
-                    if property == "Tc":
-                        properties["temperature_critical"] = value
-                    if property == "Pc":
-                        properties["pressure_critical"] = value
-                    if property == "Vc":
-                        properties["volume_critical"] = value
-                    if property == "c":
-                        properties["density_critical"] = value
-                    if property == "vapH°":
-                        properties["enthalpy_vaporization_average"] = value
+    def extract_one_dimensional_data(self, tables: list, phase: str, properties: dict):
+        # One dimentional data is the first table for each phase (gas, condensed or change)
+        # This table contains the enthalpy and entalpy for each phase.
+        # Only the first row after each header row is taken
+        one_dimentional_data = []
+        for table in tables:
+            for row in table.iter("tr"):
+                if not self.cells(row, "th"):
+                    continue
+                following = row.getnext()
+                while following is not None and following.tag != "tr":
+                    following = following.getnext()
+                if following is not None:
+                    one_dimentional_data.append(following)
+
+        names = {
+            # Gas or liquid
+            "fH°{}".format(phase): "enthalpy_formation_{}".format(phase),
+            "cH°{}".format(phase): "enthalpy_combustion_{}".format(phase),
+            "S°{}".format(phase): "entropy_{}".format(phase),
+            # Phase change
+            "Tboil": "temperature_boil",
+            "Tfus": "temperature_fusion",
+            "Ttriple": "temperature_triple",
+            "Ptriple": "pressure_triple",
+            "Tc": "temperature_critical",
+            "Pc": "pressure_critical",
+            "Vc": "volume_critical",
+            "c": "density_critical",
+            "vapH°": "enthalpy_vaporization_average",
+        }
 
-        # Some substances have one or more tables with pair or values for Cp(T)
-        heat_capacity_rows = response.xpath(
-            "//main/table[contains(@aria-label, 'Constant pressure heat capacity of {}')]//tr[position()>1]".format(
-                phase
+        for row in one_dimentional_data:
+            cells = self.cells(row)
+            property = self.cell_string(cells[0]) if cells else ""
+            value_str = re.sub(
+                "\s.*", "", self.cell_string(cells[1]) if len(cells) > 1 else ""
             )
-        )
+            if value_str:
+                value = {
+                    "value": self.to_float(value_str),
+                    "units": self.cell_text(cells[2]) if len(cells) > 2 else None,
+                }
+                if property in names:
+                    properties[names[property]] = value
+
+    def extract_heat_capacity(self, tables: list, phase: str, properties: dict):
+        # Some substances have one or more tables with pair or values for Cp(T)
+        heat_capacity_rows = [
+            row
+            for table in tables
+            for position, row in self.table_rows(table)
+            if position > 1
+        ]
         if heat_capacity_rows:  # Checking if these tables exist
             values = []
             for row in heat_capacity_rows:
-                temperature = row.xpath("td[position()=2]/text()").get()
+                cells = self.cells(row)
+                temperature = self.cell_text(cells[1]) if len(cells) > 1 else None
                 if temperature:
                     if "-" not in temperature:
                         temperature = float(temperature)
-                        value = float(
-                            re.sub(
-                                "\s.*", "", row.xpath("td[position()=1]/text()").get()
-                            )
-                        )
+                        value = float(re.sub("\s.*", "", self.cell_text(cells[0])))
                         values.append([value, temperature])
 
-            values_units = response.xpath(
-                "string(//main/table[contains(@aria-label, 'Constant pressure heat capacity of {}')]//tr[position()=1]/th[position()=1])".format(
-                    phase
-                )
-            )[0].get()
-            temperature_units = response.xpath(
-                "string(//main/table[contains(@aria-label, 'Constant pressure heat capacity of {}')]//tr[position()=1]/th[position()=2])".format(
-                    phase
-                )
-            )[0].get()
-            values_units = re.search("\((.*)\)", values_units).group(1)
-            temperature_units = re.search("\((.*)\)", temperature_units).group(1)
             properties[
                 "constant_pressure_heat_capacity_values_{}".format(phase)
             ] = sorted(values, key=lambda value: value[1])
             properties["constant_pressure_heat_capacity_units_{}".format(phase)] = [
-                values_units,
-                temperature_units,
+                self.header_units(tables, 0),
+                self.header_units(tables, 1),
             ]
 
+    def extract_shomate_equation(self, tables: list, phase: str, properties: dict):
         # Other substances instead of pair of values for Cp(T) they have shomate equation
-        # The shomate equation have [a-h] constants
-        shomate_rows = response.xpath(
-            "//main/table[contains(@aria-label, '{} Phase Heat Capacity (Shomate Equation)')]//tr[position()<10]".format(
-                phase.capitalize()
-            )
-        )
+        # The shomate equation have [a-h] constants, one column per temperature range
+        rows = [
+            (position, row) for table in tables for position, row in self.table_rows(table)
+        ]
+        shomate_rows = [row for position, row in rows if position < 10]
         if shomate_rows:
+            cols = sum(len(self.cells(row)) for position, row in rows if position == 1)
+
+            # Temperature range and A to H, read once as text
+            text = [
+                [self.cell_string(cell) for cell in self.cells(row)]
+                for row in shomate_rows[:9]
+            ]
+
+            def cell(row, col):
+                return text[row][col] if col < len(text[row]) else ""
+
             heat_capacity_shomate_equation = []
-            cols = response.xpath(
-                "//main/table[contains(@aria-label, '{} Phase Heat Capacity (Shomate Equation)')]//tr[position()=1]/td".format(
-                    phase.capitalize()
-                )
-            )
-            for col in range(1, len(cols) + 1):
-                temperatures = (
-                    shomate_rows[0].xpath("string(td[{}])".format(col)).get().split("-")
-                )
-                temperatures = [float(x) for x in temperatures]
-                a = self.to_float(
-                    shomate_rows[1].xpath("string(td[{}])".format(col)).get()
-                )
-                b = self.to_float(
-                    shomate_rows[2].xpath("string(td[{}])".format(col)).get()
-                )
-                c = self.to_float(
-                    shomate_rows[3].xpath("string(td[{}])".format(col)).get()
-                )
-                d = self.to_float(
-                    shomate_rows[4].xpath("string(td[{}])".format(col)).get()
-                )
-                e = self.to_float(
-                    shomate_rows[5].xpath("string(td[{}])".format(col)).get()
-                )
-                f = self.to_float(
-                    shomate_rows[6].xpath("string(td[{}])".format(col)).get()
-                )
-                g = self.to_float(
-                    shomate_rows[7].xpath("string(td[{}])".format(col)).get()
-                )
-                h = self.to_float(
-                    shomate_rows[8].xpath("string(td[{}])".format(col)).get()
-                )
+            for col in range(cols):
+                temperatures = [float(x) for x in cell(0, col).split("-")]
+                a, b, c, d, e, f, g, h = [
+                    self.to_float(cell(row, col)) for row in range(1, 9)
+                ]
 
                 heat_capacity_shomate_equation.append(
                     {
@@ -315,138 +461,101 @@ class WebbookNistSpider(scrapy.Spider):
                 "heat_capacity_shomate_equation_{}".format(phase)
             ] = heat_capacity_shomate_equation
 
-        # Change phase data enthalpy_vaporization
-        enthalpy_vaporization_rows = response.xpath(
-            "//main/table[contains(@aria-label, 'Enthalpy of vaporization')][1]//tr[position()>1]"
-        )
+    def extract_enthalpy_vaporization(self, tables: list, properties: dict):
+        # Change phase data enthalpy_vaporization, from the first table
+        enthalpy_vaporization_rows = [
+            row for position, row in self.table_rows(tables[0]) if position > 1
+        ] if tables else []
 
         if enthalpy_vaporization_rows:
             values = []
             for row in enthalpy_vaporization_rows:
-                temperature = row.xpath("td[position()=2]/text()").get()
+                cells = self.cells(row)
+                temperature = self.cell_text(cells[1]) if len(cells) > 1 else None
                 if temperature and "-" not in temperature:
                     temperature = float(temperature)
-                    value = float(
-                        re.sub("\s.*", "", row.xpath("td[position()=1]/text()").get())
-                    )
+                    value = float(re.sub("\s.*", "", self.cell_text(cells[0])))
                     values.append([value, temperature])
 
-            values_units = response.xpath(
-                "string(//main/table[contains(@aria-label, 'Enthalpy of vaporization')]//tr[position()=1]/th[position()=1])"
-            )[0].get()
-            temperature_units = response.xpath(
-                "string(//main/table[contains(@aria-label, 'Enthalpy of vaporization')]//tr[position()=1]/th[position()=2])"
-            )[0].get()
-            values_units = re.search("\((.*)\)", values_units).group(1)
-            temperature_units = re.search("\((.*)\)", temperature_units).group(1)
             properties["enthalpy_vaporization_values"] = sorted(
                 values, key=lambda value: value[1]
             )
             properties["enthalpy_vaporization_units"] = [
-                values_units,
-                temperature_units,
+                self.header_units(tables, 0),
+                self.header_units(tables, 1),
             ]
 
-        enthalpy_vaporization_equation_rows = response.xpath(
-            "//main/table[contains(@aria-label, 'Enthalpy of vaporization')][2]//tr[position()<6]"
-        )
+    def extract_enthalpy_vaporization_equation(self, tables: list, properties: dict):
+        # The second enthalpy of vaporization table has the equation
+        # parameters, one column per temperature range
+        rows = self.table_rows(tables[1]) if len(tables) > 1 else []
+        enthalpy_vaporization_equation_rows = [
+            row for position, row in rows if position < 6
+        ]
         if enthalpy_vaporization_equation_rows:
             enthalpy_vaporization_equation = []
-            cols = response.xpath(
-                "//main/table[contains(@aria-label, 'Enthalpy of vaporization')][2]//tr[position()=1]/td"
-            )
-            for col in range(len(cols)):
-                temperatures = (
-                    enthalpy_vaporization_equation_rows[0]
-                    .xpath("td")[col]
-                    .xpath("text()")
-                    .get()
-                    .split("-")
-                )
-                temperatures = [float(x) for x in temperatures]
-                a = float(
-                    enthalpy_vaporization_equation_rows[1]
-                    .xpath("td")[col]
-                    .xpath("text()")
-                    .get()
-                )
-                alpha = float(
-                    enthalpy_vaporization_equation_rows[2]
-                    .xpath("td")[col]
-                    .xpath("text()")
-                    .get()
-                )
-                beta = float(
-                    enthalpy_vaporization_equation_rows[3]
-                    .xpath("td")[col]
-                    .xpath("text()")
-                    .get()
-                )
-                temperature_critical = float(
-                    enthalpy_vaporization_equation_rows[4]
-                    .xpath("td")[col]
-                    .xpath("text()")
-                    .get()
-                )
-
+            cols = sum(len(self.cells(row)) for position, row in rows if position == 1)
+            text = [
+                [self.cell_text(cell) for cell in self.cells(row)]
+                for row in enthalpy_vaporization_equation_rows[:5]
+            ]
+            for col in range(cols):
+                temperatures = [float(x) for x in text[0][col].split("-")]
                 enthalpy_vaporization_equation.append(
                     {
                         "temperatures": temperatures,
-                        "A": a,
-                        "alpha": alpha,
-                        "beta": beta,
-                        "Tc": temperature_critical,
+                        "A": float(text[1][col]),
+                        "alpha": float(text[2][col]),
+                        "beta": float(text[3][col]),
+                        "Tc": float(text[4][col]),
                     }
                 )
             properties[
                 "enthalpy_vaporization_equation"
             ] = enthalpy_vaporization_equation
 
-        # Change phase data entropy_vaporization
-        entropy_vaporization_rows = response.xpath(
-            "//main/table[contains(@aria-label, 'Entropy of vaporization')][1]//tr[position()>1]"
-        )
+    def extract_entropy_vaporization(self, tables: list, properties: dict):
+        # Change phase data entropy_vaporization, from the first table
+        entropy_vaporization_rows = [
+            row for position, row in self.table_rows(tables[0]) if position > 1
+        ] if tables else []
 
         if entropy_vaporization_rows:
             values = []
             for row in entropy_vaporization_rows:
-                temperature = row.xpath("td[position()=2]/text()").get()
+                cells = self.cells(row)
+                temperature = self.cell_text(cells[1]) if len(cells) > 1 else None
                 if temperature:
                     temperature = float(temperature)
-                    value = float(
-                        re.sub("\s.*", "", row.xpath("td[position()=1]/text()").get())
-                    )
+                    value = float(re.sub("\s.*", "", self.cell_text(cells[0])))
                     values.append([value, temperature])
 
-            values_units = response.xpath(
-                "string(//main/table[contains(@aria-label, 'Entropy of vaporization')]//tr[position()=1]/th[position()=1])"
-            )[0].get()
-            temperature_units = response.xpath(
-                "string(//main/table[contains(@aria-label, 'Entropy of vaporization')]//tr[position()=1]/th[position()=2])"
-            )[0].get()
-            values_units = re.search("\((.*)\)", values_units).group(1)
-            temperature_units = re.search("\((.*)\)", temperature_units).group(1)
             properties["entropy_vaporization_values"] = sorted(
                 values, key=lambda value: value[1]
             )
             properties["entropy_vaporization_units"] = [
-                values_units,
-                temperature_units,
+                self.header_units(tables, 0),
+                self.header_units(tables, 1),
             ]
 
+    def extract_antoine_equation(self, tables: list, properties: dict):
         # Antoine equation
-        antoine_rows = response.xpath(
-            "//main/table[contains(@aria-label, 'Antoine')]//tr[position()>1]"
-        )
+        antoine_rows = [
+            row
+            for table in tables
+            for position, row in self.table_rows(table)
+            if position > 1
+        ]
         if antoine_rows:
             values = []
             for row in antoine_rows:
-                temperature = row.xpath("td[position()=1]/text()").get().split("-")
+                cells = [self.cell_text(cell) for cell in self.cells(row)]
+                temperature = cells[0].split("-")
                 tmin = float(temperature[0])
                 tmax = float(temperature[1])
-                a = float(row.xpath("td[position()=2]/text()").get())
-                b = float(row.xpath("td[position()=3]/text()").get())
-                c = float(row.xpath("td[position()=4]/text()").get())
+                a = float(cells[1])
+                b = float(cells[2])
+                c = float(cells[3])
                 values.append(
                     {
                         "temperatures": [tmin, tmax],
@@ -457,69 +566,56 @@ class WebbookNistSpider(scrapy.Spider):
                 )
             properties["antoine_equation"] = values
 
-        return properties
-
+    @traced("parse_section")
     def parse_gas_phase_thermo(self, response):
-        properties = self.extract_data_tables(response, "gas")
-
-        # Look for link to pass as url for next response
-        condensed_phase_thermo = response.xpath(
-            "//main//li[a[contains(string(.), 'Condensed phase thermo')]]/a/@href"
-        ).get()
-        phase_change_data = response.xpath(
-            "//main//li[a[contains(string(.), 'Phase change data')]]/a/@href"
-        ).get()
-
-        if condensed_phase_thermo:
-            condensed_phase_thermo = "https://webbook.nist.gov{}".format(
-                condensed_phase_thermo
-            )
-            yield response.follow(
-                url=condensed_phase_thermo,
-                callback=self.parse_condensed_phase_thermo,
-                meta={**properties},
-            )
-        elif phase_change_data:
-            phase_change_data = "https://webbook.nist.gov{}".format(phase_change_data)
-            yield response.follow(
-                url=phase_change_data,
-                callback=self.parse_phase_change_data,
-                meta={**properties},
-            )
-        else:
-            substance = SubstanceItem()
-            for key, value in properties.items():
-                substance[key] = value
-
-            yield substance
+        properties = self.section_properties(response, "gas")
+        yield from self.collect_section(response, "gas", properties)
 
+    @traced("parse_section")
     def parse_condensed_phase_thermo(self, response):
-        properties = self.extract_data_tables(response, "liquid")
-
-        # Look for link to pass as url for next response
-        phase_change_data = response.xpath(
-            "//main//li[a[contains(string(.), 'Phase change data')]]/a/@href"
-        ).get()
-
-        if phase_change_data:
-            phase_change_data = "https://webbook.nist.gov{}".format(phase_change_data)
-            yield response.follow(
-                url=phase_change_data,
-                callback=self.parse_phase_change_data,
-                meta={**properties},
-            )
-        else:
-            substance = SubstanceItem()
-            for key, value in properties.items():
-                substance[key] = value
-
-            yield substance
+        properties = self.section_properties(response, "liquid")
+        yield from self.collect_section(response, "liquid", properties)
 
+    @traced("parse_section")
     def parse_phase_change_data(self, response):
-        properties = self.extract_data_tables(response, "")
+        properties = self.section_properties(response, "")
+        yield from self.collect_section(response, "", properties)
+
+    def section_failed(self, failure):
+        # A missing section must not hold back the rest of the substance
+        self.logger.warning(
+            "Section page {} failed: {}".format(
+                failure.request.url, failure.getErrorMessage()
+            )
+        )
+        yield from self.collect_section(failure.request, None, {})
+
+    def section_properties(self, response, phase: str, section: str = None) -> dict:
+        # Only what the page added, not the request meta
+        properties = self.extract_data_tables(response, phase, section)
+        return dict(
+            (name, value)
+            for name, value in properties.items()
+            if name not in response.meta
+        )
+
+    def build_item(self, properties: dict, sections: dict) -> SubstanceItem:
+        properties = dict(properties)
+        for text, callback, phase, heading in self.sections:
+            properties.update(sections.get(phase, {}))
 
         substance = SubstanceItem()
         for key, value in properties.items():
             substance[key] = value
 
-        yield substance
+        return substance
+
+    def collect_section(self, response, phase, properties: dict):
+        key = response.meta["substance"]
+        substance = self.pending[key]
+        substance["sections"][phase] = properties
+        substance["remaining"] -= 1
+
+        if substance["remaining"] == 0:
+            del self.pending[key]
+            yield self.build_item(substance["properties"], substance["sections"])
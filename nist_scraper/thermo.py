@@ -0,0 +1,65 @@
+# Evaluation of the stored WebBook equations
+#
+# The Shomate and Antoine coefficients are stored as a list of temperature
+# ranges. Every point is matched with its range and the equations are then
+# evaluated for all the points at once with NumPy. Points outside every
+# range are NaN.
+#
+#     https://webbook.nist.gov/chemistry/guide/gui-index.html#shomate
+#
+# Shomate equation, with t = T / 1000:
+#
+#     Cp = A + B*t + C*t^2 + D*t^3 + E/t^2                   (J/mol*K)
+#     H - H298 = A*t + B*t^2/2 + C*t^3/3 + D*t^4/4 - E/t + F - H   (kJ/mol)
+#     S = A*ln(t) + B*t + C*t^2/2 + D*t^3/3 - E/(2*t^2) + G  (J/mol*K)
+#
+# Antoine equation, log10(P) = A - B / (T + C), P in bar and T in K.
+
+import numpy as np
+
+SHOMATE_COEFFICIENTS = ["A", "B", "C", "D", "E", "F", "G", "H"]
+ANTOINE_COEFFICIENTS = ["A", "B", "C"]
+
+
+def temperature_ranges(ranges: list, temperatures: np.ndarray) -> np.ndarray:
+    # Index of the range of every point, -1 when no range contains it. When
+    # ranges overlap the first one stored wins.
+    index = np.full(temperatures.shape, -1)
+    for position, stored in reversed(list(enumerate(ranges))):
+        tmin, tmax = stored["temperatures"]
+        index[(temperatures >= tmin) & (temperatures <= tmax)] = position
+    return index
+
+
+def coefficients(ranges: list, names: list, index: np.ndarray) -> list:
+    # One array per coefficient with the value of the range of every point,
+    # NaN for the points without range
+    table = np.array(
+        [[stored[name] for name in names] for stored in ranges] + [[np.nan] * len(names)],
+        dtype=float,
+    )
+    return table[index].T
+
+
+def shomate(ranges: list, temperatures) -> dict:
+    temperatures = np.asarray(temperatures, dtype=float)
+    index = temperature_ranges(ranges, temperatures)
+    a, b, c, d, e, f, g, h = coefficients(ranges, SHOMATE_COEFFICIENTS, index)
+
+    t = temperatures / 1000
+    t2 = t * t
+    t3 = t2 * t
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "heat_capacity": a + b * t + c * t2 + d * t3 + e / t2,
+            "enthalpy": a * t + b * t2 / 2 + c * t3 / 3 + d * t3 * t / 4 - e / t + f - h,
+            "entropy": a * np.log(t) + b * t + c * t2 / 2 + d * t3 / 3 - e / (2 * t2) + g,
+        }
+
+
+def antoine(ranges: list, temperatures) -> np.ndarray:
+    temperatures = np.asarray(temperatures, dtype=float)
+    index = temperature_ranges(ranges, temperatures)
+    a, b, c = coefficients(ranges, ANTOINE_COEFFICIENTS, index)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.power(10.0, a - b / (temperatures + c))
@@ -0,0 +1,257 @@
+# Per-stage timings of crawl.json requests
+#
+# A crawl.json request with trace=true gets a Trace. Its spans are added by
+# CheckDatabaseBeforeCrawlResource (cache and database precheck, crawl), by
+# the WebbookNistSpider callbacks (crawler startup, parsing, table
+# extraction), by the downloader middleware (NIST downloads) and by the
+# MongoPipeline (database writes). The crawl runs in the scrapyrt process,
+# the spider finds the trace of its request by the trace_id it is given as
+# an argument. The response then has a "timings" breakdown, where the spans
+# of a stage are added up (extract_data_tables runs inside parse and
+# parse_section, its time is part of theirs too):
+#
+#     {"total_ms": 812.4,
+#      "stages": {"precheck": 3.1, "crawler_startup": 41.0, "download": 702.7, ...},
+#      "spans": [{"name": "download", "start_ms": 45.2, "duration_ms": 702.7,
+#                 "url": "...", "status": 200}, ...]}
+#
+# profile=true also samples the stack of the reactor thread while the
+# request is served, for deep dives (see Sampler). Spiders and pipelines run
+# outside scrapyrt get NULL, whose spans do nothing.
+
+import functools
+import inspect
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+# Seconds between two samples of the profiler and functions returned
+PROFILE_INTERVAL = 0.005
+PROFILE_TOP = 25
+
+# Traces of the requests being served, by id
+traces = {}
+
+
+class Trace:
+    def __init__(self, profile: bool = False):
+        self.id = uuid.uuid4().hex
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.spans = []
+        # Points in time other components measure from
+        self.marks = {}
+        self.sampler = Sampler(threading.get_ident()) if profile else None
+        if self.sampler is not None:
+            self.sampler.start()
+
+    def add(self, name: str, started: float, duration: float = None, **attributes):
+        # started is a time.perf_counter() value, the duration defaults to
+        # the time since then
+        if duration is None:
+            duration = time.perf_counter() - started
+        span = {
+            "name": name,
+            "start_ms": round((started - self.started) * 1000, 3),
+            "duration_ms": round(duration * 1000, 3),
+        }
+        span.update(attributes)
+        with self.lock:
+            self.spans.append(span)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        started = time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            self.add(name, started, **attributes)
+
+    def mark(self, name: str):
+        self.marks[name] = time.perf_counter()
+
+    def timer(self, name: str, **attributes):
+        # Deferred callback adding a span from now until it is called
+        started = time.perf_counter()
+
+        def done(result):
+            self.add(name, started, **attributes)
+            return result
+
+        return done
+
+    def summary(self) -> dict:
+        with self.lock:
+            spans = sorted(self.spans, key=lambda span: span["start_ms"])
+        stages = {}
+        for span in spans:
+            stages[span["name"]] = round(
+                stages.get(span["name"], 0) + span["duration_ms"], 3
+            )
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "stages": stages,
+            "spans": spans,
+        }
+
+    def close(self):
+        traces.pop(self.id, None)
+        if self.sampler is not None:
+            self.sampler.stop()
+
+    def attach(self, response):
+        # The timings (and profile) added to a copy of the response, crawl
+        # results can be shared by coalesced requests
+        self.close()
+        if not isinstance(response, dict):
+            return response
+        response = dict(response)
+        response["timings"] = self.summary()
+        if self.sampler is not None:
+            response["profile"] = self.sampler.report()
+        return response
+
+
+class NullTrace:
+    # Trace of the crawls nobody asked timings for
+    id = None
+    marks = {}
+
+    def add(self, name, started, duration=None, **attributes):
+        pass
+
+    @contextmanager
+    def span(self, name, **attributes):
+        yield attributes
+
+    def mark(self, name):
+        pass
+
+    def timer(self, name, **attributes):
+        return lambda result: result
+
+
+NULL = NullTrace()
+
+
+class Sampler(threading.Thread):
+    # Sampling profiler of one thread: its stack is read every
+    # PROFILE_INTERVAL seconds and the functions found are counted. The
+    # reactor thread serves other requests too, their work shows up in the
+    # samples as well.
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL):
+        super().__init__(name="sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.samples = 0
+        self.inclusive = Counter()
+        self.leaves = Counter()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.samples += 1
+            self.leaves[self.location(frame)] += 1
+            seen = set()
+            while frame is not None:
+                location = self.location(frame)
+                if location not in seen:
+                    seen.add(location)
+                    self.inclusive[location] += 1
+                frame = frame.f_back
+
+    def location(self, frame) -> str:
+        code = frame.f_code
+        return "{} ({}:{})".format(code.co_name, code.co_filename, code.co_firstlineno)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def report(self, top: int = PROFILE_TOP) -> dict:
+        def share(count):
+            return round(count / self.samples, 4) if self.samples else 0.0
+
+        return {
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "functions": [
+                {
+                    "function": location,
+                    "samples": count,
+                    "self_samples": self.leaves[location],
+                    "share": share(count),
+                }
+                for location, count in self.inclusive.most_common(top)
+            ],
+        }
+
+
+def start(profile: bool = False) -> Trace:
+    trace = Trace(profile)
+    traces[trace.id] = trace
+    return trace
+
+
+def get(trace_id):
+    return traces.get(trace_id, NULL)
+
+
+def trace_of(spider, request=None):
+    # A warm crawler serves many requests, their trace_id is in the meta of
+    # the Scrapy requests instead of being a spider argument
+    trace_id = request.meta.get("trace_id") if request is not None else None
+    return get(trace_id or getattr(spider, "trace_id", None))
+
+
+def traced(name: str):
+    # Spider method decorator adding a span to the trace of its crawl.
+    # Callbacks are generators, only the time spent in them is counted, not
+    # the time Scrapy holds them between two yields.
+    def decorator(f):
+        if inspect.isgeneratorfunction(f):
+
+            def generator(self, response, *args, **kwargs):
+                trace = trace_of(self, response.request)
+                started = time.perf_counter()
+                busy = 0.0
+                results = f(self, response, *args, **kwargs)
+                while True:
+                    resumed = time.perf_counter()
+                    try:
+                        result = next(results)
+                    except StopIteration:
+                        busy += time.perf_counter() - resumed
+                        break
+                    busy += time.perf_counter() - resumed
+                    yield result
+                trace.add(
+                    name,
+                    started,
+                    busy,
+                    url=response.url,
+                    cached="cached" in response.flags,
+                )
+
+            # Scrapy reads the source of the callbacks to warn about
+            # generators returning values, without __wrapped__ it reads
+            # this one instead of the decorated method
+            functools.update_wrapper(generator, f)
+            del generator.__wrapped__
+            return generator
+
+        @functools.wraps(f)
+        def function(self, response, *args, **kwargs):
+            with trace_of(self, response.request).span(name, url=response.url):
+                return f(self, response, *args, **kwargs)
+
+        return function
+
+    return decorator
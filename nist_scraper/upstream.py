@@ -0,0 +1,310 @@
+# Rate limiter and circuit breaker of the upstream sites
+#
+# The crawls of the scrapyrt process run side by side, each one with its own
+# downloader and AutoThrottle would only see its own requests. The
+# downloader middleware asks the Upstream of the host (one per process,
+# shared by all the crawls) before every download:
+#
+# - a token bucket spaces the downloads at the current rate, a request
+#   waiting more than UPSTREAM_MAX_WAIT seconds fails right away when the
+#   crawl fails fast (UPSTREAM_FAIL_FAST, the scrapyrt crawls)
+# - the rate is halved on 429 and 5xx responses, failed downloads and
+#   downloads slower than UPSTREAM_TARGET_LATENCY, and grows back by
+#   UPSTREAM_RATE_STEP on every fast successful one (AIMD). Retry-After is
+#   honored.
+# - after BREAKER_FAILURES failures in a row the circuit opens: downloads
+#   fail immediately for BREAKER_COOLDOWN seconds, then a single request
+#   probes the site and closes the circuit again if it succeeds
+#
+# The crawls that do not fail fast (command line, bulk ingestion) wait
+# instead: for their token however long it takes, and for the end of the
+# cooldown while the circuit is open.
+#
+# The upstreams are configured with the following environment variables:
+#
+# UPSTREAM_RATE (default: 4 requests per second, the most the rate grows to)
+# UPSTREAM_MIN_RATE (default: 0.25 requests per second)
+# UPSTREAM_RATE_STEP (default: 0.1 requests per second)
+# UPSTREAM_BURST (default: 8 requests)
+# UPSTREAM_TARGET_LATENCY (default: 5 seconds)
+# UPSTREAM_MAX_WAIT (default: 30 seconds)
+# BREAKER_FAILURES (default: 5)
+# BREAKER_COOLDOWN (default: 30 seconds)
+
+import math
+import os
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from dotenv import load_dotenv
+from scrapy.exceptions import IgnoreRequest
+
+from nist_scraper import metrics
+
+load_dotenv()
+
+UPSTREAM_RATE = float(os.environ.get("UPSTREAM_RATE", 4))
+UPSTREAM_MIN_RATE = float(os.environ.get("UPSTREAM_MIN_RATE", 0.25))
+UPSTREAM_RATE_STEP = float(os.environ.get("UPSTREAM_RATE_STEP", 0.1))
+UPSTREAM_BURST = float(os.environ.get("UPSTREAM_BURST", 8))
+UPSTREAM_TARGET_LATENCY = float(os.environ.get("UPSTREAM_TARGET_LATENCY", 5))
+UPSTREAM_MAX_WAIT = float(os.environ.get("UPSTREAM_MAX_WAIT", 30))
+BREAKER_FAILURES = int(os.environ.get("BREAKER_FAILURES", 5))
+BREAKER_COOLDOWN = float(os.environ.get("BREAKER_COOLDOWN", 30))
+
+# Statuses telling the site is overloaded or failing
+BACKOFF_STATUSES = [429, 500, 502, 503, 504, 522, 524]
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class UpstreamUnavailable(IgnoreRequest):
+    def __init__(self, host: str, reason: str, retry_after: float):
+        super().__init__(
+            "{} is unavailable ({}), retry in {} seconds".format(
+                host, reason, math.ceil(retry_after)
+            )
+        )
+        self.host = host
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def retry_after(value, now: float = None) -> float:
+    # Seconds of a Retry-After header, given in seconds or as an HTTP date
+    if not value:
+        return 0.0
+    if isinstance(value, bytes):
+        value = value.decode("latin-1")
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return max(0.0, date.timestamp() - (time.time() if now is None else now))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        # No token is given before this time (Retry-After)
+        self.paused_until = 0.0
+
+    def refill(self, now: float):
+        start = max(self.updated, self.paused_until)
+        if now > start:
+            self.tokens = min(self.burst, self.tokens + (now - start) * self.rate)
+        self.updated = max(now, self.updated)
+
+    def wait(self, now: float) -> float:
+        # Seconds until the next token, the waiting requests took theirs
+        # already (tokens below zero)
+        self.refill(now)
+        pause = max(0.0, self.paused_until - now)
+        return pause + max(0.0, 1 - self.tokens) / self.rate
+
+    def take(self, now: float):
+        self.refill(now)
+        self.tokens -= 1
+
+    def pause(self, now: float, seconds: float):
+        self.refill(now)
+        self.paused_until = max(self.paused_until, now + seconds)
+
+
+class CircuitBreaker:
+    def __init__(self, failures: int = BREAKER_FAILURES, cooldown: float = BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.state = CLOSED
+        self.consecutive = 0
+        self.opened = 0.0
+        # Times the circuit opened, the requests waiting for a token since
+        # before are not sent
+        self.trips = 0
+        # A probe that never got an answer (dropped request) gives way to
+        # another one after the cooldown
+        self.probing = False
+        self.probe_started = 0.0
+
+    def retry_after(self, now: float) -> float:
+        return max(0.0, self.opened + self.cooldown - now)
+
+    def allow(self, now: float) -> bool:
+        # Closed lets everything through, open nothing until the cooldown is
+        # over, half open a single probe at a time
+        if self.state == OPEN and self.retry_after(now) == 0:
+            self.state = HALF_OPEN
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and (
+            not self.probing or now - self.probe_started > self.cooldown
+        ):
+            self.probing = True
+            self.probe_started = now
+            return True
+        return False
+
+    def success(self):
+        self.state = CLOSED
+        self.consecutive = 0
+        self.probing = False
+
+    def failure(self, now: float):
+        self.consecutive += 1
+        self.probing = False
+        if self.state == HALF_OPEN or self.consecutive >= self.failures:
+            self.state = OPEN
+            self.opened = now
+            self.trips += 1
+
+
+class Upstream:
+    def __init__(
+        self,
+        host: str,
+        rate: float = UPSTREAM_RATE,
+        min_rate: float = UPSTREAM_MIN_RATE,
+        rate_step: float = UPSTREAM_RATE_STEP,
+        burst: float = UPSTREAM_BURST,
+        target_latency: float = UPSTREAM_TARGET_LATENCY,
+        max_wait: float = UPSTREAM_MAX_WAIT,
+        breaker: CircuitBreaker = None,
+    ):
+        self.host = host
+        self.max_rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.rate_step = rate_step
+        self.target_latency = target_latency
+        self.max_wait = max_wait
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = breaker or CircuitBreaker()
+        self.lock = threading.Lock()
+        self.last_decrease = 0.0
+
+    @property
+    def rate(self) -> float:
+        return self.bucket.rate
+
+    def available(self) -> bool:
+        # Whether a crawl has a chance, for the resources to fail fast
+        with self.lock:
+            return self.breaker.state != OPEN or self.breaker.retry_after(time.monotonic()) == 0
+
+    def acquire(self, fail_fast: bool = True) -> float:
+        # Seconds the download has to wait, raises UpstreamUnavailable when
+        # the circuit is open or, failing fast, the wait is too long
+        with self.lock:
+            now = time.monotonic()
+            if not self.breaker.allow(now):
+                raise UpstreamUnavailable(self.host, "circuit open", self.breaker.retry_after(now))
+            delay = self.bucket.wait(now)
+            if fail_fast and delay > self.max_wait:
+                self.breaker.probing = False
+                raise UpstreamUnavailable(self.host, "too many requests queued", delay)
+            self.bucket.take(now)
+            return delay
+
+    def admit(self, trips: int):
+        # Called once a request waited for its token: it is not sent if the
+        # circuit opened meanwhile, and its token is given back
+        with self.lock:
+            if self.breaker.trips != trips:
+                self.bucket.tokens += 1
+                now = time.monotonic()
+                raise UpstreamUnavailable(self.host, "circuit open", self.breaker.retry_after(now))
+
+    def decrease(self, now: float):
+        # Halved at most once per second, the responses of a burst report
+        # the same congestion
+        if now - self.last_decrease >= 1:
+            self.last_decrease = now
+            self.bucket.refill(now)
+            self.bucket.rate = max(self.min_rate, self.bucket.rate / 2)
+
+    def response(self, status: int, latency: float = None, wait: float = 0.0):
+        with self.lock:
+            now = time.monotonic()
+            if status in BACKOFF_STATUSES:
+                self.decrease(now)
+                if wait:
+                    self.bucket.pause(now, wait)
+                self.breaker.failure(now)
+                return
+
+            self.breaker.success()
+            if latency is not None and latency > self.target_latency:
+                self.decrease(now)
+            else:
+                self.bucket.refill(now)
+                self.bucket.rate = min(self.max_rate, self.bucket.rate + self.rate_step)
+
+    def error(self):
+        # Timeouts, refused connections... anything but an HTTP response
+        with self.lock:
+            now = time.monotonic()
+            self.decrease(now)
+            self.breaker.failure(now)
+
+    def stats(self) -> dict:
+        with self.lock:
+            now = time.monotonic()
+            return {
+                "rate": round(self.bucket.rate, 3),
+                "tokens": round(self.bucket.tokens, 3),
+                "circuit": self.breaker.state,
+                "consecutive_failures": self.breaker.consecutive,
+                "retry_after": round(self.breaker.retry_after(now), 3)
+                if self.breaker.state != CLOSED
+                else 0.0,
+            }
+
+
+# Upstreams by host, shared by the crawls of the process
+upstreams = {}
+upstreams_lock = threading.Lock()
+
+
+def upstream(url: str) -> Upstream:
+    host = urlparse(url).hostname or ""
+    with upstreams_lock:
+        if host not in upstreams:
+            upstreams[host] = Upstream(host)
+        return upstreams[host]
+
+
+def stats() -> dict:
+    with upstreams_lock:
+        hosts = list(upstreams.items())
+    return dict((host, upstream.stats()) for host, upstream in hosts)
+
+
+metrics.registry.gauge(
+    "nist_upstream_rate",
+    "Requests per second the rate limiter lets through, by host",
+    ["host"],
+    collect=lambda: dict(((host,), values["rate"]) for host, values in stats().items()),
+)
+metrics.registry.gauge(
+    "nist_upstream_circuit_open",
+    "1 while the circuit breaker of a host is open or half open",
+    ["host"],
+    collect=lambda: dict(
+        ((host,), int(values["circuit"] != CLOSED)) for host, values in stats().items()
+    ),
+)
+rejections = metrics.registry.counter(
+    "nist_upstream_rejections_total",
+    "Downloads failed without being sent, by host and reason",
+    ["host", "reason"],
+)
@@ -0,0 +1,30 @@
+import mongomock
+import pytest
+from twisted.web.test.requesthelper import DummyRequest
+
+from nist_scraper.database import connection
+
+
+def render_get(resource, **args):
+    # What the resource renders for a GET with the given url parameters
+    request = DummyRequest([b""])
+    request.method = b"GET"
+    request.args = dict(
+        (name.encode("utf-8"), [value.encode("utf-8")]) for name, value in args.items()
+    )
+    return resource.render_GET(request)
+
+
+@pytest.fixture
+def get():
+    return render_get
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    # The shared connection of the process on an in-memory database
+    client = mongomock.MongoClient()
+    monkeypatch.setenv("MONGO_DB", "test")
+    monkeypatch.setattr(connection, "_client", client)
+    monkeypatch.setattr(connection, "indexed", set())
+    return client
@@ -0,0 +1,38 @@
+import mongomock
+
+from nist_scraper.autocomplete import NameIndex
+
+
+def index():
+    collection = mongomock.MongoClient().db.substances
+    collection.insert_many(
+        [
+            {"cas": "75343", "name": "1,1-dichloroethane", "synonyms": ["ethylidene chloride"]},
+            {"cas": "107862", "name": "2-methylpentane"},
+            {"cas": "60297", "name": "diethyl ether", "synonyms": ["ethyl ether"]},
+        ]
+    )
+    names = NameIndex()
+    names.load(collection)
+    return names
+
+
+def test_resolve_takes_exact_names_and_synonyms():
+    names = index()
+    assert names.resolve("Diethyl  Ether") == "60297"
+    assert names.resolve("ethyl+ether") == "60297"
+    assert names.resolve("ethylidene chloride") == "75343"
+
+
+def test_resolve_does_not_take_close_names():
+    names = index()
+    assert names.resolve("1,2-dichloroethane") is None
+    assert names.resolve("3-methylpentane") is None
+    # A word of a name is not the name
+    assert names.resolve("ether") is None
+
+
+def test_autocomplete_still_finds_close_names():
+    names = index()
+    matches = names.complete("1,2-dichloroethane", 5)
+    assert matches[0]["cas"] == "75343"
@@ -0,0 +1,53 @@
+from nist_scraper import cache
+from nist_scraper.cache import TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_is_evicted():
+    entries = TTLCache(maxsize=2, ttl=60)
+    entries.set("water", 1)
+    entries.set("ethanol", 2)
+    assert entries.get("water") == 1
+    entries.set("methane", 3)
+
+    assert entries.get("ethanol") is None
+    assert entries.get("water") == 1
+    assert entries.get("methane") == 3
+    assert entries.stats()["evictions"] == 1
+
+
+def test_entries_expire(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    entries = TTLCache(maxsize=2, ttl=60)
+    entries.set("water", 1)
+
+    clock.now += 59
+    assert entries.get("water") == 1
+    clock.now += 2
+    assert entries.get("water") is None
+    assert entries.stats()["expirations"] == 1
+    assert entries.stats()["size"] == 0
+
+
+def test_invalidate():
+    entries = TTLCache(maxsize=2, ttl=60)
+    entries.set("water", 1)
+    entries.invalidate("water")
+    entries.invalidate("ethanol")
+
+    assert entries.get("water") is None
+    assert entries.stats()["invalidations"] == 1
+
+
+def test_size_zero_disables_the_cache():
+    entries = TTLCache(maxsize=0, ttl=60)
+    entries.set("water", 1)
+    assert entries.get("water") is None
@@ -0,0 +1,64 @@
+import math
+
+import pytest
+
+from nist_scraper.codec import is_packed, pack, pack_document, unpack, unpack_document
+
+# Equations of a couple of ranges are not packed, they are not smaller
+SHOMATE = [
+    {"temperatures": [300.0 * i, 300.0 * (i + 1)], "A": 30.09, "B": 6.83, "C": 6.79, "D": -2.53,
+     "E": None if i == 1 else 0.08}
+    for i in range(1, 9)
+]
+HEAT_CAPACITY = [[75.3 + i / 10, 280.0 + i] for i in range(40)]
+
+
+def test_documents_round_trip():
+    document = {
+        "cas": "7732185",
+        "name": "water",
+        "heat_capacity_shomate_equation_gas": SHOMATE,
+        "constant_pressure_heat_capacity_values_liquid": HEAT_CAPACITY,
+        "enthalpy_vaporization_values": [],
+    }
+    packed = pack_document(document)
+    assert is_packed(packed["heat_capacity_shomate_equation_gas"])
+    assert is_packed(packed["constant_pressure_heat_capacity_values_liquid"])
+    # Empty series are stored as they are
+    assert packed["enthalpy_vaporization_values"] == []
+    # The document given is left as it was
+    assert document["constant_pressure_heat_capacity_values_liquid"] is HEAT_CAPACITY
+
+    assert unpack_document(packed) == document
+
+
+def test_missing_values_come_back_as_none():
+    packed = pack(SHOMATE)
+    assert packed["missing"] is True
+    assert unpack(packed)[0]["E"] is None
+
+
+def test_nan_is_kept():
+    series = [[float("nan"), 300.0]] + HEAT_CAPACITY
+    values = unpack(pack(series))
+    assert math.isnan(values[0][0])
+    assert values[1:] == HEAT_CAPACITY
+
+
+@pytest.mark.parametrize(
+    "series",
+    [
+        [],
+        [[1.0, "K"], [2.0, "K"]],
+        [{"temperatures": [298.0, 500.0], "reference": "Chase, 1998"}],
+        [[1.0, 2.0], [3.0]],
+    ],
+)
+def test_series_that_do_not_fit_are_left_as_they_are(series):
+    assert pack(series) is series
+
+
+def test_unknown_versions_are_rejected():
+    packed = dict(pack(HEAT_CAPACITY), _v=99)
+    with pytest.raises(ValueError):
+        unpack(packed)
@@ -0,0 +1,68 @@
+import time
+from email.utils import formatdate
+
+from scrapy import Spider
+from scrapy.http import Request, Response
+from scrapy.settings import Settings
+from scrapy.utils.test import get_crawler
+
+from nist_scraper.httpcache import DAY, NistCachePolicy, NistHttpCacheMiddleware
+
+URL = "https://webbook.nist.gov/cgi/cbook.cgi?ID=C7732185&Units=SI"
+
+
+def settings(tmp_path, **values):
+    return Settings(
+        dict(
+            HTTPCACHE_ENABLED=True,
+            HTTPCACHE_DIR=str(tmp_path),
+            HTTPCACHE_STORAGE="nist_scraper.httpcache.SqliteCacheStorage",
+            HTTPCACHE_POLICY="nist_scraper.httpcache.NistCachePolicy",
+            **values
+        )
+    )
+
+
+def page(age, **headers):
+    headers["Date"] = formatdate(time.time() - age, usegmt=True)
+    return Response(URL, status=200, headers=headers, body=b"<html></html>")
+
+
+def test_ttl_by_mask(tmp_path):
+    policy = NistCachePolicy(settings(tmp_path, HTTPCACHE_SECTION_TTLS={4: 60}))
+    assert policy.ttl(Request(URL)) == 7 * DAY
+    assert policy.ttl(Request(URL + "&Mask=1")) == 30 * DAY
+    assert policy.ttl(Request(URL + "&Mask=4")) == 60
+    assert policy.ttl(Request(URL + "&Mask=800")) == 7 * DAY
+
+
+def test_stale_pages_are_revalidated(tmp_path):
+    policy = NistCachePolicy(settings(tmp_path))
+    request = Request(URL + "&Mask=4")
+    assert policy.is_cached_response_fresh(page(29 * DAY, ETag='"v1"'), request)
+
+    assert not policy.is_cached_response_fresh(page(31 * DAY, ETag='"v1"'), request)
+    assert request.headers[b"If-None-Match"] == b'"v1"'
+
+
+def test_not_modified_refreshes_the_stored_headers(tmp_path):
+    spider = Spider("webbook_nist")
+    crawler = get_crawler(settings_dict=dict(settings(tmp_path)))
+    middleware = NistHttpCacheMiddleware(crawler.settings, crawler.stats)
+    middleware.spider_opened(spider)
+    try:
+        request = Request(URL)
+        stale = page(8 * DAY, ETag='"v1"')
+        middleware.storage.store_response(spider, request, stale)
+
+        # Stale, the request goes out with its validators
+        assert middleware.process_request(request, spider) is None
+        not_modified = Response(URL, status=304, headers=page(0).headers, request=request)
+        middleware.process_response(request, not_modified, spider)
+
+        stored = middleware.storage.retrieve_response(spider, Request(URL))
+        assert stored.headers[b"Date"] == not_modified.headers[b"Date"]
+        assert stored.headers[b"ETag"] == b'"v1"'
+        assert middleware.policy.is_cached_response_fresh(stored, Request(URL))
+    finally:
+        middleware.spider_closed(spider)
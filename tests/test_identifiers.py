@@ -0,0 +1,72 @@
+import pytest
+
+from nist_scraper.cache import substance_key
+from nist_scraper.identifiers import (
+    InvalidIdentifier,
+    canonical,
+    canonical_document,
+    cas_check_digit,
+    format_cas,
+)
+
+
+def test_cas_check_digit():
+    # 7732-18-5: 8*1 + 1*2 + 2*3 + 3*4 + 7*5 + 7*6 = 105
+    assert cas_check_digit("773218") == 5
+    assert cas_check_digit("6417") == 5
+
+
+@pytest.mark.parametrize("value", ["7732-18-5", "7732185", "C7732185", " 7732 18 5 ", "7732–18–5"])
+def test_cas_forms(value):
+    assert canonical("cas", value) == "7732185"
+
+
+@pytest.mark.parametrize("value", ["7732-18-4", "12", "water", "7732-18-5x", ""])
+def test_malformed_cas(value):
+    with pytest.raises(InvalidIdentifier):
+        canonical("cas", value)
+
+
+def test_format_cas():
+    assert format_cas("7732185") == "7732-18-5"
+
+
+@pytest.mark.parametrize(
+    "value, name",
+    [
+        ("Ethyl+Ether", "ethyl ether"),
+        ("ethyl   ether ", "ethyl ether"),
+        ("(+)-Camphor", "(+)-camphor"),
+        ("1,2‐Dichloroethane", "1,2-dichloroethane"),
+    ],
+)
+def test_names(value, name):
+    assert canonical("name", value) == name
+
+
+def test_inchikeys():
+    inchikey = "XLYOFNOQVPJJNP-UHFFFAOYSA-N"
+    assert canonical("iupac_std_inchikey", "InChIKey=" + inchikey.lower()) == inchikey
+    with pytest.raises(InvalidIdentifier):
+        canonical("iupac_std_inchikey", "XLYOFNOQVPJJNP-UHFFFAOYSA")
+
+
+def test_canonical_document():
+    document = {
+        "cas": "7732-18-5",
+        "name": "Water",
+        "iupac_std_inchikey": "not an inchikey",
+        "synonyms": ["Dihydrogen  oxide", "H2O"],
+    }
+    assert canonical_document(document) == {
+        "cas": "7732185",
+        "name": "water",
+        "synonyms": ["dihydrogen oxide", "h2o"],
+    }
+
+
+def test_substance_keys_meet():
+    assert substance_key("cas", "7732-18-5") == substance_key("cas", "C7732185")
+    assert substance_key("name", "Ethyl+Ether") == substance_key("name", "ethyl ether")
+    with pytest.raises(InvalidIdentifier):
+        substance_key("cas", "7732-18-4")
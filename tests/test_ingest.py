@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from nist_scraper import ingest
+from nist_scraper.ingest import Checkpoint, identifier, pending_identifiers, read_entries
+
+ENTRIES = [
+    {"name": "Water", "cas": "7732-18-5"},
+    {"name": "ethyl ether"},
+]
+
+
+def write(path, text):
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def test_read_json_ndjson_and_csv(tmp_path):
+    # JSON as written by the Scrapy feed exporter, one item per line
+    exported = "[\n" + ",\n".join(json.dumps(entry) for entry in ENTRIES) + "\n]\n"
+    assert list(read_entries(write(tmp_path / "links.json", exported))) == ENTRIES
+
+    lines = "\n".join(json.dumps(entry) for entry in ENTRIES) + "\n\n"
+    assert list(read_entries(write(tmp_path / "links.ndjson", lines))) == ENTRIES
+
+    table = "name,cas\nWater,7732-18-5\nethyl ether,\n"
+    assert list(read_entries(write(tmp_path / "links.csv", table))) == [
+        {"name": "Water", "cas": "7732-18-5"},
+        {"name": "ethyl ether", "cas": ""},
+    ]
+
+
+def test_json_that_is_not_one_item_per_line(tmp_path):
+    with pytest.raises(ValueError):
+        list(read_entries(write(tmp_path / "links.json", json.dumps(ENTRIES, indent=2))))
+
+
+@pytest.mark.parametrize(
+    "entry, found",
+    [
+        ({"cas": "7732-18-5", "name": "water"}, ("cas", "7732185")),
+        ({"name": " ethyl ether"}, ("name", "ethyl+ether")),
+        ({"link": "https://webbook.nist.gov/cgi/cbook.cgi?ID=C64175&Units=SI"}, ("cas", "64175")),
+        ({"url": "https://webbook.nist.gov/cgi/cbook.cgi?Name=ethyl+ether&Units=SI"}, ("name", "ethyl+ether")),
+        ({"link": "https://webbook.nist.gov/cgi/cbook.cgi?ID=B6004591"}, None),
+        ({"title": "water"}, None),
+    ],
+)
+def test_identifier_of_links_json_entries(entry, found):
+    assert identifier(entry) == found
+
+
+def test_checkpoint_resumes(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "stored", lambda search_by, values: set())
+    source = write(tmp_path / "links.ndjson", '{"cas": "7732-18-5"}\n{"cas": "64-17-5"}\n')
+    path = str(tmp_path / "links.checkpoint")
+
+    checkpoint = Checkpoint(path)
+    checkpoint.mark(["7732185", "7732185"])
+    checkpoint.close()
+
+    resumed = Checkpoint(path)
+    try:
+        assert "7732185" in resumed
+        assert list(pending_identifiers(source, resumed)) == [("cas", "64175")]
+    finally:
+        resumed.close()
+    with open(path, encoding="utf-8") as f:
+        assert f.read() == "7732185\n"
+
+
+def test_stored_identifiers_are_skipped(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingest, "stored", lambda search_by, values: {"7732185"})
+    source = write(tmp_path / "links.ndjson", '{"cas": "7732-18-5"}\n{"cas": "64-17-5"}\n')
+    assert list(pending_identifiers(source)) == [("cas", "64175")]
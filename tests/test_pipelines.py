@@ -0,0 +1,127 @@
+import mongomock
+import pytest
+from pymongo.errors import ServerSelectionTimeoutError
+from scrapy import Spider
+from twisted.internet import defer
+
+from nist_scraper.database import connection
+from nist_scraper import pipelines
+from nist_scraper.pipelines import MongoPipeline
+from nist_scraper.scrapyrt import threads
+
+
+class Unreachable:
+    # A collection whose server never answers, until it comes back
+    def __init__(self, collection):
+        self.collection = collection
+        self.down = True
+        self.calls = 0
+
+    def __getattr__(self, name):
+        if self.down:
+            def unreachable(*args, **kwargs):
+                self.calls += 1
+                raise ServerSelectionTimeoutError("localhost:27017: connection refused")
+            return unreachable
+        return getattr(self.collection, name)
+
+
+def substance(i):
+    return {"cas": "7732185" if i == 0 else str(i), "name": "water", "image": "water.png"}
+
+
+@pytest.fixture
+def pipeline(monkeypatch, mongo):
+    # The writes run right away instead of in the database thread pool
+    writes = []
+    monkeypatch.setattr(
+        threads,
+        "run_in_thread",
+        lambda f, *args, **kwargs: writes.append(f) or defer.maybeDeferred(f, *args, **kwargs),
+    )
+    pipeline = MongoPipeline(None, "test", bulk_size=2, bulk_interval=3600, buffer_max=4)
+    pipeline.open_spider(Spider("pipeline_test"))
+    pipeline.writes = writes
+    pipeline.collection = Unreachable(pipeline.db["substances"])
+    pipeline.db = {"substances": pipeline.collection}
+    yield pipeline
+    if pipeline.flush_loop.running:
+        pipeline.flush_loop.stop()
+
+
+def test_flush_keeps_the_items_when_the_database_is_down(pipeline):
+    pipeline.process_item(substance(0), None)
+    pipeline.flush()
+    assert len(pipeline.buffer) == 1
+    assert pipeline.writes == [pipeline.write]
+    assert pipeline.flush_loop.running
+
+    pipeline.collection.down = False
+    pipeline.flush()
+    assert pipeline.buffer == []
+    assert pipeline.inserted == 1
+    assert pipeline.collection.find_one({"cas": "7732185"})["name"] == "water"
+
+
+def test_only_the_flush_loop_retries_a_failed_write(pipeline):
+    pipeline.process_item(substance(0), None)
+    pipeline.process_item(substance(1), None)
+    assert pipeline.collection.calls == 1
+
+    # The buffer is full, but the items do not wait for the database again
+    pipeline.process_item(substance(2), None)
+    pipeline.process_item(substance(3), None)
+    assert pipeline.collection.calls == 1
+
+    # Beyond buffer_max the items are dropped
+    pipeline.process_item(substance(4), None)
+    assert len(pipeline.buffer) == 4
+    assert pipeline.dropped == 1
+
+    pipeline.collection.down = False
+    pipeline.flush()
+    assert pipeline.buffer == []
+    assert pipeline.inserted == 4
+    assert not pipeline.failing
+
+
+def test_indexes_are_created_once_per_process(monkeypatch, mongo):
+    created = []
+    create_index = mongomock.Collection.create_index
+    monkeypatch.setattr(
+        mongomock.Collection,
+        "create_index",
+        lambda self, *args, **kwargs: created.append(repr(args)) or create_index(self, *args, **kwargs),
+    )
+
+    connection.ensure_indexes()
+    connection.ensure_indexes()
+    pipeline = MongoPipeline(None, "test", bulk_size=100, bulk_interval=3600)
+    pipeline.open_spider(Spider("pipeline_test"))
+    pipeline.flush_loop.stop()
+
+    assert len(created) == len(set(created)) > 0
+
+
+class Snapshot:
+    def __init__(self):
+        self.appended = []
+
+    def exists(self):
+        return True
+
+    def append(self, documents):
+        self.appended.append([document["cas"] for document in documents])
+
+
+def test_snapshot_is_appended_with_the_write_off_the_reactor(pipeline, monkeypatch):
+    # write() is what runs in the database thread pool, written() runs on
+    # the reactor
+    snapshot = Snapshot()
+    monkeypatch.setattr(pipelines, "snapshot", snapshot)
+    monkeypatch.setattr(pipeline, "written", lambda *args: snapshot.appended.append("reactor"))
+    pipeline.collection.down = False
+
+    pipeline.process_item(substance(0), None)
+    pipeline.flush()
+    assert snapshot.appended == [["7732185"], "reactor"]
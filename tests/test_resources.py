@@ -0,0 +1,118 @@
+import json
+
+import pytest
+from twisted.internet import defer
+from twisted.web.error import Error
+from twisted.web.test.requesthelper import DummyRequest
+
+from nist_scraper.autocomplete import name_index
+from nist_scraper.scrapyrt.resources import (
+    AutocompleteResource,
+    CheckDatabaseBeforeCrawlResource,
+    ExportResource,
+    QueryResource,
+    SubstancesResource,
+)
+from nist_scraper.scrapyrt import resources, threads
+
+
+@pytest.mark.parametrize("batch_size", ["0", "-5", "abc", "1.5"])
+def test_export_rejects_bad_batch_sizes(batch_size, get):
+    with pytest.raises(Error) as error:
+        get(ExportResource(), batch_size=batch_size)
+    assert error.value.status == "400"
+
+
+@pytest.mark.parametrize("limit", ["0", "ten"])
+def test_autocomplete_rejects_bad_limits(monkeypatch, limit, get):
+    monkeypatch.setattr(name_index, "loaded", True)
+    # Created without __init__, which loads the name index
+    resource = AutocompleteResource.__new__(AutocompleteResource)
+    with pytest.raises(Error) as error:
+        get(resource, q="wat", limit=limit)
+    assert error.value.status == "400"
+
+
+@pytest.mark.parametrize("limit", ["-1", "many"])
+def test_query_rejects_bad_limits(limit, get):
+    with pytest.raises(Error) as error:
+        get(QueryResource(), where="temperature_critical>=600", limit=limit)
+    assert error.value.status == "400"
+
+
+def crawl_request(**crawl_args):
+    request = DummyRequest([b""])
+    request.args = {
+        b"spider_name": [b"webbook_nist"],
+        b"crawl_args": [json.dumps(crawl_args).encode("utf-8")],
+    }
+    return request
+
+
+def test_crawls_are_shared_only_with_the_same_arguments():
+    resource = CheckDatabaseBeforeCrawlResource.__new__(CheckDatabaseBeforeCrawlResource)
+    key = ("cas", "7732185")
+    plain = resource.flight_key(crawl_request(search_by="cas", cas="7732-18-5"), key)
+    combined = resource.flight_key(
+        crawl_request(search_by="cas", cas="7732-18-5", combined=True), key
+    )
+    assert plain != combined
+    assert combined == resource.flight_key(
+        crawl_request(combined=True, cas="7732185", search_by="cas"), key
+    )
+
+
+@pytest.mark.parametrize(
+    "crawl_args", ['{"search_by": "cas"}', '{"cas": "7732-18-5"}', "not json"]
+)
+def test_crawl_without_an_identifier(crawl_args):
+    resource = CheckDatabaseBeforeCrawlResource.__new__(CheckDatabaseBeforeCrawlResource)
+    with pytest.raises(Error) as error:
+        resource.lookup(None, {"crawl_args": crawl_args})
+    assert error.value.status == "400"
+
+
+def substances_resource():
+    # Created without __init__, which creates the indexes
+    return SubstancesResource.__new__(SubstancesResource)
+
+
+@pytest.mark.parametrize(
+    "args", [{"per_page": "0"}, {"per_page": "twenty"}, {"page": "-1"}, {"after": "7732-18-4"}]
+)
+def test_substances_rejects_bad_pages(args, get):
+    with pytest.raises(Error) as error:
+        get(substances_resource(), **args)
+    assert error.value.status == "400"
+
+
+def test_substances_after_a_dashed_cas(monkeypatch, get):
+    pages = []
+    monkeypatch.setattr(threads, "run_in_thread", lambda f, *args: pages.append(args))
+    get(substances_resource(), after="7732-18-5", per_page="10")
+    assert pages == [("7732185", 10)]
+
+
+def test_batch_crawls_a_substance_once_for_all_its_identifiers(monkeypatch):
+    resource = CheckDatabaseBeforeCrawlResource.__new__(CheckDatabaseBeforeCrawlResource)
+    crawled = []
+
+    def prepare_crawl(api_params, scrapy_request_args, **kwargs):
+        crawl_args = json.loads(api_params["crawl_args"])
+        crawled.append(crawl_args["cas"])
+        return defer.succeed({"items": [
+            {"query": value, "cas": "64175", "name": "ethanol"} for value in crawl_args["cas"]
+        ]})
+
+    monkeypatch.setattr(resource, "prepare_crawl", prepare_crawl)
+    monkeypatch.setattr(resource, "validate_options", lambda *args: None)
+    monkeypatch.setattr(resources.webbook, "available", lambda: True)
+    values = ["64-17-5", "64175", "C64175"]
+
+    results = []
+    resource.crawl_batch({}, {}, {}, "cas", values, values).addCallback(results.append)
+
+    assert crawled == [["64-17-5"]]
+    assert results[0]["items"] == dict(
+        (value, {"cas": "64175", "name": "ethanol"}) for value in values
+    )
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+from twisted.web.error import Error
+
+from nist_scraper.database import connection
+from nist_scraper.scrapyrt.resources import SearchResource
+from nist_scraper.search import build_filter, check
+
+# The explain plans need a real server, mongomock does not plan queries
+needs_mongo = pytest.mark.skipif(
+    not os.environ.get("MONGO_URI"), reason="needs a MongoDB server (MONGO_URI)"
+)
+
+SUBSTANCES = [
+    {
+        "cas": "7732185",
+        "name": "water",
+        "formula": "H2O",
+        "elements": ["H", "O"],
+        "molecular_weight": 18.0153,
+        "temperature_critical": {"value": 647.0, "units": "K"},
+    },
+    {
+        "cas": "64175",
+        "name": "ethanol",
+        "formula": "C2H6O",
+        "elements": ["C", "H", "O"],
+        "molecular_weight": 46.0684,
+        "temperature_critical": {"value": 514.0, "units": "K"},
+    },
+    {
+        "cas": "74828",
+        "name": "methane",
+        "formula": "CH4",
+        "elements": ["C", "H"],
+        "molecular_weight": 16.0425,
+        "temperature_critical": {"value": 190.6, "units": "K"},
+    },
+]
+
+
+@pytest.fixture
+def collection(mongo):
+    collection = connection.collection()
+    collection.insert_many([dict(substance) for substance in SUBSTANCES])
+    return collection
+
+
+def names(collection, where="", elements=""):
+    return sorted(
+        substance["name"] for substance in collection.find(build_filter(where, elements))
+    )
+
+
+def test_ranges_compare_the_stored_values(collection):
+    assert build_filter("temperature_critical>=400,temperature_critical<600") == {
+        "temperature_critical.value": {"$gte": 400.0, "$lt": 600.0}
+    }
+    assert names(collection, "temperature_critical>=400,temperature_critical<600") == ["ethanol"]
+    assert names(collection, "molecular_weight<20") == ["methane", "water"]
+
+
+def test_elements_must_all_be_in_the_formula(collection):
+    assert names(collection, elements="C,H") == ["ethanol", "methane"]
+    assert names(collection, "molecular_weight>20", "C,H,O") == ["ethanol"]
+
+
+def test_equalities(collection):
+    assert names(collection, "formula=H2O") == ["water"]
+
+
+@pytest.mark.parametrize(
+    "where, elements",
+    [("", ""), ("temperature_critical!=400", ""), ("image=x", ""), ("", "c")],
+)
+def test_invalid_searches(where, elements):
+    with pytest.raises(ValueError):
+        build_filter(where, elements)
+
+
+@pytest.mark.parametrize("limit", ["0", "abc", "100000"])
+def test_search_rejects_bad_limits(limit, get):
+    with pytest.raises(Error) as error:
+        get(SearchResource(), where="molecular_weight<20", limit=limit)
+    assert error.value.status == "400"
+
+
+@needs_mongo
+def test_every_search_uses_an_index():
+    connection.ensure_indexes("search_test")
+    collection = connection.collection("search_test")
+    try:
+        collection.insert_many([dict(substance) for substance in SUBSTANCES])
+        assert check(collection)
+    finally:
+        collection.drop()
@@ -0,0 +1,44 @@
+from twisted.internet import defer
+
+from nist_scraper.scrapyrt.singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    crawl = defer.Deferred()
+    calls = []
+    results = []
+
+    for _ in range(3):
+        flight.run(("cas", "7732185"), lambda: calls.append(1) or crawl).addCallback(
+            results.append
+        )
+    assert len(calls) == 1
+    assert flight.stats() == {"in_flight": 1, "started": 1, "coalesced": 2}
+
+    crawl.callback({"items": ["water"]})
+    assert results == [{"items": ["water"]}] * 3
+
+
+def test_errors_reach_every_caller():
+    flight = SingleFlight()
+    crawl = defer.Deferred()
+    failures = []
+    for _ in range(2):
+        flight.run("water", lambda: crawl).addErrback(failures.append)
+
+    crawl.errback(RuntimeError("timeout"))
+    assert [failure.value.args for failure in failures] == [("timeout",)] * 2
+
+
+def test_key_is_released_once_finished():
+    flight = SingleFlight()
+    crawl = defer.Deferred()
+    flight.run("water", lambda: crawl)
+    crawl.callback(None)
+    assert flight.calls == {}
+
+    calls = []
+    flight.run("water", lambda: calls.append(1))
+    assert calls == [1]
+    assert flight.stats()["started"] == 2
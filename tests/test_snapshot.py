@@ -0,0 +1,29 @@
+from nist_scraper.snapshot import Snapshot, parse_where
+
+
+def water(temperature_critical):
+    return {
+        "cas": "7732185",
+        "name": "water",
+        "temperature_critical": {"value": temperature_critical, "units": "K"},
+    }
+
+
+def test_superseded_rows_do_not_match(tmp_path):
+    snapshot = Snapshot(str(tmp_path / "snapshot"), max_segments=16)
+    snapshot.append([water(647.0)])
+    snapshot.append([water(300.0)])
+
+    assert snapshot.query(parse_where("temperature_critical>=600"), ["cas"]) == (0, [])
+    total, rows = snapshot.query(parse_where("temperature_critical<400"), ["temperature_critical"])
+    assert (total, rows) == (1, [{"temperature_critical": 300.0}])
+
+
+def test_new_segments_refresh_the_live_rows(tmp_path):
+    snapshot = Snapshot(str(tmp_path / "snapshot"), max_segments=16)
+    snapshot.append([water(300.0)])
+    assert snapshot.query(parse_where("temperature_critical<400"), ["cas"])[0] == 1
+
+    snapshot.append([water(647.0)])
+    assert snapshot.query(parse_where("temperature_critical<400"), ["cas"])[0] == 0
+    assert snapshot.query(parse_where("temperature_critical>=600"), ["cas"])[0] == 1
@@ -0,0 +1,103 @@
+import pytest
+from scrapy.http import Request, Response
+from twisted.internet.task import Clock
+
+from nist_scraper import metrics, middlewares, upstream
+from nist_scraper.middlewares import NistScraperDownloaderMiddleware
+
+URL = "https://webbook.nist.gov/cgi/cbook.cgi?ID=C7732185&Units=SI"
+
+
+@pytest.fixture
+def open_breaker(monkeypatch):
+    # The upstreams are shared by the whole process, the open one is only
+    # there for the test
+    site = upstream.Upstream("webbook.nist.gov", breaker=upstream.CircuitBreaker(5, 30))
+    monkeypatch.setitem(upstream.upstreams, "webbook.nist.gov", site)
+    for _ in range(5):
+        site.error()
+    assert site.breaker.state == upstream.OPEN
+    return site
+
+
+def test_cached_response_leaves_an_open_breaker_open(open_breaker):
+    site = open_breaker
+    request = Request(URL, meta={"download_latency": 0.01})
+    response = Response(URL, status=200, request=request, flags=["cached"])
+
+    NistScraperDownloaderMiddleware().process_response(request, response, None)
+
+    assert site.breaker.state == upstream.OPEN
+    assert not site.available()
+
+
+def test_response_without_latency_is_not_counted(open_breaker):
+    site = open_breaker
+    request = Request(URL)
+    response = Response(URL, status=200, request=request)
+
+    NistScraperDownloaderMiddleware().process_response(request, response, None)
+
+    assert site.breaker.state == upstream.OPEN
+
+
+def test_downloaded_response_closes_a_half_open_breaker(open_breaker):
+    site = open_breaker
+    site.breaker.opened -= site.breaker.cooldown
+    assert site.acquire() == 0
+    request = Request(URL, meta={"download_latency": 0.01})
+    response = Response(URL, status=200, request=request)
+
+    NistScraperDownloaderMiddleware().process_response(request, response, None)
+
+    assert site.breaker.state == upstream.CLOSED
+
+
+def test_cached_response_is_not_counted_as_a_download():
+    request = Request(URL, meta={"download_latency": 0.01})
+    response = Response(URL, status=299, request=request, flags=["cached"])
+
+    NistScraperDownloaderMiddleware().process_response(request, response, None)
+
+    assert ("299",) not in metrics.download_responses.values
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # The reactor of the middleware and the clock of the breaker
+    clock = Clock()
+    monkeypatch.setattr(middlewares, "reactor", clock)
+    monkeypatch.setattr(upstream.time, "monotonic", clock.seconds)
+    return clock
+
+
+def test_bulk_crawl_waits_out_an_open_breaker(clock, monkeypatch):
+    site = upstream.Upstream("webbook.nist.gov", breaker=upstream.CircuitBreaker(5, 30))
+    monkeypatch.setitem(upstream.upstreams, "webbook.nist.gov", site)
+    for _ in range(5):
+        site.error()
+
+    results = []
+    waiting = NistScraperDownloaderMiddleware().process_request(Request(URL), None)
+    waiting.addBoth(results.append)
+    clock.advance(29)
+    assert results == []
+
+    # The cooldown is over, the request is the probe of the half open circuit
+    clock.advance(1)
+    assert results == [None]
+    assert site.breaker.state == upstream.HALF_OPEN
+
+
+def test_scrapyrt_crawl_fails_fast_on_an_open_breaker(clock, open_breaker):
+    with pytest.raises(upstream.UpstreamUnavailable):
+        NistScraperDownloaderMiddleware(fail_fast=True).process_request(Request(URL), None)
+
+
+def test_only_the_scrapyrt_crawls_fail_fast():
+    from scrapy.utils.project import get_project_settings
+    from nist_scraper.scrapyrt.manager import FailFastCrawlManager
+
+    assert not get_project_settings().getbool("UPSTREAM_FAIL_FAST")
+    manager = FailFastCrawlManager("webbook_nist", {})
+    assert manager.get_project_settings().getbool("UPSTREAM_FAIL_FAST")
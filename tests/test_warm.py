@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+
+from twisted.internet.task import Clock
+
+from nist_scraper.scrapyrt.warm import Job, WarmCrawler
+
+
+def test_timed_out_job_still_runs_its_callbacks():
+    clock = Clock()
+    warm = WarmCrawler("webbook_nist", timeout=1)
+    job = Job(0)
+    job.outstanding = 1
+    job.timeout = clock.callLater(warm.timeout, warm.timed_out, job)
+    warm.jobs[job.token] = job
+    failures = []
+    job.deferred.addErrback(failures.append)
+
+    clock.advance(1)
+    assert failures[0].value.status == "504"
+
+    # The last section page comes back after the timeout
+    pending = {0: "sections"}
+    def collect_section(response):
+        del pending[0]
+        yield {"cas": "7732185", "name": "water"}
+    response = SimpleNamespace(meta={"warm_job": job.token, "warm_callback": collect_section})
+
+    assert list(warm.callback(response)) == [{"cas": "7732185", "name": "water"}]
+    assert pending == {}
+    assert warm.jobs == {}